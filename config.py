@@ -41,6 +41,8 @@ class Config:
     'partners': int(os.getenv("PARTNERS_ID", "-1002919380244")),
     'budapest_people': int(os.getenv("BUDAPEST_PEOPLE_ID", "-1003114019170")),  # НОВОЕ
      }  # НОВОЕ
+    STATS_CONCURRENCY = int(os.getenv("STATS_CONCURRENCY", "4"))  # одновременных запросов к API
+    STATS_CALL_TIMEOUT = float(os.getenv("STATS_CALL_TIMEOUT", "5"))  # секунд на вызов API
     
     # Альтернативные каналы (если нужны)
     BUDAPEST_PLAY_ID = int(os.getenv("BUDAPEST_PLAY_ID", "0"))  # 🐦‍🔥 BUDAPEST PLAY
@@ -81,6 +83,64 @@ class Config:
     # НОВОЕ: Теперь используется STATS_TIMES_BUDAPEST вместо интервала
     STATS_INTERVAL_HOURS = int(os.getenv("STATS_INTERVAL_HOURS", "8"))  # Резервный параметр
     
+    # Write-behind счётчиков активности: сброс в БД раз в N секунд или каждые M событий
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+    ACTIVITY_FLUSH_MAX_EVENTS = int(os.getenv("ACTIVITY_FLUSH_MAX_EVENTS", "500"))
+    
+    # Планировщик: запуск, опоздавший больше чем на N секунд (например, во время простоя), пропускается
+    SCHEDULER_MISFIRE_GRACE = float(os.getenv("SCHEDULER_MISFIRE_GRACE", "300"))
+    # Сколько просроченных подтверждений TrixActivity выплачивать одной транзакцией
+    TRIX_AUTO_CONFIRM_BATCH = int(os.getenv("TRIX_AUTO_CONFIRM_BATCH", "200"))
+    
+    # ============= ЛИМИТЫ TELEGRAM API =============
+    
+    TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))  # запросов в секунду на бота
+    TG_GROUP_RATE_PER_MIN = float(os.getenv("TG_GROUP_RATE_PER_MIN", "20"))  # сообщений в минуту на группу
+    TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))  # повторов при RetryAfter
+    
+    # ============= АНТИ-ФЛУД =============
+    
+    ANTIFLOOD_ENABLED = os.getenv("ANTIFLOOD_ENABLED", "true").lower() == "true"
+    FLOOD_COMMANDS_PER_MIN = float(os.getenv("FLOOD_COMMANDS_PER_MIN", "20"))
+    FLOOD_COMMAND_BURST = int(os.getenv("FLOOD_COMMAND_BURST", "5"))
+    FLOOD_CALLBACKS_PER_MIN = float(os.getenv("FLOOD_CALLBACKS_PER_MIN", "60"))
+    FLOOD_CALLBACK_BURST = int(os.getenv("FLOOD_CALLBACK_BURST", "10"))
+    FLOOD_MEDIA_PER_MIN = float(os.getenv("FLOOD_MEDIA_PER_MIN", "30"))
+    FLOOD_MEDIA_BURST = int(os.getenv("FLOOD_MEDIA_BURST", "12"))  # альбом до 10 файлов
+    
+    # ============= КЭШ =============
+    
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(16 * 1024 * 1024)))  # примерный размер
+    CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "300"))  # секунд
+    CACHE_NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL", "30"))  # секунд для "не найдено"
+    CHAT_INFO_CACHE_TTL = float(os.getenv("CHAT_INFO_CACHE_TTL", "3600"))  # название/тип чата
+    MEMBER_COUNT_CACHE_TTL = float(os.getenv("MEMBER_COUNT_CACHE_TTL", "60"))
+    
+    # ============= ВРЕМЕННЫЕ РЯДЫ СТАТИСТИКИ =============
+    
+    TIMESERIES_FLUSH_INTERVAL = float(os.getenv("TIMESERIES_FLUSH_INTERVAL", "30"))  # секунд
+    TIMESERIES_MAX_PENDING = int(os.getenv("TIMESERIES_MAX_PENDING", "2000"))  # минутных агрегатов до досрочного сброса
+    TIMESERIES_MINUTE_RETENTION_DAYS = int(os.getenv("TIMESERIES_MINUTE_RETENTION_DAYS", "2"))
+    TIMESERIES_HOUR_RETENTION_DAYS = int(os.getenv("TIMESERIES_HOUR_RETENTION_DAYS", "90"))
+    TIMESERIES_DAY_RETENTION_DAYS = int(os.getenv("TIMESERIES_DAY_RETENTION_DAYS", "730"))
+    
+    # ============= TRIXACTIVITY: ЖУРНАЛ ТРИКСИКОВ =============
+    
+    TRIX_LEDGER_COMMIT_DELAY = float(os.getenv("TRIX_LEDGER_COMMIT_DELAY", "0.05"))  # окно group commit, секунд
+    TRIX_SNAPSHOT_EVERY = int(os.getenv("TRIX_SNAPSHOT_EVERY", "1000"))  # проводок между снимками балансов
+    
+    # ============= СТАТИСТИКА SQL =============
+    
+    QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "true").lower() == "true"
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # порог лога медленных запросов
+    
+    # ============= РАССЫЛКА =============
+    
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # сообщений в секунду
+    BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # секунд
+    
     # ============= СООБЩЕНИЯ ПО УМОЛЧАНИЮ =============
     
     DEFAULT_SIGNATURE = os.getenv("DEFAULT_SIGNATURE", "🤖 @TrixLiveBot - Ваш гид по Будапешту")
@@ -102,6 +162,9 @@ class Config:
         "shorturl.at", "ow.ly", "is.gd", "buff.ly"
     ]
     
+    # JSON с banned_domains / spam_patterns - перечитывается при изменении без перезапуска
+    FILTER_RULES_FILE = os.getenv("FILTER_RULES_FILE", "")
+    
     # ============= МЕТОДЫ КЛАССА =============
     
     @classmethod
@@ -185,7 +248,7 @@ if __name__ != "__main__":
             logger.warning(f"  {error}")
     else:
         logger.info("✅ Конфигурация валидна")
-        ```python
+
 # ============= TRIXACTIVITY НАСТРОЙКИ =============
 
 # Chat ID для Budapest People 
@@ -203,6 +266,3 @@ TRIXIKI_PRICES = {
     'comment': 4,
     'follow': 5
 }
-```
-
----
@@ -2,8 +2,11 @@
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 
-# Хранилище данных пользователей
-user_data: Dict[int, Dict] = {}
+from services.user_store import user_store
+from services.cache_service import cache_service, cached
+
+# Хранилище данных пользователей (кэш user_store, индексы ведёт user_store)
+user_data: Dict[int, Dict] = user_store.users
 
 # Участники розыгрыша
 lottery_participants: Dict[int, Dict] = {}
@@ -11,147 +14,101 @@ lottery_participants: Dict[int, Dict] = {}
 # Состояния ожидания (для ссылок и других команд)
 waiting_users: Dict[int, Dict] = {}
 
-def update_user_activity(user_id: int, username: Optional[str] = None):
+def update_user_activity(user_id: int, username: Optional[str] = None, count: int = 1):
     """Обновить активность пользователя"""
-    if user_id not in user_data:
-        user_data[user_id] = {
-            'id': user_id,
-            'username': username or f"user_{user_id}",
-            'join_date': datetime.now(),
-            'last_activity': datetime.now(),
-            'message_count': 0,
-            'banned': False,
-            'ban_reason': None,
-            'banned_at': None,
-            'muted_until': None
-        }
-    else:
-        user_data[user_id]['last_activity'] = datetime.now()
-        if username:
-            user_data[user_id]['username'] = username
-    
-    user_data[user_id]['message_count'] += 1
+    user_store.touch(user_id, username, count)
 
 def get_user_by_id(user_id: int) -> Optional[Dict]:
     """Получить данные пользователя по ID"""
-    return user_data.get(user_id)
+    return user_store.get(user_id)
 
 def get_user_by_username(username: str) -> Optional[Dict]:
     """Получить данные пользователя по username"""
-    username = username.lower().lstrip('@')
-    for user in user_data.values():
-        if user['username'].lower() == username:
-            return user
-    return None
+    return user_store.get_by_username(username)
 
 def ban_user(user_id: int, reason: str = "Не указана"):
     """Забанить пользователя"""
-    if user_id in user_data:
-        user_data[user_id]['banned'] = True
-        user_data[user_id]['ban_reason'] = reason
-        user_data[user_id]['banned_at'] = datetime.now()
+    user_store.ban(user_id, reason)
 
 def unban_user(user_id: int):
     """Разбанить пользователя"""
-    if user_id in user_data:
-        user_data[user_id]['banned'] = False
-        user_data[user_id]['ban_reason'] = None
-        user_data[user_id]['banned_at'] = None
+    user_store.unban(user_id)
 
 def mute_user(user_id: int, until: datetime):
     """Замутить пользователя до определённого времени"""
-    if user_id in user_data:
-        user_data[user_id]['muted_until'] = until
+    user_store.mute(user_id, until)
 
 def unmute_user(user_id: int):
     """Размутить пользователя"""
-    if user_id in user_data:
-        user_data[user_id]['muted_until'] = None
+    user_store.unmute(user_id)
 
 def is_user_banned(user_id: int) -> bool:
     """Проверить, забанен ли пользователь"""
-    if user_id not in user_data:
-        return False
-    return user_data[user_id].get('banned', False)
+    return user_store.is_banned(user_id)
 
 def is_user_muted(user_id: int) -> bool:
     """Проверить, замучен ли пользователь"""
-    if user_id not in user_data:
-        return False
-    
-    muted_until = user_data[user_id].get('muted_until')
-    if not muted_until:
-        return False
-    
-    # Если время мута истекло, автоматически размучиваем
-    if datetime.now() > muted_until:
-        unmute_user(user_id)
-        return False
-    
-    return True
+    # Если время мута истекло, user_store автоматически размучивает
+    return user_store.is_muted(user_id)
 
 def get_banned_users() -> List[Dict]:
     """Получить список всех забаненных пользователей"""
-    return [
-        user for user in user_data.values()
-        if user.get('banned', False)
-    ]
+    return user_store.banned_users()
 
 def get_muted_users() -> List[Dict]:
     """Получить список всех замученных пользователей"""
-    return [
-        user for user in user_data.values()
-        if user.get('muted_until') and user['muted_until'] > datetime.now()
-    ]
+    return user_store.muted_users()
 
 def get_top_users(limit: int = 10) -> List[Dict]:
     """Получить топ пользователей по количеству сообщений"""
-    sorted_users = sorted(
-        user_data.values(),
-        key=lambda x: x['message_count'],
-        reverse=True
-    )
-    return sorted_users[:limit]
+    return user_store.top(limit)
 
 def get_active_users(hours: int = 24) -> List[Dict]:
     """Получить активных пользователей за последние N часов"""
     threshold = datetime.now() - timedelta(hours=hours)
-    return [
-        user for user in user_data.values()
-        if user['last_activity'] > threshold
-    ]
+    return user_store.active_since(threshold)
 
 def get_user_stats() -> Dict:
     """Получить общую статистику пользователей"""
-    total_users = len(user_data)
-    active_24h = len(get_active_users(24))
-    active_7d = len(get_active_users(168))
-    total_messages = sum(user['message_count'] for user in user_data.values())
-    banned_count = len(get_banned_users())
-    muted_count = len(get_muted_users())
-    
-    return {
-        'total_users': total_users,
-        'active_24h': active_24h,
-        'active_7d': active_7d,
-        'total_messages': total_messages,
-        'banned_count': banned_count,
-        'muted_count': muted_count,
-        'avg_messages': total_messages // total_users if total_users > 0 else 0
-    }
+    return user_store.summary()
 
 def clean_old_data(days: int = 90):
     """Очистить данные о пользователях, неактивных более N дней"""
     threshold = datetime.now() - timedelta(days=days)
-    to_remove = [
-        user_id for user_id, data in user_data.items()
-        if data['last_activity'] < threshold and not data.get('banned')
-    ]
+    return user_store.remove_inactive(threshold)
+
+def _user_row_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+@cached(key=_user_row_key)
+async def get_user_row(user_id: int) -> Optional[Dict]:
+    """Строка users из БД (кэшируется, в т.ч. отсутствие пользователя)"""
+    from services.db import db
+    from models import User
+    from sqlalchemy import select
+    
+    if not db.session_maker:
+        return None
+    
+    async with db.get_session() as session:
+        result = await session.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
     
-    for user_id in to_remove:
-        del user_data[user_id]
+    if not user:
+        return None
     
-    return len(to_remove)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'referral_code': user.referral_code,
+        'created_at': user.created_at
+    }
+
+async def invalidate_user_row(user_id: int):
+    """Сбросить кэш строки пользователя после изменения в БД"""
+    await cache_service.delete(_user_row_key(user_id))
 
 # Экспорт всех функций и переменных
 __all__ = [
@@ -172,5 +129,7 @@ __all__ = [
     'get_top_users',
     'get_active_users',
     'get_user_stats',
-    'clean_old_data'
+    'clean_old_data',
+    'get_user_row',
+    'invalidate_user_row'
 ]
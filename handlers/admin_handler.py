@@ -5,6 +5,7 @@ from telegram.ext import ContextTypes
 from config import Config
 from services.admin_notifications import admin_notifications
 from data.user_data import user_data
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -51,14 +52,11 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===============================
 # Обработка callback'ов админ-панели
 # ===============================
-async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback для админ-панели"""
+async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str = None):
+    """Обработчик callback для админ-панели (admin:<action>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     if action == "broadcast":
         await show_broadcast_info(query, context)
     
@@ -142,32 +140,20 @@ async def execute_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Текст рассылки не найден. Попробуйте снова.")
         return
 
-    await query.edit_message_text("📢 Начинаю рассылку...")
-
-    sent_count = 0
-    failed_count = 0
-
-    for user_id in user_data.keys():
-        try:
-            await context.bot.send_message(chat_id=user_id, text=broadcast_text)
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to {user_id}: {e}")
-            failed_count += 1
+    from services.broadcast_service import broadcast_service
 
-    await admin_notifications.notify_broadcast(
-        sent=sent_count,
-        failed=failed_count,
-        moderator=query.from_user.username or str(query.from_user.id)
-    )
+    await query.edit_message_text("📢 Начинаю рассылку...")
 
-    result_text = (
-        f"✅ **Рассылка завершена!**\n\n"
-        f"📤 Отправлено: {sent_count}\n"
-        f"❌ Не удалось: {failed_count}"
+    # Рассылка идёт в фоне, прогресс обновляется в этом же сообщении
+    job_id = await broadcast_service.start(
+        text=broadcast_text,
+        recipients=list(user_data.keys()),
+        moderator=query.from_user.username or str(query.from_user.id),
+        admin_chat_id=query.message.chat_id,
+        status_message_id=query.message.message_id
     )
 
-    await query.edit_message_text(result_text, parse_mode='Markdown')
+    logger.info(f"Broadcast #{job_id} started by {query.from_user.id}")
     context.user_data.pop('broadcast_text', None)
 
 
@@ -393,6 +379,26 @@ async def sendstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error sending stats: {e}")
         await update.message.reply_text(f"❌ Ошибка при отправке статистики: {e}")
 
+async def dbstats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Буфер активности и топ SQL-запросов по суммарному времени (/dbstats [N] | /dbstats reset)"""
+    if not Config.is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для использования этой команды")
+        return
+    
+    from services.query_stats import query_stats
+    from services.activity_buffer import activity_buffer
+    
+    if context.args and context.args[0] == 'reset':
+        query_stats.reset()
+        await update.message.reply_text("✅ Статистика SQL сброшена")
+        return
+    
+    limit = int(context.args[0]) if context.args and context.args[0].isdigit() else 10
+    text = activity_buffer.format_report() + "\n" + query_stats.format_report(min(limit, 20))
+    
+    # Отчёт без Markdown: в тексте запросов есть * и _
+    await update.message.reply_text(text[:Config.MAX_MESSAGE_LENGTH])
+
 
 # ===============================
 # Вспомогательные функции для показа разделов
@@ -421,17 +427,11 @@ async def show_broadcast_info(query, context):
 async def show_stats(query, context):
     """Показать статистику"""
     from data.games_data import word_games, roll_games
-    from datetime import datetime, timedelta
+    from data.user_data import get_user_stats
     
-    total_users = len(user_data)
-    active_24h = sum(1 for data in user_data.values() if 
-                    datetime.now() - data['last_activity'] <= timedelta(days=1))
-    active_7d = sum(1 for data in user_data.values() if 
-                   datetime.now() - data['last_activity'] <= timedelta(days=7))
-    total_messages = sum(data['message_count'] for data in user_data.values())
-    banned_count = sum(1 for data in user_data.values() if data.get('banned'))
-    muted_count = sum(1 for data in user_data.values() if 
-                     data.get('muted_until') and data['muted_until'] > datetime.now())
+    stats = get_user_stats()
+    total_users = stats['total_users']
+    total_messages = stats['total_messages']
     
     games_stats = ""
     for version in ['need', 'try', 'more']:
@@ -445,14 +445,14 @@ async def show_stats(query, context):
         f"📊 **СТАТИСТИКА БОТА**\n\n"
         f"👥 **Пользователи:**\n"
         f"• Всего: {total_users}\n"
-        f"• Активных за 24ч: {active_24h}\n"
-        f"• Активных за 7д: {active_7d}\n\n"
+        f"• Активных за 24ч: {stats['active_24h']}\n"
+        f"• Активных за 7д: {stats['active_7d']}\n\n"
         f"💬 **Сообщения:**\n"
         f"• Всего: {total_messages}\n"
-        f"• Среднее на пользователя: {total_messages // total_users if total_users > 0 else 0}\n\n"
+        f"• Среднее на пользователя: {stats['avg_messages']}\n\n"
         f"🔨 **Модерация:**\n"
-        f"• Забанено: {banned_count}\n"
-        f"• В муте: {muted_count}\n\n"
+        f"• Забанено: {stats['banned_count']}\n"
+        f"• В муте: {stats['muted_count']}\n\n"
         f"🎮 **Игры:**{games_stats}\n\n"
         f"📈 Используйте `/sendstats` для отправки в админскую группу"
     )
@@ -471,12 +471,11 @@ async def show_stats(query, context):
 
 async def show_users_info(query, context):
     """Показать информацию о пользователях"""
-    from data.user_data import get_top_users
-    from datetime import datetime, timedelta
+    from data.user_data import get_top_users, get_user_stats
     
-    total_users = len(user_data)
-    active_today = sum(1 for data in user_data.values() if 
-                      datetime.now() - data['last_activity'] <= timedelta(hours=24))
+    stats = get_user_stats()
+    total_users = stats['total_users']
+    active_today = stats['active_24h']
     
     top_users = get_top_users(5)
     top_text = "\n".join([
@@ -613,6 +612,7 @@ async def show_logs(query, context):
         "**Основные команды для мониторинга:**\n"
         "• `/stats` - статистика\n"
         "• `/sendstats` - отправить в админскую группу\n"
+        "• `/dbstats` - буфер активности и самые долгие SQL-запросы\n"
         "• `/banlist` - список забаненных\n"
         "• `/top` - топ пользователей"
     )
@@ -668,11 +668,15 @@ async def show_admin_help(query, context):
 # ===============================
 # Экспорт функций
 # ===============================
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('admin', handle_admin_callback, str)
+
 __all__ = [
     'admin_command',
     'execute_broadcast',
     'say_command',
     'broadcast_command',
     'sendstats_command',
+    'dbstats_command',
     'handle_admin_callback'
 ]
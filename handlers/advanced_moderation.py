@@ -3,14 +3,23 @@ from telegram.ext import ContextTypes
 from config import Config
 from data.user_data import user_data, get_user_by_username, get_user_by_id
 from utils.validators import parse_time
+from services.telegram_scheduler import bulk_priority
+from services.expiring_store import expiring_store, SLOWMODE, SLOWMODE_USER, LOCKDOWN
 from datetime import datetime, timedelta
 import logging
 import asyncio
 
 logger = logging.getLogger(__name__)
 
-# Хранилище задач lockdown
-lockdown_tasks = {}
+# Фоновые задачи purge по чатам
+purge_tasks = {}
+
+# deleteMessages принимает до 100 ID за вызов
+PURGE_BATCH_SIZE = 100
+# Параллельных одиночных удалений, если deleteMessages недоступен
+PURGE_CONCURRENCY = 10
+# Как часто обновлять сообщение с прогрессом (секунд)
+PURGE_PROGRESS_INTERVAL = 2
 
 async def del_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Удалить сообщение (реплай)"""
@@ -46,32 +55,92 @@ async def purge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❌ Ответьте на сообщение, с которого начать удаление")
         return
     
+    chat_id = update.effective_chat.id
+    
+    task = purge_tasks.get(chat_id)
+    if task and not task.done():
+        await update.message.reply_text("⏳ Удаление в этом чате уже идёт")
+        return
+    
     try:
         start_id = update.message.reply_to_message.message_id
         end_id = update.message.message_id
-        chat_id = update.effective_chat.id
+        message_ids = list(range(start_id, end_id + 1))
         
-        deleted_count = 0
-        for msg_id in range(start_id, end_id + 1):
-            try:
-                await context.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                deleted_count += 1
-                await asyncio.sleep(0.1)  # Небольшая задержка
-            except:
-                continue
+        progress_msg = await update.message.reply_text(f"🧹 Удаление {len(message_ids)} сообщений...")
         
-        # Отправляем результат и удаляем через 5 секунд
-        result_msg = await update.message.reply_text(f"✅ Удалено {deleted_count} сообщений")
-        await asyncio.sleep(5)
-        await result_msg.delete()
-        
-        logger.info(f"Purged {deleted_count} messages by {update.effective_user.id}")
+        # Удаление идёт в фоне, обработчик не блокируется
+        purge_tasks[chat_id] = asyncio.create_task(
+            run_purge(context.bot, chat_id, message_ids, progress_msg, update.effective_user.id)
+        )
         
     except Exception as e:
         logger.error(f"Error in purge command: {e}")
         if update.effective_chat.type == 'private':
             await update.message.reply_text("❌ Ошибка массового удаления")
 
+async def _delete_batch(bot, chat_id: int, message_ids: list, semaphore: asyncio.Semaphore) -> int:
+    """Удалить пачку сообщений, вернуть количество удалённых"""
+    # deleteMessages (Bot API 7.0+) - одним запросом до 100 сообщений
+    if hasattr(bot, 'delete_messages'):
+        try:
+            async with semaphore:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+            return len(message_ids)
+        except Exception as e:
+            logger.warning(f"deleteMessages failed, falling back to single deletes: {e}")
+    
+    async def delete_one(msg_id: int) -> bool:
+        async with semaphore:
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+                return True
+            except Exception:
+                return False
+    
+    results = await asyncio.gather(*(delete_one(msg_id) for msg_id in message_ids))
+    return sum(results)
+
+async def run_purge(bot, chat_id: int, message_ids: list, progress_msg, admin_id: int):
+    """Фоновое удаление сообщений с прогрессом"""
+    total = len(message_ids)
+    deleted_count = 0
+    processed = 0
+    started = datetime.now()
+    last_report = started
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+    
+    try:
+        # Темп удаления задаёт планировщик исходящих запросов
+        with bulk_priority():
+            for i in range(0, total, PURGE_BATCH_SIZE):
+                batch = message_ids[i:i + PURGE_BATCH_SIZE]
+                deleted_count += await _delete_batch(bot, chat_id, batch, semaphore)
+                processed += len(batch)
+                
+                now = datetime.now()
+                if processed < total and (now - last_report).total_seconds() >= PURGE_PROGRESS_INTERVAL:
+                    last_report = now
+                    try:
+                        await progress_msg.edit_text(
+                            f"🧹 Удаление: {processed}/{total} ({processed * 100 // total}%)"
+                        )
+                    except Exception:
+                        pass
+        
+        elapsed = (datetime.now() - started).total_seconds()
+        logger.info(f"Purged {deleted_count}/{total} messages in {elapsed:.1f}s by {admin_id}")
+        
+        # Показываем результат и удаляем через 5 секунд
+        await progress_msg.edit_text(f"✅ Удалено {deleted_count} сообщений")
+        await asyncio.sleep(5)
+        await progress_msg.delete()
+        
+    except Exception as e:
+        logger.error(f"Error in purge task: {e}")
+    finally:
+        purge_tasks.pop(chat_id, None)
+
 async def slowmode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Включить медленный режим"""
     if not Config.is_admin(update.effective_user.id):
@@ -105,6 +174,12 @@ async def slowmode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         )
         
+        # Интервал хранится в expiring_store и переживает перезапуск
+        if seconds > 0:
+            expiring_store.set(SLOWMODE, update.effective_chat.id, value=seconds)
+        else:
+            expiring_store.delete(SLOWMODE, update.effective_chat.id)
+        
         if seconds > 0:
             await update.message.reply_text(
                 f"🐌 **Медленный режим включен**: {seconds} секунд между сообщениями",
@@ -142,6 +217,7 @@ async def noslowmode_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 can_invite_users=True
             )
         )
+        expiring_store.delete(SLOWMODE, update.effective_chat.id)
         await update.message.reply_text("✅ **Медленный режим отключен**", parse_mode='Markdown')
         logger.info(f"Slowmode disabled by {update.effective_user.id}")
         
@@ -174,10 +250,8 @@ async def lockdown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     
     if context.args[0].lower() == 'off':
-        # Отменяем задачу если есть
-        if chat_id in lockdown_tasks:
-            lockdown_tasks[chat_id].cancel()
-            del lockdown_tasks[chat_id]
+        # Снимаем таймер автоматической разблокировки
+        expiring_store.delete(LOCKDOWN, chat_id)
         
         try:
             await context.bot.set_chat_permissions(
@@ -221,43 +295,58 @@ async def lockdown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"Lockdown enabled for {minutes}m by {update.effective_user.id}")
         
-        # Создаем задачу для автоматической разблокировки
-        async def unlock_after_delay():
-            try:
-                await asyncio.sleep(time_seconds)
-                await context.bot.set_chat_permissions(
-                    chat_id=chat_id,
-                    permissions=ChatPermissions(
-                        can_send_messages=True,
-                        can_send_media_messages=True,
-                        can_send_polls=True,
-                        can_send_other_messages=True
-                    )
-                )
-                await context.bot.send_message(
-                    chat_id=chat_id,
-                    text="🔓 **Блокировка автоматически снята**",
-                    parse_mode='Markdown'
-                )
-                if chat_id in lockdown_tasks:
-                    del lockdown_tasks[chat_id]
-                logger.info(f"Lockdown auto-disabled for chat {chat_id}")
-            except asyncio.CancelledError:
-                logger.info(f"Lockdown task cancelled for chat {chat_id}")
-            except Exception as e:
-                logger.error(f"Error in lockdown auto-unlock: {e}")
-        
-        # Отменяем предыдущую задачу если есть
-        if chat_id in lockdown_tasks:
-            lockdown_tasks[chat_id].cancel()
-        
-        # Запускаем новую задачу
-        lockdown_tasks[chat_id] = asyncio.create_task(unlock_after_delay())
+        # Автоматическая разблокировка - по сроку в expiring_store (переживает перезапуск)
+        expiring_store.set(LOCKDOWN, chat_id, ttl=time_seconds)
         
     except Exception as e:
         logger.error(f"Error in lockdown: {e}")
         await update.message.reply_text(f"❌ Ошибка блокировки чата: {e}")
 
+async def _unlock_chat(chat_id: int, value):
+    """Срок блокировки истёк - возвращаем права участникам"""
+    bot = expiring_store.bot
+    if not bot:
+        logger.warning(f"Bot not set, cannot auto-unlock chat {chat_id}")
+        return
+    
+    await bot.set_chat_permissions(
+        chat_id=chat_id,
+        permissions=ChatPermissions(
+            can_send_messages=True,
+            can_send_media_messages=True,
+            can_send_polls=True,
+            can_send_other_messages=True
+        )
+    )
+    await bot.send_message(
+        chat_id=chat_id,
+        text="🔓 **Блокировка автоматически снята**",
+        parse_mode='Markdown'
+    )
+    logger.info(f"Lockdown auto-disabled for chat {chat_id}")
+
+async def enforce_slowmode(update: Update) -> bool:
+    """Удалить сообщение, если в чате медленный режим и интервал не прошёл (True - удалено)"""
+    chat_id = update.effective_chat.id
+    seconds = expiring_store.get(SLOWMODE, chat_id)
+    if not seconds:
+        return False
+    
+    user_id = update.effective_user.id
+    if Config.is_moderator(user_id):
+        return False
+    
+    key = (chat_id, user_id)
+    if expiring_store.contains(SLOWMODE_USER, key):
+        try:
+            await update.message.delete()
+        except Exception as e:
+            logger.warning(f"Could not delete slowmode message: {e}")
+        return True
+    
+    expiring_store.set(SLOWMODE_USER, key, ttl=seconds)
+    return False
+
 async def antiinvite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Включить/выключить защиту от ссылок-приглашений"""
     if not Config.is_admin(update.effective_user.id):
@@ -318,9 +407,10 @@ async def tagall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(f"📢 **{message}**", parse_mode='Markdown')
     
-    for chunk in chunks:
-        await update.message.reply_text(" ".join(chunk))
-        await asyncio.sleep(1)  # Задержка между сообщениями
+    # Лимит сообщений в группу соблюдает планировщик исходящих запросов
+    with bulk_priority():
+        for chunk in chunks:
+            await update.message.reply_text(" ".join(chunk))
     
     logger.info(f"Tagall used by {update.effective_user.id}, tagged {len(active_users)} users")
 
@@ -351,3 +441,8 @@ async def admins_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 text += f"• ID: {mod_id}\n"
     
     await update.message.reply_text(text, parse_mode='Markdown')
+
+# Сроки ограничений чатов
+expiring_store.register(SLOWMODE)
+expiring_store.register(SLOWMODE_USER, persist=False)
+expiring_store.register(LOCKDOWN, on_expire=_unlock_chat)
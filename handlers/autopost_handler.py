@@ -67,11 +67,18 @@ async def autopost_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         time_str = context.args[1]  # Например: 12:00
         message = ' '.join(context.args[2:]).strip('"')
         
-        # TODO: Реализовать планирование по времени
+        try:
+            hour, minute = map(int, time_str.split(':'))
+            chat_id = autopost_service.data['target_chat_id'] or Config.MODERATION_GROUP_ID
+            run_at = autopost_service.schedule_once(hour, minute, message, chat_id)
+        except ValueError:
+            await update.message.reply_text("❌ Время в формате ЧЧ:ММ, например 12:00")
+            return
+        
         await update.message.reply_text(
-            f"📅 **Планирование на {time_str}:**\n"
-            f"Сообщение: {message}\n\n"
-            f"⚠️ Функция планирования в разработке",
+            f"📅 **Запланировано на {run_at.strftime('%d.%m.%Y %H:%M')} (Будапешт):**\n"
+            f"Сообщение: {message}\n"
+            f"🎯 Чат ID: {chat_id}",
             parse_mode='Markdown'
         )
     
@@ -12,6 +12,7 @@ from data.games_data import (
     normalize_word, get_unique_roll_number
 )
 from data.user_data import update_user_activity, is_user_banned, is_user_muted
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -706,18 +707,13 @@ async def wordinfoedit_command(update: Update, context: ContextTypes.DEFAULT_TYP
     
     await update.message.reply_text(f"✅ Описание изменено [{game_version.upper()}]:\n\n{new_description}")
 
-async def handle_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка callback для игр"""
+async def handle_game_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               action: str = None, game_version: str = None, word: str = None):
+    """Обработка callback для игр (game:<action>:<version>:<word>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     if action == "skip_media":
-        game_version = data[2] if len(data) > 2 else None
-        word = data[3] if len(data) > 3 else None
-        
         user_id = update.effective_user.id
         if user_id in game_waiting:
             game_waiting.pop(user_id)
@@ -729,9 +725,6 @@ async def handle_game_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         )
     
     elif action == "finish":
-        game_version = data[2] if len(data) > 2 else None
-        word = data[3] if len(data) > 3 else None
-        
         user_id = update.effective_user.id
         if user_id in game_waiting:
             game_waiting.pop(user_id)
@@ -753,6 +746,9 @@ async def wordclear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Например: /needguide, /tryguide, /moreguide для справки"
     )
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('game', handle_game_callback, str, str, str)
+
 __all__ = [
     'wordadd_command',
     'wordedit_command',
@@ -4,6 +4,7 @@ from telegram.ext import ContextTypes
 from config import Config
 import logging
 from datetime import datetime
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -170,15 +171,12 @@ async def show_monthly_menu(query, context):
         parse_mode='Markdown'
     )
 
-async def handle_giveaway_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback для розыгрышей"""
+async def handle_giveaway_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                   action: str = None, section: str = None):
+    """Обработчик callback для розыгрышей (giveaway:<action>[:<section>])"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    section = data[2] if len(data) > 2 else None
-    
     if action == "daily":
         await show_daily_menu(query, context)
     elif action == "weekly":
@@ -367,6 +365,9 @@ async def add_giveaway_record(section: str, winner: str, prize: str, status: str
     return True
 
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('giveaway', handle_giveaway_callback, str, str)
+
 __all__ = [
     'giveaway_command',
     'handle_giveaway_callback',
@@ -3,6 +3,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import Config
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -68,14 +69,11 @@ async def trix_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-async def handle_trix_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback для команды /trix"""
+async def handle_trix_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, section: str = None):
+    """Обработчик callback для команды /trix (trix:<section>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    section = data[1] if len(data) > 1 else None
-    
     user_id = update.effective_user.id
     is_admin = Config.is_admin(user_id)
     is_moderator = Config.is_moderator(user_id)
@@ -325,6 +323,7 @@ async def show_stats_commands(update: Update, context: ContextTypes.DEFAULT_TYPE
         
         "**Базовая статистика:**\n"
         "`/sendstats` - Отправить статистику сейчас\n"
+        "`/dbstats` N - Топ N SQL-запросов по времени\n"
         "`/stats` - Статистика бота\n"
         "`/top` N - Топ N пользователей\n\n"
         
@@ -411,6 +410,9 @@ async def show_main_trix_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode='Markdown'
     )
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('trix', handle_trix_callback, str)
+
 __all__ = [
     'trix_command',
     'handle_trix_callback'
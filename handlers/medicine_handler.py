@@ -1,6 +1,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -147,14 +148,11 @@ async def hp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-async def handle_hp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка callback для медикаментов"""
+async def handle_hp_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, category: str = None):
+    """Обработка callback для медикаментов (hp:<category>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    category = data[1] if len(data) > 1 else None
-    
     if category == "all":
         await show_all_medicines(update, context)
     elif category in MEDICINE_DATA:
@@ -299,3 +297,6 @@ async def show_medicine_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='Markdown'
         )
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('hp', handle_hp_callback, str)
@@ -2,17 +2,15 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import Config
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
-async def handle_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle menu callbacks"""
+async def handle_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str = None):
+    """Handle menu callbacks (menu:<action>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     logger.info(f"Menu callback action: {action}")
     
     if action == "write":
@@ -230,3 +228,6 @@ async def start_category_post(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception as e:
         logger.error(f"Error in start_category_post: {e}")
         await update.callback_query.answer("Ошибка. Попробуйте позже", show_alert=True)
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('menu', handle_menu_callback, str)
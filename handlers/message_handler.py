@@ -3,7 +3,7 @@ from telegram.ext import ContextTypes
 from config import Config
 from data.user_data import (
     update_user_activity, is_user_banned, is_user_muted, 
-    waiting_users, user_data
+    waiting_users
 )
 from data.links_data import add_link, edit_link
 from data.games_data import word_games
@@ -169,10 +169,8 @@ async def handle_media_messages(update: Update, context: ContextTypes.DEFAULT_TY
     """Обработка медиа сообщений"""
     user_id = update.effective_user.id
     
-    # Обновляем активность пользователя (медиа = больше XP)
-    update_user_activity(user_id, update.effective_user.username)
-    if user_id in user_data:
-        user_data[user_id]['message_count'] += 1  # Дополнительный счетчик для медиа
+    # Обновляем активность пользователя (медиа = больше XP, засчитывается дважды)
+    update_user_activity(user_id, update.effective_user.username, count=2)
     
     # Проверяем бан и мут
     if is_user_banned(user_id):
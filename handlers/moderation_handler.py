@@ -11,13 +11,15 @@ from services.admin_notifications import admin_notifications
 from utils.validators import parse_time
 from datetime import datetime, timedelta
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
 # ============= CALLBACK HANDLERS =============
 
-async def handle_moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle moderation callbacks"""
+async def handle_moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     action: str = None, post_id: int = None):
+    """Handle moderation callbacks (mod:<action>:<post_id>)"""
     query = update.callback_query
     user_id = update.effective_user.id
     
@@ -29,10 +31,6 @@ async def handle_moderation_callback(update: Update, context: ContextTypes.DEFAU
     
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    post_id = int(data[2]) if len(data) > 2 and data[2].isdigit() else None
-    
     logger.info(f"Action: {action}, Post ID: {post_id}")
     
     if not post_id:
@@ -517,3 +515,6 @@ async def lastseen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     last = user_data['last_activity'].strftime('%d.%m.%Y %H:%M')
     await update.message.reply_text(f"⏰ @{username}\n{last}")
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('mod', handle_moderation_callback, str, int)
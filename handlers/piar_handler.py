@@ -2,9 +2,14 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMe
 from telegram.ext import ContextTypes
 from config import Config
 from services.db import db
+from services.unit_of_work import unit_of_work
 from models import User, Post, PostStatus  # <-- ДОБАВИТЬ PostStatus
-from sqlalchemy import select
+from utils.media import send_media_groups
+from services.filter_service import filter_service
+from services.channel_stats import get_chat_cached
+import asyncio
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -71,14 +76,11 @@ PIAR_STEPS = [
         "💭 Начнем с описания ваших услуг. *Добавьте текст*:"
     )
 ]
-async def handle_piar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle piar callbacks"""
+async def handle_piar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str = None):
+    """Handle piar callbacks (piar:<action>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     if action == "preview":
         await show_piar_preview(update, context)
     elif action == "send":
@@ -352,21 +354,13 @@ async def show_piar_preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ИСПРАВЛЕНО: Сначала показываем медиа, если есть
     if data.get('media'):
         try:
-            for i, media_item in enumerate(data['media'][:3]):  # Показываем до 3 медиа
-                caption = None
-                if i == 0:  # Первое медиа с подписью
-                    caption = f"📷 Медиа файлы ({len(data['media'])} шт.)"
-                
-                if media_item.get('type') == 'photo':
-                    await update.effective_message.reply_photo(
-                        photo=media_item['file_id'],
-                        caption=caption
-                    )
-                elif media_item.get('type') == 'video':
-                    await update.effective_message.reply_video(
-                        video=media_item['file_id'],
-                        caption=caption
-                    )
+            # Показываем до 3 медиа одним альбомом
+            await send_media_groups(
+                context.bot,
+                update.effective_chat.id,
+                data['media'][:3],
+                caption=f"📷 Медиа файлы ({len(data['media'])} шт.)"
+            )
         except Exception as e:
             logger.error(f"Error showing piar media preview: {e}")
     
@@ -397,12 +391,9 @@ async def send_piar_to_moderation(update: Update, context: ContextTypes.DEFAULT_
             )
             return
         
-        async with db.get_session() as session:
-            # Get user
-            result = await session.execute(
-                select(User).where(User.id == user_id)
-            )
-            user = result.scalar_one_or_none()
+        # Одна сессия на обновление: пользователь, пост и moderation_message_id
+        async with unit_of_work() as uow:
+            user = await uow.get_user(user_id)
             
             if not user:
                 logger.warning(f"User {user_id} not found for piar")
@@ -436,16 +427,14 @@ async def send_piar_to_moderation(update: Update, context: ContextTypes.DEFAULT_
             
             # Create post
             post = Post(**post_data)
-            session.add(post)
-            await session.flush()
+            uow.add(post)
+            await uow.flush()
             
             post_id = post.id
             logger.info(f"Created piar post with ID: {post_id}")
             
-            await session.commit()
-            
-            # Refresh post
-            await session.refresh(post)
+            # Пост фиксируем до отправки модераторам (expire_on_commit=False - refresh не нужен)
+            await uow.commit()
             
             # Send to moderation group
             await send_piar_to_mod_group_safe(update, context, post, user, data)
@@ -541,6 +530,13 @@ async def send_piar_to_mod_group_safe(update: Update, context: ContextTypes.DEFA
         description += "..."
     text += f"\n📝 Описание:\n{escape_markdown(description)}"
     
+    # Ссылки в Каталоге разрешены - модераторам показываем только признаки спама
+    scan = filter_service.scan('\n'.join(
+        str(data.get(field) or '') for field in ('name', 'profession', 'price', 'description')
+    ))
+    if scan.is_spam:
+        text += f"\n\n🚩 Фильтр: {', '.join(scan.reasons)}"
+    
     # ИСПРАВЛЕННЫЕ КНОПКИ - убираем кнопку "Написать автору" которая вызывает ошибку
     keyboard = [
         [
@@ -552,7 +548,7 @@ async def send_piar_to_mod_group_safe(update: Update, context: ContextTypes.DEFA
     try:
         # Проверяем доступность группы модерации
         try:
-            await bot.get_chat(Config.MODERATION_GROUP_ID)
+            await get_chat_cached(bot, Config.MODERATION_GROUP_ID)
         except Exception as e:
             logger.error(f"Cannot access moderation group {Config.MODERATION_GROUP_ID}: {e}")
             await bot.send_message(
@@ -561,28 +557,15 @@ async def send_piar_to_mod_group_safe(update: Update, context: ContextTypes.DEFA
             )
             return
 
-        # Отправляем медиа с улучшенной обработкой ошибок
-        media_sent = []
+        # Медиа альбомами по 10, параллельно с основным сообщением
+        media_task = None
         if data.get('media') and len(data['media']) > 0:
-            for i, media_item in enumerate(data['media']):
-                try:
-                    if media_item.get('type') == 'photo':
-                        msg = await bot.send_photo(
-                            chat_id=Config.MODERATION_GROUP_ID,
-                            photo=media_item['file_id'],
-                            caption=f"📷 Медиа {i+1}/{len(data['media'])}"
-                        )
-                        media_sent.append(msg.message_id)
-                    elif media_item.get('type') == 'video':
-                        msg = await bot.send_video(
-                            chat_id=Config.MODERATION_GROUP_ID,
-                            video=media_item['file_id'],
-                            caption=f"🎥 Медиа {i+1}/{len(data['media'])}"
-                        )
-                        media_sent.append(msg.message_id)
-                except Exception as media_error:
-                    logger.error(f"Error sending piar media {i+1}: {media_error}")
-                    continue
+            media_task = asyncio.create_task(send_media_groups(
+                bot,
+                Config.MODERATION_GROUP_ID,
+                data['media'],
+                caption=f"📷 Медиа ({len(data['media'])})"
+            ))
         
         # Отправляем основное сообщение с кнопками БЕЗ parse_mode
         try:
@@ -595,18 +578,18 @@ async def send_piar_to_mod_group_safe(update: Update, context: ContextTypes.DEFA
             
             logger.info(f"Piar sent to moderation successfully. Post ID: {post.id}")
             
-            # Сохраняем ID сообщения безопасно
+            # Сохраняем ID сообщения в сессии обновления (commit - на выходе из unit of work)
             try:
-                from sqlalchemy import text as sql_text
-                async with db.get_session() as session:
-                    await session.execute(
-                        sql_text("UPDATE posts SET moderation_message_id = :msg_id WHERE id = :post_id"),
-                        {"msg_id": message.message_id, "post_id": int(post.id)}  # Используем int вместо str
-                    )
-                    await session.commit()
+                async with unit_of_work() as uow:
+                    post.moderation_message_id = message.message_id
+                    uow.add(post)
+                    await uow.flush()
             except Exception as save_error:
                 logger.error(f"Error saving moderation_message_id for piar: {save_error}")
             
+            if media_task:
+                await media_task
+            
         except Exception as text_error:
             logger.error(f"Error sending piar text message: {text_error}")
             raise text_error
@@ -697,3 +680,6 @@ async def cancel_piar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     from handlers.start_handler import show_main_menu
     await show_main_menu(update, context)
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('piar', handle_piar_callback, str)
@@ -1,6 +1,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -24,18 +25,11 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Пытаемся получить данные из БД, но не падаем если ошибка
     try:
-        from services.db import db
-        from models import User
-        from sqlalchemy import select
+        from data.user_data import get_user_row
         
-        async with db.get_session() as session:
-            result = await session.execute(
-                select(User).where(User.id == user.id)
-            )
-            db_user = result.scalar_one_or_none()
-            
-            if db_user:
-                profile_text += f"📅 Регистрация: {db_user.created_at.strftime('%d.%m.%Y')}\n"
+        db_user = await get_user_row(user.id)
+        if db_user and db_user['created_at']:
+            profile_text += f"📅 Регистрация: {db_user['created_at'].strftime('%d.%m.%Y')}\n"
             
     except Exception as e:
         logger.warning(f"Could not load profile data from DB: {e}")
@@ -70,3 +64,6 @@ async def handle_profile_callback(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
     
     await show_profile(update, context)
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('profile', handle_profile_callback)
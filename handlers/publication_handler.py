@@ -3,27 +3,28 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMe
 from telegram.ext import ContextTypes
 from config import Config
 from services.db import db
+from services.unit_of_work import unit_of_work
 from services.cooldown import CooldownService
 from services.hashtags import HashtagService
-from services.filter_service import FilterService
+from services.filter_service import filter_service
+from services.channel_stats import get_chat_cached
 from models import User, Post, PostStatus
-from sqlalchemy import select
 from datetime import datetime
+from utils.media import send_media_groups
+import asyncio
 import logging
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
-async def handle_publication_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle publication callbacks"""
+async def handle_publication_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                      action: str = None, subcategory: str = None):
+    """Handle publication callbacks (pub:<action>[:<subcategory>])"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     if action == "cat":
         # Subcategory selected
-        subcategory = data[2] if len(data) > 2 else None
         await start_post_creation(update, context, subcategory)
     elif action == "preview":
         await show_preview(update, context)
@@ -85,8 +86,8 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Если ждём текст поста
         if context.user_data.get('waiting_for') == 'post_text':
             # Проверяем на запрещённые ссылки
-            filter_service = FilterService()
-            if filter_service.contains_banned_link(text) and not Config.is_moderator(update.effective_user.id):
+            scan = filter_service.scan(text)
+            if scan.has_banned_link and not Config.is_moderator(update.effective_user.id):
                 await handle_link_violation(update, context)
                 return
             
@@ -95,6 +96,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 context.user_data['post_data'] = {}
             
             context.user_data['post_data']['text'] = text
+            context.user_data['post_data']['filter_reasons'] = scan.reasons
             context.user_data['post_data']['media'] = []
             
             # Сохраняем медиа
@@ -145,8 +147,8 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if waiting_for == 'post_text':
         # Check for links
-        filter_service = FilterService()
-        if filter_service.contains_banned_link(text) and not Config.is_moderator(update.effective_user.id):
+        scan = filter_service.scan(text)
+        if scan.has_banned_link and not Config.is_moderator(update.effective_user.id):
             await handle_link_violation(update, context)
             return
         
@@ -159,6 +161,7 @@ async def handle_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         context.user_data['post_data']['text'] = text
+        context.user_data['post_data']['filter_reasons'] = scan.reasons
         context.user_data['post_data']['media'] = []
         
         keyboard = [
@@ -297,26 +300,13 @@ async def show_preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
     media = post_data.get('media', [])
     if media:
         try:
-            for i, media_item in enumerate(media[:5]):  # Показываем до 5 медиа файлов
-                caption = None
-                if i == 0:  # Первое медиа с подписью
-                    caption = f"💿 Медиа файлы ({len(media)} шт.)"
-                
-                if media_item.get('type') == 'photo':
-                    await update.effective_message.reply_photo(
-                        photo=media_item['file_id'],
-                        caption=caption
-                    )
-                elif media_item.get('type') == 'video':
-                    await update.effective_message.reply_video(
-                        video=media_item['file_id'],
-                        caption=caption
-                    )
-                elif media_item.get('type') == 'document':
-                    await update.effective_message.reply_document(
-                        document=media_item['file_id'],
-                        caption=caption
-                    )
+            # Показываем до 5 медиа файлов одним альбомом
+            await send_media_groups(
+                context.bot,
+                update.effective_chat.id,
+                media[:5],
+                caption=f"💿 Медиа файлы ({len(media)} шт.)"
+            )
         except Exception as e:
             logger.error(f"Error showing media preview: {e}")
     
@@ -355,12 +345,9 @@ async def send_to_moderation(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return
         
-        async with db.get_session() as session:
-            # Get user
-            result = await session.execute(
-                select(User).where(User.id == user_id)
-            )
-            user = result.scalar_one_or_none()
+        # Одна сессия на обновление: пользователь, пост и moderation_message_id
+        async with unit_of_work() as uow:
+            user = await uow.get_user(user_id)
             
             if not user:
                 logger.warning(f"User {user_id} not found in database")
@@ -403,16 +390,14 @@ async def send_to_moderation(update: Update, context: ContextTypes.DEFAULT_TYPE)
             
             # Create post
             post = Post(**create_post_data)
-            session.add(post)
-            await session.flush()
+            uow.add(post)
+            await uow.flush()
             
             post_id = post.id
             logger.info(f"Created post with ID: {post_id}")
             
-            await session.commit()
-            
-            # Refresh post
-            await session.refresh(post)
+            # Пост фиксируем до отправки модераторам (expire_on_commit=False - refresh не нужен)
+            await uow.commit()
             
             # Send to moderation
             await send_to_moderation_group(update, context, post, user)
@@ -484,6 +469,10 @@ async def send_to_moderation_group(update: Update, context: ContextTypes.DEFAULT
     if post.anonymous:
         mod_text += "\n🫆 Анонимно"
     
+    filter_reasons = context.user_data.get('post_data', {}).get('filter_reasons')
+    if filter_reasons:
+        mod_text += f"\n🚩 Фильтр: {', '.join(filter_reasons)}"
+    
     media_count = 0
     if post.media:
         try:
@@ -524,7 +513,7 @@ async def send_to_moderation_group(update: Update, context: ContextTypes.DEFAULT
     try:
         # Проверяем доступность группы модерации
         try:
-            await bot.get_chat(target_group)
+            await get_chat_cached(bot, target_group)
         except Exception as chat_error:
             logger.error(f"Cannot access moderation group {target_group}: {chat_error}")
             await bot.send_message(
@@ -533,82 +522,47 @@ async def send_to_moderation_group(update: Update, context: ContextTypes.DEFAULT
             )
             return
 
-        # Отправляем медиа если есть
-        media_messages = []
-        if post.media and media_count > 0:
-            for i, media_item in enumerate(post.media):
-                try:
-                    if not media_item or not isinstance(media_item, dict):
-                        logger.warning(f"Invalid media item {i}: {media_item}")
-                        continue
-                        
-                    file_id = media_item.get('file_id')
-                    media_type = media_item.get('type')
-                    
-                    if not file_id or not media_type:
-                        logger.warning(f"Missing file_id or type in media item {i}: {media_item}")
-                        continue
-                    
-                    caption = f"📷 Медиа {i+1}/{media_count}"
-                    if is_actual:
-                        caption += " ⚡️"
-                    
-                    if media_type == 'photo':
-                        msg = await bot.send_photo(
-                            chat_id=target_group,
-                            photo=file_id,
-                            caption=caption
-                        )
-                        media_messages.append(msg.message_id)
-                    elif media_type == 'video':
-                        msg = await bot.send_video(
-                            chat_id=target_group,
-                            video=file_id,
-                            caption=caption
-                        )
-                        media_messages.append(msg.message_id)
-                    elif media_type == 'document':
-                        msg = await bot.send_document(
-                            chat_id=target_group,
-                            document=file_id,
-                            caption=caption
-                        )
-                        media_messages.append(msg.message_id)
-                        
-                except Exception as e:
-                    logger.error(f"Error sending media {i+1} for post {post.id}: {e}")
-                    continue
+        async def send_media():
+            """Медиа альбомами по 10"""
+            if not post.media or media_count == 0:
+                return []
+            caption = f"📷 Медиа ({media_count})"
+            if is_actual:
+                caption += " ⚡️"
+            return await send_media_groups(bot, target_group, post.media, caption=caption)
         
-        # Отправляем текст с кнопками
-        try:
-            message = await bot.send_message(
-                chat_id=target_group,
-                text=mod_text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            logger.info(f"✅ Post {post.id} sent to moderation successfully")
-        except Exception as text_error:
-            logger.error(f"Error sending moderation text: {text_error}")
-            simple_text = (
-                f"Новая заявка от @{username} (ID: {user.id})\n"
-                f"Категория: {category}\n"
-                f"Текст: {(post.text or '')[:200]}..."
-            )
-            message = await bot.send_message(
-                chat_id=target_group,
-                text=simple_text,
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
+        async def send_text():
+            """Текст с кнопками"""
+            try:
+                message = await bot.send_message(
+                    chat_id=target_group,
+                    text=mod_text,
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+                logger.info(f"✅ Post {post.id} sent to moderation successfully")
+                return message
+            except Exception as text_error:
+                logger.error(f"Error sending moderation text: {text_error}")
+                simple_text = (
+                    f"Новая заявка от @{username} (ID: {user.id})\n"
+                    f"Категория: {category}\n"
+                    f"Текст: {(post.text or '')[:200]}..."
+                )
+                return await bot.send_message(
+                    chat_id=target_group,
+                    text=simple_text,
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+        
+        # Медиа и текст с кнопками уходят параллельно
+        media_messages, message = await asyncio.gather(send_media(), send_text())
         
-        # Сохраняем message ID
+        # Сохраняем message ID в сессии обновления (commit - на выходе из unit of work)
         try:
-            from sqlalchemy import text
-            async with db.get_session() as session:
-                await session.execute(
-                    text("UPDATE posts SET moderation_message_id = :msg_id WHERE id = :post_id"),
-                    {"msg_id": message.message_id, "post_id": int(post.id)}
-                )
-                await session.commit()
+            async with unit_of_work() as uow:
+                post.moderation_message_id = message.message_id
+                uow.add(post)
+                await uow.flush()
                 logger.info(f"✅ Saved moderation_message_id for post {post.id}")
         except Exception as save_error:
             logger.warning(f"Could not save moderation_message_id: {save_error}")
@@ -669,3 +623,6 @@ async def cancel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     from handlers.start_handler import show_main_menu
     await show_main_menu(update, context)
+
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('pub', handle_publication_callback, str, str)
@@ -10,6 +10,8 @@ from config import Config
 from datetime import datetime
 import logging
 from typing import Dict, Optional
+from services.leaderboard import Leaderboard
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +23,9 @@ rating_data = {
     'user_votes': {}
 }
 
+# Топ профилей по очкам, группы - пол ('boy', 'girl', 'unknown')
+profile_leaderboard = Leaderboard(group_of=lambda url: rating_data['profiles'][url]['gender'])
+
 # ============= ОСНОВНЫЕ КОМАНДЫ =============
 
 async def rate_start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -98,22 +103,19 @@ async def handle_rate_profile(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
-async def handle_rate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка всех коллбэков рейтинга"""
+async def handle_rate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               action: str = None, value: str = None, vote_value: int = None):
+    """Обработка всех коллбэков рейтинга (rate:<action>[:<value>[:<vote>]])"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    value = data[2] if len(data) > 2 else None
-    
     if action == "gender":
         context.user_data['rate_gender'] = value
         await publish_rate_post(update, context)
     
     elif action == "vote":
+        # value - ID поста
         post_id = int(value) if value else None
-        vote_value = int(data[3]) if len(data) > 3 else None
         await handle_vote(update, context, post_id, vote_value)
     
     elif action == "back":
@@ -173,6 +175,7 @@ async def publish_rate_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'vote_count': 0,
                 'post_ids': []
             }
+            profile_leaderboard.update(profile_url, 0)
         
         rating_data['profiles'][profile_url]['post_ids'].append(post_id)
         
@@ -238,15 +241,12 @@ async def send_rating_to_moderation(update: Update, context: ContextTypes.DEFAUL
         logger.error(f"Error sending rating post to moderation: {e}")
         raise
 
-async def handle_rate_moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle moderation callbacks for rating posts"""
+async def handle_rate_moderation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                          action: str = None, post_id: int = None):
+    """Handle moderation callbacks for rating posts (rate_mod:<action>:<post_id>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    post_id = int(data[2]) if len(data) > 2 and data[2].isdigit() else None
-    
     if not Config.is_moderator(update.effective_user.id):
         await query.answer("❌ Доступ запрещен", show_alert=True)
         return
@@ -377,6 +377,7 @@ async def handle_vote(update: Update, context: ContextTypes.DEFAULT_TYPE, post_i
             
             profile['total_score'] = total_score
             profile['vote_count'] = vote_count
+            profile_leaderboard.update(profile_url, total_score)
             
             logger.info(f"User {username} voted {vote_value} for post {post_id}")
         
@@ -428,15 +429,10 @@ async def toppeople_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Нет данных")
         return
     
-    sorted_profiles = sorted(
-        rating_data['profiles'].items(),
-        key=lambda x: x[1]['total_score'],
-        reverse=True
-    )[:10]
-    
     text = "🏆 **ТОП-10 ПРОФИЛЕЙ**\n\n"
     
-    for i, (profile_url, data) in enumerate(sorted_profiles, 1):
+    for i, (profile_url, _) in enumerate(profile_leaderboard.top(10), 1):
+        data = rating_data['profiles'][profile_url]
         text += (
             f"{i}. **{profile_url}**\n"
             f"   ⭐️ Очки: {data['total_score']}\n"
@@ -448,34 +444,32 @@ async def toppeople_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def topboys_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Топ-10 мужчин - /topboys"""
-    profiles = {url: data for url, data in rating_data['profiles'].items() if data['gender'] == 'boy'}
+    top_profiles = profile_leaderboard.top(10, group='boy')
     
-    if not profiles:
+    if not top_profiles:
         await update.message.reply_text("❌ Нет данных")
         return
     
-    sorted_profiles = sorted(profiles.items(), key=lambda x: x[1]['total_score'], reverse=True)[:10]
-    
     text = "🧑‍🦱 **ТОП-10 BOYS**\n\n"
     
-    for i, (profile_url, data) in enumerate(sorted_profiles, 1):
+    for i, (profile_url, _) in enumerate(top_profiles, 1):
+        data = rating_data['profiles'][profile_url]
         text += f"{i}. {profile_url} — ⭐️ {data['total_score']} ({data['vote_count']} голосов)\n"
     
     await update.message.reply_text(text, parse_mode='Markdown')
 
 async def topgirls_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Топ-10 женщин - /topgirls"""
-    profiles = {url: data for url, data in rating_data['profiles'].items() if data['gender'] == 'girl'}
+    top_profiles = profile_leaderboard.top(10, group='girl')
     
-    if not profiles:
+    if not top_profiles:
         await update.message.reply_text("❌ Нет данных")
         return
     
-    sorted_profiles = sorted(profiles.items(), key=lambda x: x[1]['total_score'], reverse=True)[:10]
-    
     text = "👱‍♀️ **ТОП-10 GIRLS**\n\n"
     
-    for i, (profile_url, data) in enumerate(sorted_profiles, 1):
+    for i, (profile_url, _) in enumerate(top_profiles, 1):
+        data = rating_data['profiles'][profile_url]
         text += f"{i}. {profile_url} — ⭐️ {data['total_score']} ({data['vote_count']} голосов)\n"
     
     await update.message.reply_text(text, parse_mode='Markdown')
@@ -501,6 +495,10 @@ async def toppeoplereset_command(update: Update, context: ContextTypes.DEFAULT_T
     
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('rate', handle_rate_callback, str, str, int)
+callback_registry.register('rate_mod', handle_rate_moderation_callback, str, int)
+
 __all__ = [
     'rate_start_command',
     'handle_rate_photo',
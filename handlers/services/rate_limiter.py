@@ -1,22 +1,159 @@
-# services/rate_limiter.py
+# -*- coding: utf-8 -*-
+"""
+Анти-флуд входящих обновлений (GCRA)
+На ключ хранится одно число - теоретическое время следующего запроса (TAT);
+простаивающие ключи удаляются периодической чисткой, память не растёт бесконечно
+"""
+import logging
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Виды обновлений с отдельными лимитами
+KIND_COMMAND = 'command'
+KIND_CALLBACK = 'callback'
+KIND_MEDIA = 'media'
+
+# Как часто чистить простаивающие ключи (сек)
+SWEEP_INTERVAL = 60.0
+
 class RateLimiter:
-    def __init__(self):
-        self.user_requests = {}
-    
-    async def check_rate_limit(self, user_id: int, limit: int = 10) -> bool:
-        """Проверка X запросов в минуту"""
-        now = datetime.now()
-        if user_id not in self.user_requests:
-            self.user_requests[user_id] = []
-        
-        # Удаляем старые запросы
-        self.user_requests[user_id] = [
-            t for t in self.user_requests[user_id]
-            if (now - t).total_seconds() < 60
-        ]
-        
-        if len(self.user_requests[user_id]) >= limit:
+    """GCRA: limit запросов за period секунд со всплеском до burst, O(1) на проверку"""
+
+    def __init__(self, budgets: Optional[Dict[str, Tuple[float, float, int]]] = None):
+        # kind -> (limit, period, burst)
+        if budgets is None:
+            budgets = {
+                KIND_COMMAND: (Config.FLOOD_COMMANDS_PER_MIN, 60.0, Config.FLOOD_COMMAND_BURST),
+                KIND_CALLBACK: (Config.FLOOD_CALLBACKS_PER_MIN, 60.0, Config.FLOOD_CALLBACK_BURST),
+                KIND_MEDIA: (Config.FLOOD_MEDIA_PER_MIN, 60.0, Config.FLOOD_MEDIA_BURST),
+            }
+
+        # kind -> (интервал между запросами, допуск всплеска)
+        self._params: Dict[str, Tuple[float, float]] = {}
+        for kind, (limit, period, burst) in budgets.items():
+            self._params[kind] = self._gcra_params(limit, period, burst)
+
+        # (kind, key) -> TAT по монотонным часам
+        self._tat: Dict[Tuple[str, Hashable], float] = {}
+        self._last_sweep = time.monotonic()
+
+        self.allowed = 0
+        self.dropped = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _gcra_params(limit: float, period: float, burst: int) -> Tuple[float, float]:
+        interval = period / limit
+        return interval, interval * max(burst - 1, 0)
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    # ============= ПРОВЕРКА =============
+
+    def hit(self, kind: str, key: Hashable, now: Optional[float] = None) -> bool:
+        """Учесть запрос: True - пропустить, False - лимит превышен"""
+        params = self._params.get(kind)
+        if params is None:
+            return True
+        interval, tolerance = params
+
+        if now is None:
+            now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(now)
+
+        slot = (kind, key)
+        tat = self._tat.get(slot, now)
+        if tat < now:
+            tat = now
+
+        if tat - now > tolerance:
+            self.dropped += 1
             return False
-        
-        self.user_requests[user_id].append(now)
+
+        self._tat[slot] = tat + interval
+        self.allowed += 1
         return True
+
+    def retry_after(self, kind: str, key: Hashable, now: Optional[float] = None) -> float:
+        """Через сколько секунд следующий запрос будет пропущен"""
+        params = self._params.get(kind)
+        tat = self._tat.get((kind, key))
+        if params is None or tat is None:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, tat - params[1] - now)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удалить ключи, чей лимит полностью восстановился (TAT в прошлом)"""
+        if now is None:
+            now = time.monotonic()
+        self._last_sweep = now
+
+        idle = [slot for slot, tat in self._tat.items() if tat <= now]
+        for slot in idle:
+            del self._tat[slot]
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def check_rate_limit(self, user_id: int, limit: int = 10) -> bool:
+        """Проверка X запросов в минуту (совместимость со старым интерфейсом)"""
+        kind = f"legacy:{limit}"
+        if kind not in self._params:
+            self._params[kind] = self._gcra_params(limit, 60.0, limit)
+        return self.hit(kind, user_id)
+
+    def get_metrics(self) -> Dict[str, int]:
+        return {
+            'keys': len(self._tat),
+            'allowed': self.allowed,
+            'dropped': self.dropped,
+            'evicted': self.evicted
+        }
+
+def classify_update(update: Update) -> Optional[str]:
+    """Вид обновления для анти-флуда (None - не ограничивается)"""
+    if update.callback_query:
+        return KIND_CALLBACK
+
+    message = update.message
+    if not message:
+        return None
+    if message.text and message.text.startswith('/'):
+        return KIND_COMMAND
+    if message.photo or message.video or message.document or message.animation:
+        return KIND_MEDIA
+    return None
+
+async def antiflood(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ранний обработчик: обновления сверх лимита дальше не обрабатываются"""
+    user = update.effective_user
+    if not user or Config.is_moderator(user.id):
+        return
+
+    kind = classify_update(update)
+    if kind is None or rate_limiter.hit(kind, user.id):
+        return
+
+    logger.debug(f"🚫 Flood dropped: {kind} from user {user.id}")
+    if kind == KIND_CALLBACK:
+        # Без ответа клиент Telegram продолжает показывать загрузку на кнопке
+        try:
+            await update.callback_query.answer()
+        except Exception as e:
+            logger.debug(f"Could not answer dropped callback: {e}")
+    raise ApplicationHandlerStop
+
+# Глобальный экземпляр ограничителя
+rate_limiter = RateLimiter()
+
+__all__ = ['RateLimiter', 'rate_limiter', 'antiflood', 'classify_update']
@@ -1,12 +1,77 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from config import Config
+from services.cache_service import cached
 import logging
 import secrets
 import string
 
 logger = logging.getLogger(__name__)
 
+@cached(ttl=0, key=lambda: "menu:main")
+async def render_main_menu():
+    """Текст и клавиатура главного меню (статичные - собираются один раз)"""
+    keyboard = [
+        [InlineKeyboardButton("🙅‍♂️ Будапешт - канал", url="https://t.me/snghu")],
+        [InlineKeyboardButton("🙅‍♀️ Будапешт - чат", url="https://t.me/tgchatxxx")],
+        [InlineKeyboardButton("🙅 Будапешт - каталог услуг", url="https://t.me/catalogtrix")],
+        [InlineKeyboardButton("🕵️‍♂️ Куплю / Отдам / Продам", url="https://t.me/hungarytrade")],
+        [InlineKeyboardButton("🚶‍♀️‍➡️ Писать", callback_data="menu:write")]
+    ]
+    
+    text = (
+    "👋🏻 *Привет❗️*\n"
+    "*Я Трикс* – гид навигатор по Будапешту и Венгрии 🇭🇺.\n\n"
+    
+    "🗯️ *Наше сообщество*:\n"
+    "🙅‍♂️ *Канал* — основные публикации и новости\n"
+    "🙅‍♀️ *Чат* — живое общение и обсуждения\n"
+    "🙅 *Каталог* — список мастеров и услуг\n"
+    "🕵️‍♂️ *КОП* — Барахолка: Куплю / Отдам / Продам\n\n"
+    
+    "*Хотите сделать публикацию❔*\n"
+    "Нажмите 🚶‍♀️‍➡️*Писать* \n\n"
+    
+    "🏹Быстро•⚔️Удобно•🛡️Безопасно•\n\n"
+    "🔒 *Добавляйте Трикса в закрепленные*"
+)
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+@cached(ttl=0, key=lambda: "menu:write")
+async def render_write_menu():
+    """Текст и клавиатура меню выбора раздела"""
+    keyboard = [
+        [InlineKeyboardButton("Пост в 🙅‍♂️Будапешт/🕵🏼‍♀️КОП", callback_data="menu:budapest")],
+        [InlineKeyboardButton("Заявка в 🙅Каталог Услуг", callback_data="menu:services")],
+        [InlineKeyboardButton("⚡️Актуальное", callback_data="menu:actual")],
+        [InlineKeyboardButton("🚶‍♀️Читать", callback_data="menu:read")]
+    ]
+    
+    text = (
+    "• *Выбор и описание разделов*\n\n"
+    
+    "*Пост в 🙅‍♂️ Будапешт / 🕵🏼‍♀️ КОП*\n"
+    "  - Канал Будапешт: объявления, новости, жалобы, подслушано, важное\n"
+    "  - Канал Куплю/Отдам/Продам: главная барахолка Будапешта и 🇭🇺\n\n"
+    
+    "*Заявка в 🙅 Каталог Услуг*\n"
+    "  - Добавляйтесь в список мастеров Будапешта\n"
+    "  - Разные направления отсортированы по хештегам для удобного поиска пользователем\n"
+    "  - Примеры: маникюр, репетитор, тренер, врач, грузчик...\n\n"
+    
+    "*⚡️ Актуальное*\n"
+    "  - Важные и срочные сообщения, публикуются в чат и закрепляются\n"
+    "  - Примеры:\n"
+    "      • нужен стоматолог сегодня\n"
+    "      • потерялась сумка в 13 районе\n"
+    "      • ищу 🚐 для переезда\n"
+    "      • в поиске 👷🏽 на завтра — оплата в конце дня\n"
+    "*🚶‍♀️ Читать* — возврат в главное меню"
+)
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command with safe DB handling"""
     user_id = update.effective_user.id
@@ -28,17 +93,12 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         from services.db import db
         from models import User, Gender
-        from sqlalchemy import select
+        from data.user_data import get_user_row, invalidate_user_row
         from datetime import datetime
         
-        async with db.get_session() as session:
-            # Check if user exists
-            result = await session.execute(
-                select(User).where(User.id == user_id)
-            )
-            user = result.scalar_one_or_none()
-            
-            if not user:
+        # Повторный /start не ходит в БД - строка пользователя берётся из кэша
+        if not await get_user_row(user_id):
+            async with db.get_session() as session:
                 # Create new user immediately with default values
                 new_user = User(
                     id=user_id,
@@ -52,6 +112,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 session.add(new_user)
                 await session.commit()
                 logger.info(f"Created new user: {user_id}")
+            await invalidate_user_row(user_id)
                 
     except Exception as e:
         logger.warning(f"Could not save user to DB: {e}")
@@ -69,42 +130,19 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.info(f"Blocked main menu in Budapest chat")
         return
     
-    keyboard = [
-        [InlineKeyboardButton("🙅‍♂️ Будапешт - канал", url="https://t.me/snghu")],
-        [InlineKeyboardButton("🙅‍♀️ Будапешт - чат", url="https://t.me/tgchatxxx")],
-        [InlineKeyboardButton("🙅 Будапешт - каталог услуг", url="https://t.me/catalogtrix")],
-        [InlineKeyboardButton("🕵️‍♂️ Куплю / Отдам / Продам", url="https://t.me/hungarytrade")],
-        [InlineKeyboardButton("🚶‍♀️‍➡️ Писать", callback_data="menu:write")]
-    ]
-    
-    text = (
-    "👋🏻 *Привет❗️*\n"
-    "*Я Трикс* – гид навигатор по Будапешту и Венгрии 🇭🇺.\n\n"
-    
-    "🗯️ *Наше сообщество*:\n"
-    "🙅‍♂️ *Канал* — основные публикации и новости\n"
-    "🙅‍♀️ *Чат* — живое общение и обсуждения\n"
-    "🙅 *Каталог* — список мастеров и услуг\n"
-    "🕵️‍♂️ *КОП* — Барахолка: Куплю / Отдам / Продам\n\n"
-    
-    "*Хотите сделать публикацию❔*\n"
-    "Нажмите 🚶‍♀️‍➡️*Писать* \n\n"
-    
-    "🏹Быстро•⚔️Удобно•🛡️Безопасно•\n\n"
-    "🔒 *Добавляйте Трикса в закрепленные*"
-)
+    text, reply_markup = await render_main_menu()
     
     try:
         if update.callback_query:
             await update.callback_query.edit_message_text(
                 text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
         else:
             await update.effective_message.reply_text(
                 text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                reply_markup=reply_markup,
                 parse_mode='Markdown'
             )
     except Exception as e:
@@ -113,7 +151,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.effective_message.reply_text(
                 "TrixBot - топ комьюнити Будапешта и 🇭🇺\n\n"
                 "Нажмите 'Писать' чтобы создать публикацию",
-                reply_markup=InlineKeyboardMarkup(keyboard)
+                reply_markup=reply_markup
             )
         except Exception as e2:
             logger.error(f"Fallback menu also failed: {e2}")
@@ -124,46 +162,19 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_write_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show write menu with publication types"""
     
-    keyboard = [
-        [InlineKeyboardButton("Пост в 🙅‍♂️Будапешт/🕵🏼‍♀️КОП", callback_data="menu:budapest")],
-        [InlineKeyboardButton("Заявка в 🙅Каталог Услуг", callback_data="menu:services")],
-        [InlineKeyboardButton("⚡️Актуальное", callback_data="menu:actual")],
-        [InlineKeyboardButton("🚶‍♀️Читать", callback_data="menu:read")]
-    ]
-    
-    text = (
-    "• *Выбор и описание разделов*\n\n"
-    
-    "*Пост в 🙅‍♂️ Будапешт / 🕵🏼‍♀️ КОП*\n"
-    "  - Канал Будапешт: объявления, новости, жалобы, подслушано, важное\n"
-    "  - Канал Куплю/Отдам/Продам: главная барахолка Будапешта и 🇭🇺\n\n"
-    
-    "*Заявка в 🙅 Каталог Услуг*\n"
-    "  - Добавляйтесь в список мастеров Будапешта\n"
-    "  - Разные направления отсортированы по хештегам для удобного поиска пользователем\n"
-    "  - Примеры: маникюр, репетитор, тренер, врач, грузчик...\n\n"
-    
-    "*⚡️ Актуальное*\n"
-    "  - Важные и срочные сообщения, публикуются в чат и закрепляются\n"
-    "  - Примеры:\n"
-    "      • нужен стоматолог сегодня\n"
-    "      • потерялась сумка в 13 районе\n"
-    "      • ищу 🚐 для переезда\n"
-    "      • в поиске 👷🏽 на завтра — оплата в конце дня\n"
-    "*🚶‍♀️ Читать* — возврат в главное меню"
-)
+    text, reply_markup = await render_write_menu()
     
     try:
         await update.callback_query.edit_message_text(
             text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     except Exception as e:
         logger.error(f"Error showing write menu: {e}")
         await update.callback_query.edit_message_text(
             "Выберите раздел публикации:",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=reply_markup
         )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
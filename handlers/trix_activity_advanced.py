@@ -22,7 +22,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id not in trix_activity.accounts:
-        await update.message.reply_text("❌ Используйте /liketime")
+        await update.effective_message.reply_text("❌ Используйте /liketime")
         return
     
     # Получаем топ пользователей
@@ -49,7 +49,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     keyboard = [[InlineKeyboardButton("◀️ Меню", callback_data="lt:menu")]]
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='Markdown'
@@ -104,14 +104,12 @@ async def settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-async def toggle_function(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Переключить функцию"""
+async def toggle_function(update: Update, context: ContextTypes.DEFAULT_TYPE, func_name: str = None):
+    """Переключить функцию (lt:toggle:<func_name>)"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    data = query.data.split(":")
-    func_name = data[2] if len(data) > 2 else None
     
     if user_id not in trix_activity.accounts or not func_name:
         return
@@ -119,6 +117,7 @@ async def toggle_function(update: Update, context: ContextTypes.DEFAULT_TYPE):
     account = trix_activity.accounts[user_id]
     current_state = account.active_functions.get(func_name, True)
     account.active_functions[func_name] = not current_state
+    trix_activity.save_account(user_id)
     
     new_state = "✅ включена" if account.active_functions[func_name] else "❌ отключена"
     
@@ -217,8 +216,8 @@ async def verify_subscriptions(update: Update, context: ContextTypes.DEFAULT_TYP
     
     await query.edit_message_text(message, parse_mode='Markdown')
 
-async def approve_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Админ одобрил подписку"""
+async def approve_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None):
+    """Админ одобрил подписку (lt:approve_sub:<user_id>)"""
     query = update.callback_query
     await query.answer()
     
@@ -226,9 +225,6 @@ async def approve_subscription(update: Update, context: ContextTypes.DEFAULT_TYP
         await query.answer("❌ Только админы", show_alert=True)
         return
     
-    data = query.data.split(":")
-    user_id = int(data[2]) if len(data) > 2 else None
-    
     if not user_id or user_id not in trix_activity.accounts:
         await query.answer("❌ Пользователь не найден", show_alert=True)
         return
@@ -254,8 +250,8 @@ async def approve_subscription(update: Update, context: ContextTypes.DEFAULT_TYP
     
     await query.edit_message_text(f"✅ {msg}")
 
-async def reject_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Админ отклонил подписку"""
+async def reject_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None):
+    """Админ отклонил подписку (lt:reject_sub:<user_id>)"""
     query = update.callback_query
     await query.answer()
     
@@ -263,9 +259,6 @@ async def reject_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.answer("❌ Только админы", show_alert=True)
         return
     
-    data = query.data.split(":")
-    user_id = int(data[2]) if len(data) > 2 else None
-    
     if not user_id:
         return
     
@@ -337,15 +330,13 @@ async def confirm_pending_task(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode='Markdown'
     )
 
-async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработать подтверждение задания"""
+async def process_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               task_id: int = None, action: str = None):
+    """Обработать подтверждение задания (lt:confirm:<task_id>:<approve|reject>)"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    data = query.data.split(":")
-    task_id = int(data[2]) if len(data) > 2 else None
-    action = data[3] if len(data) > 3 else None
     
     if not task_id or not action:
         return
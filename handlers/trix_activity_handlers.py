@@ -12,6 +12,7 @@ from datetime import datetime
 
 # Импортируем сервис из главного файла
 from handlers.trix_activity_service import trix_activity
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -51,23 +52,70 @@ async def liketime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     context.user_data['lt_step'] = 'waiting_ig'
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='Markdown'
     )
 
-async def handle_lt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка callback'ов регистрации"""
+def _to_int(value):
+    """ID из callback_data (None, если не число)"""
+    return int(value) if value and value.isdigit() else None
+
+async def handle_lt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             action: str = None, value: str = None, extra: str = None):
+    """Все кнопки TrixActivity (lt:<action>[:<value>[:<extra>]])"""
+    from handlers import trix_activity_advanced as advanced
+    
     query = update.callback_query
-    await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
+    # Обработчики с собственным query.answer()
+    if action == "create":
+        if value:
+            await handle_create_action(update, context, value)
+        else:
+            await create_task_menu(update, context)
+        return
+    elif action == "perform":
+        await perform_task(update, context, _to_int(value))
+        return
+    elif action == "settings":
+        await advanced.settings_menu(update, context)
+        return
+    elif action == "toggle":
+        await advanced.toggle_function(update, context, value)
+        return
+    elif action == "subscribe":
+        await advanced.subscribe_menu(update, context)
+        return
+    elif action == "verify_subs":
+        await advanced.verify_subscriptions(update, context)
+        return
+    elif action == "approve_sub":
+        await advanced.approve_subscription(update, context, _to_int(value))
+        return
+    elif action == "reject_sub":
+        await advanced.reject_subscription(update, context, _to_int(value))
+        return
+    elif action == "confirm":
+        await advanced.process_confirmation(update, context, _to_int(value), extra)
+        return
     
-    user_id = update.effective_user.id
+    await query.answer()
     
-    if action == "ig":
+    if action == "menu":
+        await show_main_menu(update, context)
+    elif action == "balance":
+        await balance_command(update, context)
+    elif action == "stats":
+        await advanced.stats_command(update, context)
+    elif action == "pool":
+        await show_pool(update, context)
+    elif action == "pool_next":
+        # lt:pool_next:<task_id> - следующее после показанного
+        await show_pool(update, context, after=_to_int(value) or 0)
+    
+    elif action == "ig":
         context.user_data['lt_step'] = 'waiting_ig'
         
         keyboard = [[InlineKeyboardButton("⏮️ Назад", callback_data="lt:back")]]
@@ -131,7 +179,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id not in trix_activity.accounts:
-        await update.message.reply_text("❌ Используйте /liketime для регистрации")
+        await update.effective_message.reply_text("❌ Используйте /liketime для регистрации")
         return
     
     account = trix_activity.accounts[user_id]
@@ -186,7 +234,7 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if user_id not in trix_activity.accounts:
-        await update.message.reply_text("❌ Используйте /liketime для регистрации")
+        await update.effective_message.reply_text("❌ Используйте /liketime для регистрации")
         return
     
     # Пытаемся получить награду
@@ -197,7 +245,7 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("◀️ Меню", callback_data="lt:menu")]
     ]
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         message,
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
@@ -244,14 +292,12 @@ async def create_task_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
-async def handle_create_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка выбора действия для создания"""
+async def handle_create_action(update: Update, context: ContextTypes.DEFAULT_TYPE, action_type: str = None):
+    """Обработка выбора действия для создания (lt:create:<type>)"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    data = query.data.split(":")
-    action_type = data[2] if len(data) > 2 else None
     
     if not action_type:
         return
@@ -326,45 +372,49 @@ async def handle_create_input(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # ============= ПУЛ ЗАДАНИЙ =============
 
-async def show_pool(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать пул активных заданий"""
+async def show_pool(update: Update, context: ContextTypes.DEFAULT_TYPE, after: int = 0):
+    """Показать пул активных заданий (по одному, after - id последнего показанного)"""
     user_id = update.effective_user.id
     
     if user_id not in trix_activity.accounts:
-        await update.message.reply_text("❌ Используйте /liketime")
+        await update.effective_message.reply_text("❌ Используйте /liketime")
         return
     
-    account = trix_activity.accounts[user_id]
-    tasks = trix_activity.get_active_tasks(user_id)
+    tasks = trix_activity.get_active_tasks(user_id, after=after, limit=1)
+    if not tasks and after:
+        # Дошли до конца - начинаем сначала
+        tasks = trix_activity.get_active_tasks(user_id, limit=1)
     
     if not tasks:
         keyboard = [[InlineKeyboardButton("◀️ Меню", callback_data="lt:menu")]]
-        
-        await update.message.reply_text(
+        text = (
             "📭 **Пул пуст!**\n\n"
             "Сейчас нет активных заданий.\n"
-            "Попробуйте позже или создайте собственное!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            "Попробуйте позже или создайте собственное!"
         )
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        else:
+            await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
         return
     
-    # Показываем первое задание
     task = tasks[0]
     creator = trix_activity.accounts.get(task.creator_id)
+    total = trix_activity.count_active_tasks(user_id)
     
     text = (
-        f"📋 **Пул заданий** ({len(tasks)} активных)\n\n"
+        f"📋 **Пул заданий** ({total} активных)\n\n"
         f"🆔 Task ID: {task.task_id}\n"
         f"👤 Создатель: @{creator.username if creator else 'unknown'}\n"
         f"📌 Тип: {'❤️ Like' if task.task_type == 'like' else '💬 Comment' if task.task_type == 'comment' else '➕ Follow'}\n"
         f"💰 Награда: {task.cost} триксиков\n"
         f"🔗 Ссылки: {task.content[:50]}...\n\n"
-        f"📊 Всего заданий: {len(tasks)}"
+        f"📊 Всего заданий: {total}"
     )
     
     keyboard = [
         [InlineKeyboardButton("✅ Выполнить", callback_data=f"lt:perform:{task.task_id}")],
-        [InlineKeyboardButton("⏭️ Следующее", callback_data=f"lt:pool_next")],
+        [InlineKeyboardButton("⏭️ Следующее", callback_data=f"lt:pool_next:{task.task_id}")],
         [InlineKeyboardButton("◀️ Меню", callback_data="lt:menu")]
     ]
     
@@ -381,14 +431,12 @@ async def show_pool(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
-async def perform_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Выполнить задание"""
+async def perform_task(update: Update, context: ContextTypes.DEFAULT_TYPE, task_id: int = None):
+    """Выполнить задание (lt:perform:<task_id>)"""
     query = update.callback_query
     await query.answer()
     
     user_id = update.effective_user.id
-    data = query.data.split(":")
-    task_id = int(data[2]) if len(data) > 2 else None
     
     if not task_id:
         return
@@ -510,6 +558,9 @@ async def trixikiadd_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     success, msg = trix_activity.admin_add_trixiki(target_user_id, amount)
     await update.message.reply_text(msg)
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('lt', handle_lt_callback, str, str, str)
+
 # ============= ЭКСПОРТ =============
 
 __all__ = [
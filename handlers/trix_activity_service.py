@@ -4,32 +4,55 @@ TrixActivity System - Instagram/Threads активность обмен
 Система с внутренней валютой "триксики"
 """
 
+from bisect import bisect_right, insort
 from datetime import datetime, timedelta
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List, Set, Tuple
 import asyncio
+import heapq
 import logging
 
+from config import Config
+from services.leaderboard import Leaderboard
+from services.scheduler_service import scheduler_service, DateTrigger
+from trix_activity_database import (
+    TrixLedger, DAILY_CLAIM, TASK_CREATE, FREEZE, PAYOUT, UNFREEZE, ADMIN_GRANT, REFUND, ADJUST
+)
+
 logger = logging.getLogger(__name__)
 
 # ============= МОДЕЛИ ДАННЫХ =============
 
 class TrixikiAccount:
     """Аккаунт пользователя с триксиками"""
-    def __init__(self, user_id: int, username: str):
+    def __init__(self, user_id: int, username: str,
+                 on_balance_change: Optional[Callable[['TrixikiAccount', int], None]] = None):
         self.user_id = user_id
         self.username = username
         self.instagram = None
         self.threads = None
-        self.balance = 0
+        self._on_balance_change = on_balance_change
+        self._balance = 0
         self.max_balance = 15  # Базовый лимит
         self.last_daily_claim = None
         self.frozen_trixiki = 0  # Замороженные триксики
+        self.ledger_seq = 0  # последняя проводка журнала, учтённая в балансе
         self.active_functions = {
             'like': True,
             'comment': True,
             'follow': True
         }
         self.enabled = True
+    
+    @property
+    def balance(self) -> int:
+        return self._balance
+    
+    @balance.setter
+    def balance(self, value: int):
+        delta = value - self._balance
+        self._balance = value
+        if self._on_balance_change and delta:
+            self._on_balance_change(self, delta)
 
 class Task:
     """Задание в пуле"""
@@ -45,15 +68,133 @@ class Task:
         self.performer_id = None
         self.performed_at = None
         self.confirmation_deadline = None
+        self.completed_at = None
+
+class TaskIndex:
+    """Индексы заданий: по статусу и типу, открытые задания по времени создания, исключения по пользователям
+    
+    Открытое задание - активное и ещё никем не взятое. Счётчики - размеры множеств, O(1).
+    """
+    
+    def __init__(self):
+        self.by_status: Dict[str, Set[int]] = {}
+        self.by_type: Dict[str, Set[int]] = {}
+        
+        # Открытые задания: отсортированные id (удаление ленивое) и множество действующих
+        self._open: List[int] = []
+        self._open_set: Set[int] = set()
+        
+        # user_id -> свои открытые задания / задания, которые пользователь уже выполнял
+        self._own_open: Dict[int, Set[int]] = {}
+        self._performed: Dict[int, Set[int]] = {}
+        
+        self._status: Dict[int, str] = {}
+        self._creator: Dict[int, int] = {}
+    
+    def __len__(self) -> int:
+        return len(self._status)
+    
+    def add(self, task: Task):
+        """Добавить задание (при создании или загрузке)"""
+        self._status[task.task_id] = task.status
+        self._creator[task.task_id] = task.creator_id
+        self.by_status.setdefault(task.status, set()).add(task.task_id)
+        self.by_type.setdefault(task.task_type, set()).add(task.task_id)
+        if task.performer_id is not None:
+            self._performed.setdefault(task.performer_id, set()).add(task.task_id)
+        if task.status == 'active' and task.performer_id is None:
+            self._open_task(task.task_id)
+    
+    def _open_task(self, task_id: int):
+        if self._open and task_id < self._open[-1]:
+            insort(self._open, task_id)
+        else:
+            self._open.append(task_id)
+        self._open_set.add(task_id)
+        self._own_open.setdefault(self._creator[task_id], set()).add(task_id)
+    
+    def _close(self, task_id: int):
+        """Убрать задание из открытых (из списка - лениво)"""
+        if task_id not in self._open_set:
+            return
+        self._open_set.discard(task_id)
+        own = self._own_open.get(self._creator[task_id])
+        if own is not None:
+            own.discard(task_id)
+            if not own:
+                del self._own_open[self._creator[task_id]]
+        
+        # Уплотняем, когда удалённых больше половины
+        if len(self._open) > 2 * len(self._open_set) + 64:
+            self._open = [i for i in self._open if i in self._open_set]
+    
+    def taken(self, task: Task):
+        """Задание взято исполнителем"""
+        self._close(task.task_id)
+        self._performed.setdefault(task.performer_id, set()).add(task.task_id)
+    
+    def set_status(self, task: Task, status: str):
+        """Сменить статус задания"""
+        old = self._status.get(task.task_id)
+        if old is not None:
+            self.by_status[old].discard(task.task_id)
+        task.status = status
+        self._status[task.task_id] = status
+        self.by_status.setdefault(status, set()).add(task.task_id)
+        if status != 'active':
+            self._close(task.task_id)
+    
+    def count(self, status: str) -> int:
+        return len(self.by_status.get(status, ()))
+    
+    @property
+    def open_count(self) -> int:
+        return len(self._open_set)
+    
+    def open_count_for(self, user_id: int) -> int:
+        """Открытые задания, кроме своих"""
+        return len(self._open_set) - len(self._own_open.get(user_id, ()))
+    
+    def page(self, user_id: int, after: int = 0, limit: Optional[int] = None,
+             accept: Optional[Callable[[int], bool]] = None) -> List[int]:
+        """Открытые задания для пользователя после task_id=after, по возрастанию id
+        
+        Стоимость - O(log n + limit + пропущенные), пропускаются только свои,
+        уже выполненные и отклонённые accept задания.
+        """
+        ids = self._open
+        own = self._own_open.get(user_id, ())
+        performed = self._performed.get(user_id, ())
+        
+        result = []
+        i = bisect_right(ids, after)
+        while i < len(ids) and (limit is None or len(result) < limit):
+            task_id = ids[i]
+            i += 1
+            if task_id not in self._open_set or task_id in own or task_id in performed:
+                continue
+            if accept is not None and not accept(task_id):
+                continue
+            result.append(task_id)
+        return result
 
 class TrixActivityService:
     """Главный сервис системы триксиков"""
     
+    AUTO_CONFIRM_JOB_ID = 'trix_auto_confirm'
+    
     def __init__(self):
         self.accounts: Dict[int, TrixikiAccount] = {}
+        self.leaderboard = Leaderboard()  # user_id -> баланс
         self.tasks: Dict[int, Task] = {}
+        self.task_index = TaskIndex()
         self.pending_confirmations: Dict[int, Dict] = {}
+        # (deadline, task_id) по pending_confirmations; устаревшие элементы пропускаются при извлечении
+        self._deadlines: List[Tuple[datetime, int]] = []
+        self.auto_confirm_batch = Config.TRIX_AUTO_CONFIRM_BATCH
+        self.is_running = False
         self.task_counter = 1
+        self.ledger: Optional[TrixLedger] = None  # журнал триксиков в БД (None - только память)
         self.freeze_duration = 3 * 3600  # 3 часа в секундах
         self.daily_reward = 10
         self.daily_reset_hour = 0
@@ -79,11 +220,37 @@ class TrixActivityService:
         if user_id in self.accounts:
             return self.accounts[user_id]
         
-        account = TrixikiAccount(user_id, username)
+        account = TrixikiAccount(user_id, username, on_balance_change=self._on_balance_change)
         self.accounts[user_id] = account
+        self.leaderboard.update(user_id, account.balance)
+        self.save_account(user_id)
         logger.info(f"User {user_id} registered in TrixActivity")
         return account
     
+    def _on_balance_change(self, account: TrixikiAccount, delta: int):
+        """Прямое присваивание баланса - корректирующая проводка"""
+        if account.user_id in self.accounts:
+            self.leaderboard.update(account.user_id, account.balance)
+            if self.ledger:
+                account.ledger_seq = self.ledger.append(account, ADJUST, amount=delta)
+    
+    def _post(self, account: TrixikiAccount, kind: str, amount: int = 0, frozen: int = 0,
+              task_id: int = None, at: datetime = None):
+        """Проводка: изменить баланс и заморозку аккаунта и записать её в журнал"""
+        if amount:
+            account._balance += amount
+            self.leaderboard.update(account.user_id, account._balance)
+        if frozen:
+            account.frozen_trixiki += frozen
+        if self.ledger:
+            account.ledger_seq = self.ledger.append(account, kind, amount, frozen, task_id, at)
+    
+    def save_account(self, user_id: int):
+        """Сохранить профиль аккаунта в БД (соцсети, лимит, функции, статус)"""
+        account = self.accounts.get(user_id)
+        if account and self.ledger:
+            self.ledger.save_account(account)
+    
     def set_social_accounts(self, user_id: int, instagram: str, threads: str) -> bool:
         """Установить социальные аккаунты"""
         if user_id not in self.accounts:
@@ -92,6 +259,7 @@ class TrixActivityService:
         account = self.accounts[user_id]
         account.instagram = instagram.lstrip('@')
         account.threads = threads.lstrip('@')
+        self.save_account(user_id)
         logger.info(f"User {user_id} set socials: IG={instagram}, Threads={threads}")
         return True
     
@@ -119,7 +287,7 @@ class TrixActivityService:
         
         # Добавляем награду
         reward = min(self.daily_reward, account.max_balance - account.balance)
-        account.balance += reward
+        self._post(account, DAILY_CLAIM, reward, at=now)
         account.last_daily_claim = now
         
         return True, account.balance, (
@@ -195,11 +363,14 @@ class TrixActivityService:
         )
         
         self.tasks[self.task_counter] = task
+        self.task_index.add(task)
         task_id = self.task_counter
         self.task_counter += 1
         
         # Списываем триксики
-        account.balance -= cost
+        self._post(account, TASK_CREATE, -cost, task_id=task_id)
+        if self.ledger:
+            self.ledger.save_task(task)
         logger.info(f"Task {task_id} created by user {user_id} (type: {task_type})")
         
         return True, task_id, (
@@ -211,27 +382,24 @@ class TrixActivityService:
     
     # ============= ПУЛ ЗАДАНИЙ =============
     
-    def get_active_tasks(self, user_id: int) -> List[Task]:
-        """Получить активные задания (кроме своих)"""
-        user_tasks = []
-        
-        for task in self.tasks.values():
-            # Пропускаем свои задания
-            if task.creator_id == user_id:
-                continue
-            
-            # Только активные
-            if task.status != 'active':
-                continue
-            
-            # Проверяем, есть ли у пользователя нужная функция
-            creator = self.accounts.get(task.creator_id)
-            if not creator or not creator.active_functions.get(task.task_type):
-                continue
-            
-            user_tasks.append(task)
-        
-        return user_tasks
+    def _is_available(self, task_id: int) -> bool:
+        """У создателя включена функция этого типа задания"""
+        task = self.tasks[task_id]
+        creator = self.accounts.get(task.creator_id)
+        return bool(creator and creator.active_functions.get(task.task_type))
+    
+    def get_active_tasks(self, user_id: int, after: int = 0,
+                         limit: Optional[int] = None) -> List[Task]:
+        """Получить открытые задания (кроме своих и уже выполненных), по времени создания
+        
+        after - id последнего показанного задания, limit - размер страницы.
+        """
+        task_ids = self.task_index.page(user_id, after, limit, accept=self._is_available)
+        return [self.tasks[task_id] for task_id in task_ids]
+    
+    def count_active_tasks(self, user_id: int) -> int:
+        """Количество открытых заданий, кроме своих (O(1))"""
+        return self.task_index.open_count_for(user_id)
     
     # ============= ВЫПОЛНЕНИЕ ЗАДАНИЙ =============
     
@@ -253,12 +421,16 @@ class TrixActivityService:
             return False, "❌ Задание уже выполняется"
         
         # Замораживаем триксики исполнителю
-        account.frozen_trixiki += task.cost
+        self._post(account, FREEZE, frozen=task.cost, task_id=task_id)
         
         # Отмечаем задание
         task.performer_id = performer_id
+        self.task_index.taken(task)
         task.performed_at = datetime.now()
         task.confirmation_deadline = datetime.now() + timedelta(seconds=self.freeze_duration)
+        if self.ledger:
+            self.ledger.save_task(task)
+            self.ledger.create_confirmation(task, task.confirmation_deadline)
         
         # Добавляем в ожидающие подтверждения
         self.pending_confirmations[task_id] = {
@@ -269,6 +441,7 @@ class TrixActivityService:
             'deadline': task.confirmation_deadline,
             'cost': task.cost
         }
+        self._track_deadline(task_id, task.confirmation_deadline)
         
         logger.info(f"Task {task_id} performed by user {performer_id}")
         
@@ -291,20 +464,22 @@ class TrixActivityService:
         
         if task.performer_id is None:
             return False, "❌ Задание еще не выполняется"
-        
+
+        # Повторное подтверждение (или после автоподтверждения) выплатило бы награду второй раз
+        if task.status != 'active' or task_id not in self.pending_confirmations:
+            return False, "❌ Задание уже подтверждено или отклонено"
+
         performer = self.accounts.get(task.performer_id)
         creator = self.accounts.get(task.creator_id)
         
         if not performer or not creator:
             return False, "❌ Аккаунт не найден"
         
-        # Разморозить триксики исполнителю
-        performer.frozen_trixiki -= task.cost
-        
         if approve:
-            # Переводим триксики
-            performer.balance += task.cost
-            task.status = 'completed'
+            # Размораживаем и переводим триксики
+            self._post(performer, PAYOUT, task.cost, -task.cost, task_id=task_id)
+            self.task_index.set_status(task, 'completed')
+            task.completed_at = datetime.now()
             
             msg = (
                 f"✅ Задание #{task_id} подтверждено!\n"
@@ -312,7 +487,8 @@ class TrixActivityService:
             )
         else:
             # Отклоняем - будет отправлено админам
-            task.status = 'disputed'
+            self._post(performer, UNFREEZE, frozen=-task.cost, task_id=task_id)
+            self.task_index.set_status(task, 'disputed')
             
             msg = (
                 f"❌ Задание #{task_id} отклонено!\n"
@@ -322,36 +498,125 @@ class TrixActivityService:
         # Удаляем из ожидающих
         if task_id in self.pending_confirmations:
             del self.pending_confirmations[task_id]
+        if self.ledger:
+            self.ledger.save_task(task)
+            self.ledger.resolve_confirmation(task_id, 'approved' if approve else 'rejected', 'creator')
         
         logger.info(f"Task {task_id} {'approved' if approve else 'rejected'} by creator {user_id}")
         
         return True, msg
     
-    async def auto_confirm_expired_tasks(self) -> List[int]:
-        """Автоматическое подтверждение истекших заданий"""
-        confirmed = []
-        now = datetime.now()
+    def cancel_task(self, task_id: int, user_id: int) -> tuple[bool, str]:
+        """Создатель отменяет невыполненное задание - стоимость возвращается"""
+        task = self.tasks.get(task_id)
+        if not task:
+            return False, "❌ Задание не найдено"
+        
+        if task.creator_id != user_id:
+            return False, "❌ Вы не создатель этого задания"
+        
+        if task.status != 'active' or task.performer_id is not None:
+            return False, "❌ Задание уже выполняется или завершено"
+        
+        creator = self.accounts.get(user_id)
+        if not creator:
+            return False, "❌ Аккаунт не найден"
+        
+        self._post(creator, REFUND, task.cost, task_id=task_id)
+        self.task_index.set_status(task, 'cancelled')
+        if self.ledger:
+            self.ledger.save_task(task)
+        
+        logger.info(f"Task {task_id} cancelled by creator {user_id}, refunded {task.cost}")
+        return True, (
+            f"✅ Задание #{task_id} отменено\n"
+            f"💰 Возвращено {task.cost} триксиков"
+        )
+    
+    def _track_deadline(self, task_id: int, deadline: datetime):
+        """Поставить срок подтверждения в кучу"""
+        heap = self._deadlines
+        # Подтверждённые создателем остаются в куче - уплотняем, когда их больше половины
+        if len(heap) > 2 * len(self.pending_confirmations) + 64:
+            heap[:] = [
+                (c['deadline'], tid) for tid, c in self.pending_confirmations.items() if tid != task_id
+            ]
+            heapq.heapify(heap)
+        
+        heapq.heappush(heap, (deadline, task_id))
+        # Новый срок раньше текущего - переносим разовую задачу
+        if heap[0][1] == task_id:
+            self._reschedule()
+    
+    async def auto_confirm_expired_tasks(self, now: Optional[datetime] = None) -> List[int]:
+        """Автоматическое подтверждение истекших заданий
         
-        for task_id, confirmation in list(self.pending_confirmations.items()):
-            if confirmation['deadline'] < now:
+        Сроки извлекаются из кучи, выплаты пачки (до auto_confirm_batch заданий)
+        пишутся в журнал одной транзакцией.
+        """
+        confirmed = []
+        now = now or datetime.now()
+        heap = self._deadlines
+        
+        while heap and heap[0][0] <= now:
+            batch = []
+            while heap and heap[0][0] <= now and len(batch) < self.auto_confirm_batch:
+                deadline, task_id = heapq.heappop(heap)
+                confirmation = self.pending_confirmations.get(task_id)
+                # Подтверждено создателем - элемент кучи устарел
+                if confirmation is None or confirmation['deadline'] != deadline:
+                    continue
+                del self.pending_confirmations[task_id]
+                
                 task = self.tasks.get(task_id)
-                if task and task.status == 'active' and task.performer_id:
-                    
-                    performer = self.accounts.get(task.performer_id)
-                    if performer:
-                        # Автоподтверждение
-                        performer.frozen_trixiki -= task.cost
-                        performer.balance += task.cost
-                        task.status = 'completed'
-                        confirmed.append(task_id)
-                    
-                    del self.pending_confirmations[task_id]
+                if not task or task.status != 'active' or not task.performer_id:
+                    continue
+                performer = self.accounts.get(task.performer_id)
+                if not performer:
+                    continue
+                
+                # Автоподтверждение
+                self._post(performer, PAYOUT, task.cost, -task.cost, task_id=task_id)
+                self.task_index.set_status(task, 'completed')
+                task.completed_at = now
+                batch.append(task_id)
+                if self.ledger:
+                    self.ledger.save_task(task)
+                    self.ledger.resolve_confirmation(task_id, 'auto_confirmed', 'auto')
+            
+            if batch and self.ledger and not await self.ledger.commit():
+                logger.warning(f"Auto-confirm batch of {len(batch)} tasks not saved yet, will retry")
+            confirmed.extend(batch)
         
         if confirmed:
             logger.info(f"Auto-confirmed {len(confirmed)} tasks: {confirmed}")
         
         return confirmed
     
+    async def _on_deadline(self):
+        """Разовая задача планировщика: подтвердить истёкшие и встать на следующий срок"""
+        try:
+            await self.auto_confirm_expired_tasks()
+        finally:
+            self._reschedule()
+    
+    def _reschedule(self):
+        """Разовая задача планировщика на ближайший срок подтверждения"""
+        if self.is_running and self._deadlines:
+            scheduler_service.add_job(
+                self.AUTO_CONFIRM_JOB_ID, self._on_deadline,
+                DateTrigger(self._deadlines[0][0].timestamp()),
+                misfire_grace_time=float('inf'), persist=False
+            )
+    
+    async def start(self):
+        """Запуск автоподтверждения (истёкшие за время простоя подтвердятся сразу)"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._reschedule()
+        logger.info(f"✅ TrixActivity auto-confirm started ({len(self.pending_confirmations)} pending)")
+    
     # ============= ПРОВЕРКА ПОДПИСОК =============
     
     def request_subscription_check(self, user_id: int) -> tuple[bool, str]:
@@ -383,6 +648,7 @@ class TrixActivityService:
             return False, "❌ Пользователь не найден"
         
         self.accounts[user_id].enabled = True
+        self.save_account(user_id)
         return True, f"✅ Пользователь {user_id} включен"
     
     def admin_disable_user(self, user_id: int) -> tuple[bool, str]:
@@ -391,6 +657,7 @@ class TrixActivityService:
             return False, "❌ Пользователь не найден"
         
         self.accounts[user_id].enabled = False
+        self.save_account(user_id)
         return True, f"✅ Пользователь {user_id} отключен"
     
     def admin_add_trixiki(self, user_id: int, amount: int) -> tuple[bool, str]:
@@ -399,9 +666,9 @@ class TrixActivityService:
             return False, "❌ Пользователь не найден"
         
         account = self.accounts[user_id]
-        old_balance = account.balance
-        account.balance = min(account.balance + amount, account.max_balance)
-        added = account.balance - old_balance
+        added = min(account.balance + amount, account.max_balance) - account.balance
+        if added:
+            self._post(account, ADMIN_GRANT, added)
         
         return True, (
             f"✅ Добавлено {added} триксиков пользователю {user_id}\n"
@@ -419,6 +686,7 @@ class TrixActivityService:
             return False, "❌ Лимит уже на максимуме"
         
         account.max_balance = 20
+        self.save_account(user_id)
         return True, (
             f"✅ Лимит увеличен для пользователя {user_id}\n"
             f"📊 Новый максимум: 20 триксиков"
@@ -446,35 +714,110 @@ class TrixActivityService:
         
         return report
     
+    # ============= ПЕРСИСТЕНТНОСТЬ =============
+    
+    async def load(self, session_maker=None) -> int:
+        """Подключить журнал и восстановить состояние: снимки балансов + хвост проводок"""
+        if session_maker is None:
+            from services.db import db
+            session_maker = db.session_maker
+        if not session_maker:
+            return 0
+        
+        try:
+            ledger = TrixLedger(session_maker)
+            state = await ledger.fetch_state()
+        except Exception as e:
+            logger.error(f"Error loading TrixActivity state: {e}")
+            return 0
+        
+        for row in state['users']:
+            account = TrixikiAccount(row.user_id, row.username, on_balance_change=self._on_balance_change)
+            account.instagram = row.instagram
+            account.threads = row.threads
+            account._balance = row.balance or 0
+            account.max_balance = row.max_balance or 15
+            account.frozen_trixiki = row.frozen_trixiki or 0
+            account.last_daily_claim = row.last_daily_claim
+            account.ledger_seq = row.ledger_seq or 0
+            account.enabled = row.enabled if row.enabled is not None else True
+            account.active_functions = {
+                'like': row.active_like is not False,
+                'comment': row.active_comment is not False,
+                'follow': row.active_follow is not False
+            }
+            self.accounts[row.user_id] = account
+        
+        # Проводки после снимков
+        for entry in state['tail']:
+            account = self.accounts.get(entry.user_id)
+            if account is None:
+                account = TrixikiAccount(entry.user_id, str(entry.user_id),
+                                         on_balance_change=self._on_balance_change)
+                self.accounts[entry.user_id] = account
+            account._balance += entry.amount or 0
+            account.frozen_trixiki += entry.frozen or 0
+            if entry.kind == DAILY_CLAIM:
+                account.last_daily_claim = entry.created_at
+            account.ledger_seq = entry.seq
+        
+        for account in self.accounts.values():
+            self.leaderboard.update(account.user_id, account.balance)
+        
+        for row in state['tasks']:
+            task = Task(row.task_id, row.creator_id, row.task_type, row.content, row.cost)
+            task.created_at = row.created_at or task.created_at
+            task.status = row.status
+            task.performer_id = row.performer_id
+            task.performed_at = row.performed_at
+            task.confirmation_deadline = row.confirmation_deadline
+            self.tasks[task.task_id] = task
+            self.task_index.add(task)
+        self.task_counter = max(self.task_counter, state['max_task_id'] + 1)
+        
+        for row in state['confirmations']:
+            self.pending_confirmations[row.task_id] = {
+                'creator_id': row.creator_id,
+                'performer_id': row.performer_id,
+                'task_id': row.task_id,
+                'created_at': row.created_at,
+                'deadline': row.deadline,
+                'cost': row.amount
+            }
+            self._track_deadline(row.task_id, row.deadline)
+        
+        self.ledger = ledger
+        logger.info(
+            f"✅ TrixActivity loaded: {len(state['users'])} accounts, "
+            f"{len(state['tail'])} ledger entries replayed, {len(state['tasks'])} open tasks"
+        )
+        return len(self.accounts)
+    
+    async def stop(self):
+        """Остановить автоподтверждение, снять балансы и дописать журнал"""
+        self.is_running = False
+        scheduler_service.remove_job(self.AUTO_CONFIRM_JOB_ID)
+        if self.ledger:
+            await self.ledger.close()
+    
     # ============= СТАТИСТИКА =============
     
     def get_top_users(self, limit: int = 10) -> List[tuple]:
         """Получить топ пользователей по триксикам"""
-        sorted_users = sorted(
-            self.accounts.values(),
-            key=lambda a: a.balance,
-            reverse=True
-        )
-        
-        return [(u.username, u.balance, u.max_balance) for u in sorted_users[:limit]]
+        top = [self.accounts[user_id] for user_id, _ in self.leaderboard.top(limit)]
+        return [(u.username, u.balance, u.max_balance) for u in top]
     
     def get_task_stats(self) -> Dict:
-        """Получить статистику заданий"""
-        active = sum(1 for t in self.tasks.values() if t.status == 'active')
-        completed = sum(1 for t in self.tasks.values() if t.status == 'completed')
-        disputed = sum(1 for t in self.tasks.values() if t.status == 'disputed')
-        
-        by_type = {}
-        for task in self.tasks.values():
-            by_type.setdefault(task.task_type, 0)
-            by_type[task.task_type] += 1
-        
+        """Получить статистику заданий (счётчики индекса, без обхода заданий)"""
+        index = self.task_index
         return {
-            'active': active,
-            'completed': completed,
-            'disputed': disputed,
-            'total': len(self.tasks),
-            'by_type': by_type,
+            'active': index.count('active'),
+            'completed': index.count('completed'),
+            'disputed': index.count('disputed'),
+            'cancelled': index.count('cancelled'),
+            'open': index.open_count,
+            'total': len(index),
+            'by_type': {task_type: len(ids) for task_type, ids in index.by_type.items() if ids},
             'pending_confirmations': len(self.pending_confirmations)
         }
 
@@ -6,6 +6,7 @@ from services.admin_notifications import admin_notifications
 import logging
 import random
 from datetime import datetime
+from services.callback_registry import callback_registry
 
 logger = logging.getLogger(__name__)
 
@@ -136,14 +137,11 @@ async def trixtickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         parse_mode='Markdown'
     )
 
-async def handle_trixticket_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback для TrixTicket"""
+async def handle_trixticket_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str = None):
+    """Обработчик callback для TrixTicket (tt:<action>)"""
     query = update.callback_query
     await query.answer()
     
-    data = query.data.split(":")
-    action = data[1] if len(data) > 1 else None
-    
     if action == "myticket":
         await myticket_command(update, context)
     elif action == "winners":
@@ -477,6 +475,9 @@ async def trixticketclear_command(update: Update, context: ContextTypes.DEFAULT_
     
     await update.message.reply_text(text, parse_mode='Markdown')
 
+# Регистрация обработчиков callback-кнопок
+callback_registry.register('tt', handle_trixticket_callback, str)
+
 __all__ = [
     'tickets_command',
     'myticket_command',
@@ -113,17 +113,15 @@ async def init_database():
             raise
         
         logger.info("")
-        logger.info("🔄 Creating database tables...")
+        logger.info("🔄 Applying schema migrations...")
         
         try:
-            from models import Base
+            from services.migrations import migration_runner
             
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            
-            logger.info("✅ Database tables created successfully")
+            applied = await migration_runner.run(engine)
+            logger.info(f"✅ Schema at revision {migration_runner.head} ({applied} applied)")
         except Exception as create_error:
-            logger.error(f"❌ Failed to create tables: {create_error}")
+            logger.error(f"❌ Failed to migrate schema: {create_error}")
             raise
         
         logger.info("")
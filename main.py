@@ -4,18 +4,16 @@ import asyncio
 from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
-    CallbackQueryHandler, filters, ContextTypes
+    CallbackQueryHandler, TypeHandler, filters, ContextTypes
 )
 from dotenv import load_dotenv
 from config import Config
 
 # ============= HANDLERS - ОСНОВНЫЕ =============
 from handlers.start_handler import start_command, help_command, show_main_menu, show_write_menu
-from handlers.menu_handler import handle_menu_callback
-from handlers.publication_handler import handle_publication_callback, handle_text_input, handle_media_input
-from handlers.piar_handler import handle_piar_callback, handle_piar_text, handle_piar_photo
+from handlers.publication_handler import handle_text_input, handle_media_input
+from handlers.piar_handler import handle_piar_text, handle_piar_photo
 from handlers.moderation_handler import (
-    handle_moderation_callback,
     handle_moderation_text,
     ban_command,
     unban_command,
@@ -28,15 +26,14 @@ from handlers.moderation_handler import (
 )
 from handlers.rating_handler import (
     rate_start_command, toppeople_command, topboys_command, 
-    topgirls_command, toppeoplereset_command, handle_rate_callback,
-    handle_rate_moderation_callback
+    topgirls_command, toppeoplereset_command
 )
-from handlers.profile_handler import handle_profile_callback
 from handlers.basic_handler import id_command, participants_command, report_command
 from handlers.link_handler import trixlinks_command
 
 # ============= HANDLERS - ПРОДВИНУТАЯ МОДЕРАЦИЯ =============
 from handlers.advanced_moderation import (
+    enforce_slowmode,
     del_command,
     purge_command,
     slowmode_command,
@@ -48,7 +45,7 @@ from handlers.advanced_moderation import (
 )
 
 # ============= HANDLERS - АДМИН =============
-from handlers.admin_handler import admin_command, say_command, handle_admin_callback, broadcast_command, sendstats_command
+from handlers.admin_handler import admin_command, say_command, broadcast_command, sendstats_command, dbstats_command
 from handlers.autopost_handler import autopost_command, autopost_test_command
 
 # ============= HANDLERS - ИГРЫ =============
@@ -59,19 +56,18 @@ from handlers.games_handler import (
     gamesinfo_command, admgamesinfo_command, game_say_command,
     roll_participant_command, roll_draw_command,
     rollreset_command, rollstatus_command, mynumber_command,
-    handle_game_text_input, handle_game_media_input, handle_game_callback
+    handle_game_text_input, handle_game_media_input
 )
 
 
 # ============= HANDLERS - УТИЛИТЫ =============
-from handlers.medicine_handler import hp_command, handle_hp_callback
+from handlers.medicine_handler import hp_command
 from handlers.stats_commands import channelstats_command, fullstats_command, resetmsgcount_command, chatinfo_command
-from handlers.help_commands import trix_command, handle_trix_callback
+from handlers.help_commands import trix_command
 from handlers.social_handler import social_command, giveaway_command
 from handlers.bonus_handler import bonus_command
 from handlers.trix_activity_handlers import (
     liketime_command,
-    handle_lt_callback,
     handle_lt_text,
     show_main_menu,
     balance_command,
@@ -86,21 +82,48 @@ from handlers.trix_activity_handlers import (
 )
 # ============= HANDLERS - РОЗЫГРЫШИ =============
 from handlers.giveaway_handler import (
-    giveaway_command, handle_giveaway_callback, p2p_command
+    giveaway_command, p2p_command
 )
 from handlers.trixticket_handler import (
     tickets_command, myticket_command, trixtickets_command,
-    handle_trixticket_callback, givett_command, removett_command,
+    givett_command, removett_command,
     userstt_command, trixticketstart_command, ttrenumber_command,
     ttsave_command, trixticketclear_command
 )
 
+# ============= CALLBACK-КНОПКИ =============
+# Модули регистрируют свои префиксы в callback_registry при импорте
+import handlers.menu_handler  # noqa: F401
+import handlers.publication_handler  # noqa: F401
+import handlers.piar_handler  # noqa: F401
+import handlers.moderation_handler  # noqa: F401
+import handlers.rating_handler  # noqa: F401
+import handlers.profile_handler  # noqa: F401
+import handlers.admin_handler  # noqa: F401
+import handlers.games_handler  # noqa: F401
+import handlers.medicine_handler  # noqa: F401
+import handlers.help_commands  # noqa: F401
+import handlers.giveaway_handler  # noqa: F401
+import handlers.trixticket_handler  # noqa: F401
+import handlers.trix_activity_handlers  # noqa: F401
+
 # ============= SERVICES =============
 from services.autopost_service import autopost_service
 from services.admin_notifications import admin_notifications
 from services.stats_scheduler import stats_scheduler
 from services.channel_stats import channel_stats
 from services.db import db
+from services.user_store import user_store
+from services.activity_buffer import activity_buffer
+from services.timeseries import timeseries
+from services.expiring_store import expiring_store
+from services.scheduler_service import scheduler_service
+from handlers.trix_activity_service import trix_activity
+from services.broadcast_service import broadcast_service
+from services.telegram_scheduler import outbound_scheduler
+from services.callback_registry import callback_registry
+from services.query_stats import tag_update
+from handlers.services.rate_limiter import antiflood
 
 load_dotenv()
 
@@ -123,8 +146,6 @@ async def init_db_tables():
         
         logger.info(f"📊 Using database: {db_url[:50]}...")
         
-        from models import Base, User, Post
-        
         try:
             await db.init()
         except Exception as db_init_error:
@@ -143,44 +164,9 @@ async def init_db_tables():
             logger.error("❌ Database engine not created")
             return False
         
-        logger.info("✅ Database engine initialized")
-        
-        try:
-            async with db.engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            logger.info("✅ Database tables created")
-        except Exception as create_error:
-            logger.error(f"❌ Failed to create tables: {create_error}")
-            return False
+        logger.info("✅ Database ready")
+        return True
         
-        try:
-            async with db.get_session() as session:
-                from sqlalchemy import text
-                
-                if 'postgres' in db_url:
-                    result = await session.execute(
-                        text("SELECT COUNT(*) FROM information_schema.tables WHERE table_schema='public'")
-                    )
-                else:
-                    result = await session.execute(
-                        text("SELECT COUNT(*) FROM sqlite_master WHERE type='table'")
-                    )
-                
-                table_count = result.scalar()
-                logger.info(f"✅ Database tables verified: {table_count} tables found")
-                
-                if table_count == 0:
-                    logger.error("❌ No tables found in database!")
-                    return False
-            
-            logger.info("✅ Database ready")
-            return True
-            
-        except Exception as verify_error:
-            logger.warning(f"⚠️  Could not verify tables: {verify_error}")
-            logger.warning("   Continuing anyway...")
-            return True
-            
     except Exception as e:
         logger.error(f"❌ Database error: {e}", exc_info=True)
         logger.warning("⚠️  Bot will run in LIMITED MODE")
@@ -295,46 +281,10 @@ async def handle_all_callbacks(update: Update, context):
         logger.info(f"Ignored callback from Budapest chat: {query.data}")
         return
     
-    data_parts = query.data.split(":")
-    handler_type = data_parts[0] if data_parts else None
-    
     logger.info(f"Callback: {query.data} from user {update.effective_user.id}")
     
-    try:
-        if handler_type == "menu":
-            await handle_menu_callback(update, context)
-        elif handler_type == "pub":
-            await handle_publication_callback(update, context)
-        elif handler_type == "piar":
-            await handle_piar_callback(update, context)
-        elif handler_type == "mod":
-            await handle_moderation_callback(update, context)
-        elif handler_type == "admin":
-            await handle_admin_callback(update, context)
-        elif handler_type == "profile":
-            await handle_profile_callback(update, context)
-        elif handler_type == "game":
-            await handle_game_callback(update, context)
-        elif handler_type == "hp":
-            await handle_hp_callback(update, context)
-        elif handler_type == "trix":
-            await handle_trix_callback(update, context)
-        elif handler_type == "giveaway":
-            await handle_giveaway_callback(update, context)
-        elif handler_type == "tt":
-            await handle_trixticket_callback(update, context)
-        elif handler_type == "rate":
-            await handle_rate_callback(update, context)
-        elif handler_type == "rate_mod":
-            await handle_rate_moderation_callback(update, context)
-        else:
-            await query.answer("⚠️ Неизвестная команда", show_alert=True)
-    except Exception as e:
-        logger.error(f"Error handling callback: {e}", exc_info=True)
-        try:
-            await query.answer("❌ Ошибка", show_alert=True)
-        except:
-            pass
+    # Обработчики регистрируют свои префиксы в callback_registry при импорте модулей
+    await callback_registry.dispatch(update, context)
 
 
 async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -357,6 +307,10 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat_id in Config.STATS_CHANNELS.values():
         channel_stats.increment_message_count(chat_id)
     
+    # Медленный режим: сообщение раньше интервала удаляется
+    if update.effective_chat.type != 'private' and await enforce_slowmode(update):
+        return
+    
     waiting_for = context.user_data.get('waiting_for')
     
     try:
@@ -382,6 +336,15 @@ async def handle_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await handle_piar_text(update, context, field, text)
             return
         
+        # TrixActivity: аккаунты и ссылки для задания
+        lt_step = context.user_data.get('lt_step')
+        if lt_step in ('waiting_ig', 'waiting_threads') and update.message.text:
+            await handle_lt_text(update, context)
+            return
+        if lt_step and lt_step.startswith('create_') and update.message.text:
+            await handle_create_input(update, context)
+            return
+        
         # Rating handlers
         if waiting_for == 'rate_photo':
             from handlers.rating_handler import handle_rate_photo
@@ -417,6 +380,12 @@ async def error_handler(update: object, context):
         except:
             pass
 
+async def post_init(application: Application):
+    """Действия после инициализации бота (бот уже может отправлять запросы)"""
+    resumed = await broadcast_service.resume_pending()
+    if resumed:
+        logger.info(f"🔁 Resumed {resumed} broadcast(s)")
+
 def main():
     """Main function"""
     if not Config.BOT_TOKEN:
@@ -439,20 +408,40 @@ def main():
         print("⚠️ Database not available")
     else:
         print("✅ Database connected")
+        loop.run_until_complete(user_store.load())
+        loop.run_until_complete(expiring_store.load())
+        loop.run_until_complete(trix_activity.load())
+        loop.run_until_complete(channel_stats.load_message_counts())
     
     # Create application
-    application = Application.builder().token(Config.BOT_TOKEN).build()
+    # Все исходящие запросы проходят через общий планировщик с flood control
+    application = (
+        Application.builder()
+        .token(Config.BOT_TOKEN)
+        .rate_limiter(outbound_scheduler)
+        .post_init(post_init)
+        .build()
+    )
     
     # Setup services
     autopost_service.set_bot(application.bot)
     admin_notifications.set_bot(application.bot)
     channel_stats.set_bot(application.bot)
+    broadcast_service.set_bot(application.bot)
+    expiring_store.set_bot(application.bot)
     stats_scheduler.set_admin_notifications(admin_notifications)
     
     logger.info("✅ Services initialized")
     
     # ============= REGISTER HANDLERS =============
     
+    # Анти-флуд: обновления сверх лимита отбрасываются до обработчиков, работающих с БД
+    if Config.ANTIFLOOD_ENABLED:
+        application.add_handler(TypeHandler(Update, antiflood), group=-2)
+    
+    # Метка SQL-запросов по команде / префиксу callback (до всех остальных обработчиков)
+    application.add_handler(TypeHandler(Update, tag_update), group=-1)
+    
     # Start and basic commands
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
@@ -467,6 +456,9 @@ def main():
     application.add_handler(CommandHandler("participants", participants_command))
     application.add_handler(CommandHandler("report", report_command))
     
+    # TrixActivity: регистрация, дальше - кнопки lt:*
+    application.add_handler(CommandHandler("liketime", liketime_command))
+    
     # TrixTicket commands - User
     application.add_handler(CommandHandler("tickets", tickets_command))
     application.add_handler(CommandHandler("mytt", myticket_command))
@@ -477,6 +469,7 @@ def main():
     application.add_handler(CommandHandler("say", say_command))
     application.add_handler(CommandHandler("broadcast", broadcast_command))
     application.add_handler(CommandHandler("sendstats", sendstats_command))
+    application.add_handler(CommandHandler("dbstats", dbstats_command))
     
     # Stats commands
     application.add_handler(CommandHandler("channelstats", channelstats_command))
@@ -565,6 +558,21 @@ def main():
     loop.create_task(stats_scheduler.start())
     print("✅ Stats scheduler enabled")
     
+    # Write-behind сброс счётчиков активности
+    loop.create_task(activity_buffer.start())
+    
+    # Сроки кулдаунов, мутов и блокировок чатов
+    loop.create_task(expiring_store.start())
+    
+    # Автоподтверждение заданий TrixActivity (разовая задача на ближайший срок)
+    loop.create_task(trix_activity.start())
+    
+    # Временные ряды статистики каналов (сброс и чистка - задачи планировщика)
+    loop.create_task(timeseries.start())
+    
+    # Общий планировщик: статистика, автопост, сроки ограничений, автоподтверждение заданий
+    loop.create_task(scheduler_service.start())
+    
     logger.info("🤖 TrixBot starting...")
     print("\n" + "="*50)
     print("🤖 TRIXBOT IS READY!")
@@ -585,7 +593,9 @@ def main():
     try:
         application.run_polling(
             allowed_updates=["message", "callback_query"],
-            drop_pending_updates=True
+            drop_pending_updates=True,
+            # Цикл нужен после остановки: сервисы дописывают состояние в БД
+            close_loop=False
         )
     except KeyboardInterrupt:
         logger.info("Received KeyboardInterrupt")
@@ -596,13 +606,27 @@ def main():
     finally:
         print("🔄 Cleaning up...")
         
-        try:
-            loop.run_until_complete(stats_scheduler.stop())
-            loop.run_until_complete(autopost_service.stop())
-            loop.run_until_complete(db.close())
-            print("✅ Cleanup complete")
-        except Exception as cleanup_error:
-            logger.error(f"Error during cleanup: {cleanup_error}")
+        # Каждая остановка отдельно: ошибка одной не должна пропускать остальные
+        shutdown_steps = [
+            ('stats_scheduler', stats_scheduler.stop),
+            ('autopost_service', autopost_service.stop),
+            ('broadcast_service', broadcast_service.stop),
+            ('user_store', user_store.flush),
+            ('trix_activity', trix_activity.stop),
+            ('expiring_store', expiring_store.stop),
+            ('timeseries', timeseries.stop),
+            ('scheduler_service', scheduler_service.stop),
+            ('activity_buffer', activity_buffer.stop),
+            ('db', db.close),
+        ]
+        failed = 0
+        for name, stop in shutdown_steps:
+            try:
+                loop.run_until_complete(stop())
+            except Exception as cleanup_error:
+                failed += 1
+                logger.error(f"Error stopping {name}: {cleanup_error}")
+        print("✅ Cleanup complete" if not failed else f"⚠️ Cleanup finished with {failed} errors")
         
         try:
             pending = asyncio.all_tasks(loop)
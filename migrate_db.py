@@ -64,11 +64,13 @@ async def migrate_database():
                     await conn.execute(text("""
                         DROP TABLE IF EXISTS posts CASCADE;
                         DROP TABLE IF EXISTS users CASCADE;
+                        DROP TABLE IF EXISTS schema_migrations CASCADE;
                     """))
                 else:
                     # SQLite
                     await conn.execute(text("DROP TABLE IF EXISTS posts;"))
                     await conn.execute(text("DROP TABLE IF EXISTS users;"))
+                    await conn.execute(text("DROP TABLE IF EXISTS schema_migrations;"))
                 
             logger.info("✅ Таблицы удалены")
         except Exception as e:
@@ -77,10 +79,9 @@ async def migrate_database():
         # СОЗДАЕМ НОВЫЕ ТАБЛИЦЫ
         logger.info("🔨 СОЗДАЮ НОВЫЕ ТАБЛИЦЫ...")
         try:
-            from models import Base
+            from services.migrations import migration_runner
             
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
+            await migration_runner.run(engine)
             
             logger.info("✅ Таблицы созданы успешно")
         except Exception as e:
@@ -1,10 +1,10 @@
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, JSON, Enum as SQLEnum
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Float, Text, JSON, Index, Enum as SQLEnum
 from sqlalchemy.sql import func
 from datetime import datetime
 from enum import Enum
 
-Base = declarative_base()
+# Единый реестр метаданных для всех моделей (схема - services/migrations.py)
+from services.db import Base
 
 # ✅ ИСПРАВЛЕНО: Правильное определение enum с заглавными буквами
 class Gender(str, Enum):
@@ -53,3 +53,85 @@ class Post(Base):
     piar_telegram = Column(String(255), nullable=True)
     piar_price = Column(String(255), nullable=True)
     piar_description = Column(Text, nullable=True)
+    
+    __table_args__ = (
+        Index('ix_posts_status_created_at', 'status', 'created_at'),
+        Index('ix_posts_user_id', 'user_id'),
+    )
+
+class UserActivity(Base):
+    """Активность пользователя бота (сообщения, бан, мут)"""
+    __tablename__ = 'user_activity'
+    
+    id = Column(BigInteger, primary_key=True)
+    username = Column(String(255), index=True)
+    join_date = Column(DateTime, default=datetime.now)
+    last_activity = Column(DateTime, default=datetime.now, index=True)
+    message_count = Column(Integer, default=0)
+    banned = Column(Boolean, default=False, index=True)
+    ban_reason = Column(Text, nullable=True)
+    banned_at = Column(DateTime, nullable=True)
+    muted_until = Column(DateTime, nullable=True, index=True)
+
+class ChatMessageCount(Base):
+    """Счётчик сообщений в отслеживаемом чате"""
+    __tablename__ = 'chat_message_counts'
+    
+    chat_id = Column(BigInteger, primary_key=True)
+    message_count = Column(Integer, default=0)
+    last_reset = Column(DateTime, default=datetime.utcnow)  # UTC
+    updated_at = Column(DateTime, default=datetime.now)
+
+class BroadcastJob(Base):
+    """Задание рассылки с сохранённым прогрессом"""
+    __tablename__ = 'broadcast_jobs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    moderator = Column(String(255))
+    admin_chat_id = Column(BigInteger, nullable=True)
+    status_message_id = Column(BigInteger, nullable=True)
+    recipients = Column(JSON, default=list)
+    cursor = Column(Integer, default=0)  # все получатели до cursor обработаны
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    blocked = Column(Integer, default=0)
+    status = Column(String(20), default='running', index=True)  # running, completed
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class ExpiringState(Base):
+    """Ограничение со сроком действия (кулдаун, блокировка чата, медленный режим)"""
+    __tablename__ = 'expiring_state'
+    
+    namespace = Column(String(64), primary_key=True)
+    key = Column(BigInteger, primary_key=True, autoincrement=False)
+    value = Column(JSON, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)  # UTC, NULL - бессрочно
+
+class ScheduledJob(Base):
+    """Задача планировщика: описание триггера и сроки запусков"""
+    __tablename__ = 'scheduled_jobs'
+    
+    id = Column(String(128), primary_key=True)
+    func_ref = Column(String(255), nullable=False)  # module:qualname
+    trigger = Column(JSON, nullable=False)
+    args = Column(JSON, default=list)
+    kwargs = Column(JSON, default=dict)
+    next_run_at = Column(DateTime, nullable=True)  # UTC, по триггеру (без jitter)
+    last_run_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class TimeSeriesPoint(Base):
+    """Агрегат временного ряда за интервал: минута, час или сутки"""
+    __tablename__ = 'timeseries_points'
+    
+    metric = Column(String(32), primary_key=True)  # members, messages
+    chat_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    resolution = Column(Integer, primary_key=True, autoincrement=False)  # секунд в интервале
+    bucket = Column(DateTime, primary_key=True)  # UTC, начало интервала
+    samples = Column(Integer, default=0)
+    total = Column(Float, default=0)
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    last_value = Column(Float, nullable=True)
@@ -4,8 +4,19 @@
 
 __all__ = [
     'db',
+    'migrations',
+    'user_store',
+    'activity_buffer',
+    'broadcast_service',
+    'telegram_scheduler',
+    'callback_registry',
+    'query_stats',
+    'unit_of_work',
+    'cache_service',
+    'expiring_store',
     'cooldown',
     'scheduler_service',
+    'timeseries',
     'filter_service',
     'hashtags'
 ]
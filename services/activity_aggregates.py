@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальные агрегаты статистики пользователей
+Счётчики и почасовые множества активных вместо полных проходов по user_data
+"""
+import time
+from datetime import datetime
+from typing import Dict, Set
+
+# Сколько часовых корзин держим (7 дней)
+MAX_BUCKETS = 24 * 7
+
+class ActivityAggregates:
+    """Поддерживаемые счётчики: сообщения, активные за N часов (муты - в expiring_store)"""
+
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.total_messages = 0
+
+        # user_id -> час последней активности (epoch // 3600)
+        self._last_hour: Dict[int, int] = {}
+        # номер часа -> пользователи, чья последняя активность пришлась на этот час
+        self._buckets: Dict[int, Set[int]] = {}
+
+    # ============= СОБЫТИЯ =============
+
+    @staticmethod
+    def _hour(at: datetime) -> int:
+        """Номер часовой корзины для момента времени"""
+        return int(at.timestamp()) // 3600
+
+    def mark_active(self, user_id: int, at: datetime = None):
+        """Отметить активность пользователя: он переезжает в корзину более позднего часа"""
+        hour = self._hour(at) if at else int(time.time()) // 3600
+        last = self._last_hour.get(user_id)
+        if last is not None and hour <= last:
+            return
+        if hour <= self._current_hour() - self.max_buckets:
+            return
+
+        if last is not None:
+            self._discard(last, user_id)
+        self._last_hour[user_id] = hour
+
+        bucket = self._buckets.get(hour)
+        if bucket is None:
+            self._buckets[hour] = {user_id}
+            self._expire(hour)
+        else:
+            bucket.add(user_id)
+
+    def add_messages(self, count: int):
+        """Учесть новые сообщения"""
+        self.total_messages += count
+
+    def add_user(self, user: Dict):
+        """Учесть пользователя, попавшего в кэш"""
+        self.total_messages += user.get('message_count', 0)
+        if user.get('last_activity'):
+            self.mark_active(user['id'], user['last_activity'])
+
+    def remove_user(self, user: Dict):
+        """Убрать пользователя из агрегатов"""
+        user_id = user['id']
+        self.total_messages -= user.get('message_count', 0)
+
+        last = self._last_hour.pop(user_id, None)
+        if last is not None:
+            self._discard(last, user_id)
+
+    def _discard(self, hour: int, user_id: int):
+        """Убрать пользователя из корзины часа"""
+        bucket = self._buckets.get(hour)
+        if bucket is not None:
+            bucket.discard(user_id)
+            if not bucket:
+                del self._buckets[hour]
+
+    # ============= ЗАПРОСЫ =============
+
+    @staticmethod
+    def _current_hour() -> int:
+        return int(time.time()) // 3600
+
+    def _expire(self, now_hour: int):
+        """Удалить корзины старше окна вместе с их пользователями"""
+        oldest = now_hour - self.max_buckets
+        for hour in [h for h in self._buckets if h <= oldest]:
+            for user_id in self._buckets.pop(hour):
+                del self._last_hour[user_id]
+
+    def active_count(self, hours: int) -> int:
+        """Количество пользователей, активных за последние hours часов (с точностью до часа)"""
+        now_hour = self._current_hour()
+        self._expire(now_hour)
+
+        # Каждый пользователь лежит ровно в одной корзине - объединение не нужно
+        return sum(
+            len(users) for hour, users in self._buckets.items()
+            if hour > now_hour - hours
+        )
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind буфер счётчиков активности
+Копит дельты по пользователям и чатам и сбрасывает их в БД пачкой
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from config import Config
+from services.db import db
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном INSERT (лимит параметров SQLite/asyncpg)
+UPSERT_CHUNK = 500
+
+class ActivityBuffer:
+    """Агрегатор дельт сообщений с пакетным UPSERT"""
+
+    def __init__(self, flush_interval: float = None, max_events: int = None):
+        self.flush_interval = flush_interval or Config.ACTIVITY_FLUSH_INTERVAL
+        self.max_events = max_events or Config.ACTIVITY_FLUSH_MAX_EVENTS
+
+        # user_id -> {'username', 'join_date', 'last_activity', 'message_count'}
+        self._users: Dict[int, Dict] = {}
+        # chat_id -> {'message_count', 'reset_at', 'updated_at'}
+        self._chats: Dict[int, Dict] = {}
+        self._events = 0
+
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.is_running = False
+
+        # Метрики
+        self.flush_count = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.failed_flushes = 0
+        self.max_queue_depth = 0
+
+    # ============= НАКОПЛЕНИЕ =============
+
+    def add_user(self, user_id: int, username: str, join_date: datetime,
+                 last_activity: datetime, count: int = 1):
+        """Добавить дельту сообщений пользователя"""
+        if not db.session_maker:
+            return
+
+        entry = self._users.get(user_id)
+        if entry is None:
+            self._users[user_id] = {
+                'username': username,
+                'join_date': join_date,
+                'last_activity': last_activity,
+                'message_count': count
+            }
+        else:
+            entry['username'] = username
+            entry['last_activity'] = last_activity
+            entry['message_count'] += count
+
+        self._on_event()
+
+    def add_chat(self, chat_id: int, count: int = 1, at: Optional[datetime] = None):
+        """Добавить дельту сообщений чата (at - время, если вызывающий его уже знает)"""
+        if not db.session_maker:
+            return
+
+        now = at or datetime.now()
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            self._chats[chat_id] = {'message_count': count, 'reset_at': None, 'updated_at': now}
+        else:
+            entry['message_count'] += count
+            entry['updated_at'] = now
+
+        self._on_event()
+
+    def reset_chat(self, chat_id: int, reset_at: datetime):
+        """Обнулить счётчик чата (накопленная дельта отбрасывается)"""
+        if not db.session_maker:
+            return
+
+        self._chats[chat_id] = {'message_count': 0, 'reset_at': reset_at, 'updated_at': datetime.now()}
+        self._on_event()
+
+    def _on_event(self):
+        """Учесть событие и разбудить сброс при переполнении"""
+        self._events += 1
+        depth = self.queue_depth
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if self._events >= self.max_events:
+            self._wakeup.set()
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество строк, ожидающих записи"""
+        return len(self._users) + len(self._chats)
+
+    # ============= СБРОС =============
+
+    async def flush(self) -> int:
+        """Записать накопленные дельты одной транзакцией"""
+        async with self._lock:
+            if not self._users and not self._chats:
+                self._events = 0
+                return 0
+
+            users, self._users = self._users, {}
+            chats, self._chats = self._chats, {}
+            self._events = 0
+
+            started = time.monotonic()
+            try:
+                from models import UserActivity, ChatMessageCount
+
+                async with db.get_session() as session:
+                    rows = [{'id': user_id, **entry} for user_id, entry in users.items()]
+                    for i in range(0, len(rows), UPSERT_CHUNK):
+                        await session.execute(db.build_upsert(
+                            UserActivity.__table__, rows[i:i + UPSERT_CHUNK],
+                            index_elements=['id'],
+                            update_columns=['username', 'last_activity'],
+                            increment_columns=['message_count']
+                        ))
+
+                    increments = []
+                    resets = []
+                    for chat_id, entry in chats.items():
+                        row = {
+                            'chat_id': chat_id,
+                            'message_count': entry['message_count'],
+                            # UTC, как и reset_at (только для новой строки)
+                            'last_reset': entry['reset_at'] or datetime.utcnow(),
+                            'updated_at': entry['updated_at']
+                        }
+                        (resets if entry['reset_at'] else increments).append(row)
+
+                    for i in range(0, len(increments), UPSERT_CHUNK):
+                        await session.execute(db.build_upsert(
+                            ChatMessageCount.__table__, increments[i:i + UPSERT_CHUNK],
+                            index_elements=['chat_id'],
+                            update_columns=['updated_at'],
+                            increment_columns=['message_count']
+                        ))
+                    for i in range(0, len(resets), UPSERT_CHUNK):
+                        await session.execute(db.build_upsert(
+                            ChatMessageCount.__table__, resets[i:i + UPSERT_CHUNK],
+                            index_elements=['chat_id'],
+                            update_columns=['message_count', 'last_reset', 'updated_at']
+                        ))
+
+                    await session.commit()
+
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Error flushing activity buffer: {e}")
+                self._requeue(users, chats)
+                return 0
+
+            elapsed_ms = (time.monotonic() - started) * 1000
+            written = len(users) + len(chats)
+            self.flush_count += 1
+            self.rows_written += written
+            self.last_flush_ms = elapsed_ms
+            self.total_flush_ms += elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+            logger.debug(f"Activity flush: {written} rows in {elapsed_ms:.1f} ms")
+            return written
+
+    def _requeue(self, users: Dict[int, Dict], chats: Dict[int, Dict]):
+        """Вернуть несохранённые дельты в буфер"""
+        for user_id, entry in users.items():
+            current = self._users.get(user_id)
+            if current is None:
+                self._users[user_id] = entry
+            else:
+                current['message_count'] += entry['message_count']
+                current['join_date'] = entry['join_date']
+
+        for chat_id, entry in chats.items():
+            current = self._chats.get(chat_id)
+            if current is None:
+                self._chats[chat_id] = entry
+            elif not current['reset_at']:
+                # Новая дельта ложится поверх несохранённого сброса
+                current['message_count'] += entry['message_count']
+                current['reset_at'] = entry['reset_at']
+
+    # ============= ЖИЗНЕННЫЙ ЦИКЛ =============
+
+    async def start(self):
+        """Запуск фонового сброса"""
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"✅ Activity buffer started (every {self.flush_interval}s "
+            f"or {self.max_events} events)"
+        )
+
+    async def _run(self):
+        """Цикл: сброс по таймеру или по количеству событий"""
+        from services.query_stats import set_query_tag
+        set_query_tag('activity_buffer')
+
+        while self.is_running:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self.flush()
+
+    async def stop(self):
+        """Остановить цикл и дописать всё накопленное"""
+        self.is_running = False
+
+        if self._task:
+            # Будим цикл, чтобы он завершил текущий сброс и вышел
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        written = await self.flush()
+        logger.info(f"🛑 Activity buffer stopped, drained {written} rows")
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Метрики буфера"""
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'pending_events': self._events,
+            'flush_count': self.flush_count,
+            'failed_flushes': self.failed_flushes,
+            'rows_written': self.rows_written,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.flush_count, 2) if self.flush_count else 0.0
+        }
+
+    def format_report(self) -> str:
+        """Текст для администратора: очередь и время сброса"""
+        metrics = self.get_metrics()
+        return (
+            f"📥 Буфер активности\n\n"
+            f"Очередь: {metrics['queue_depth']} строк (макс. {metrics['max_queue_depth']}), "
+            f"событий: {metrics['pending_events']}\n"
+            f"Сбросов: {metrics['flush_count']} (ошибок: {metrics['failed_flushes']}), "
+            f"строк записано: {metrics['rows_written']}\n"
+            f"Сброс last/avg/max: {metrics['last_flush_ms']} / {metrics['avg_flush_ms']} / "
+            f"{metrics['max_flush_ms']} мс\n"
+        )
+
+# Глобальный экземпляр буфера
+activity_buffer = ActivityBuffer()
+
+__all__ = ['ActivityBuffer', 'activity_buffer']
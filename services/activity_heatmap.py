@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Heatmap активности чатов
+На чат - номер слота и два массива счётчиков: накопительный (день недели x час)
+и кольцо за последние 7 дней. Смещение часового пояса пересчитывается раз в минуту,
+поэтому учёт сообщения - пара целочисленных индексов без строк и новых объектов
+"""
+import logging
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+BUDAPEST_TZ = pytz.timezone('Europe/Budapest')
+
+HOURS = 24
+DAYS = 7
+CELLS = DAYS * HOURS
+
+# 1 января 1970 - четверг (понедельник = 0)
+_EPOCH_WEEKDAY = 3
+
+class ActivityHeatmap:
+    """Счётчики сообщений по часам в массивах, индексы - слот чата и час"""
+
+    def __init__(self, timezone=BUDAPEST_TZ):
+        self.timezone = timezone
+
+        # chat_id -> слот; массивы ниже индексируются слотом
+        self._slots: Dict[int, int] = {}
+        self._chat_ids: List[int] = []
+        # [день недели * 24 + час] - за всё время
+        self._cumulative: List[array] = []
+        # [(день % 7) * 24 + час] - последние 7 дней; _ring_days - какой день лежит в позиции
+        self._ring: List[array] = []
+        self._ring_days: List[array] = []
+
+        # Индексы текущей минуты (пересчитываются в _refresh)
+        self._valid_until = 0.0
+        self._day = 0
+        self._cumulative_cell = 0
+        self._ring_cell = 0
+        self._ring_pos = 0
+
+    def slot(self, chat_id: int) -> int:
+        """Слот чата (выделяется при первом обращении)"""
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            slot = self._slots[chat_id] = len(self._chat_ids)
+            self._chat_ids.append(chat_id)
+            self._cumulative.append(array('L', bytes(CELLS * array('L').itemsize)))
+            self._ring.append(array('L', bytes(CELLS * array('L').itemsize)))
+            self._ring_days.append(array('l', [-1] * DAYS))
+        return slot
+
+    def _refresh(self, now: float):
+        """Смещение пояса и индексы ячеек на текущую минуту"""
+        offset = datetime.fromtimestamp(now, self.timezone).utcoffset().total_seconds()
+        local = int(now + offset)
+        day, second = divmod(local, 86400)
+        hour = second // 3600
+
+        self._day = day
+        self._cumulative_cell = ((day + _EPOCH_WEEKDAY) % DAYS) * HOURS + hour
+        self._ring_pos = day % DAYS
+        self._ring_cell = self._ring_pos * HOURS + hour
+        self._valid_until = (now // 60 + 1) * 60
+
+    # ============= УЧЁТ (горячий путь) =============
+
+    def increment(self, chat_id: int, count: int = 1, now: Optional[float] = None):
+        """Учесть сообщения чата в текущем часе"""
+        if now is None:
+            now = time.time()
+        if now >= self._valid_until or now < self._valid_until - 60:
+            self._refresh(now)
+
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            slot = self.slot(chat_id)
+
+        self._cumulative[slot][self._cumulative_cell] += count
+
+        # Позиция кольца занята днём недельной давности - обнуляем её
+        ring_days = self._ring_days[slot]
+        pos = self._ring_pos
+        if ring_days[pos] != self._day:
+            ring = self._ring[slot]
+            start = pos * HOURS
+            for i in range(start, start + HOURS):
+                ring[i] = 0
+            ring_days[pos] = self._day
+        self._ring[slot][self._ring_cell] += count
+
+    # ============= ЗАПРОСЫ =============
+
+    @property
+    def chat_ids(self) -> List[int]:
+        return list(self._chat_ids)
+
+    def cumulative(self, chat_id: int) -> List[List[int]]:
+        """Накопительная матрица: 7 дней недели (пн - вс) x 24 часа"""
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            return [[0] * HOURS for _ in range(DAYS)]
+        cells = self._cumulative[slot]
+        return [list(cells[d * HOURS:(d + 1) * HOURS]) for d in range(DAYS)]
+
+    def rolling(self, chat_id: int, now: Optional[float] = None) -> List[List[int]]:
+        """Последние 7 дней по дням недели (пн - вс) x 24 часа"""
+        matrix = [[0] * HOURS for _ in range(DAYS)]
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            return matrix
+
+        self._refresh(now if now is not None else time.time())
+        ring, ring_days = self._ring[slot], self._ring_days[slot]
+        for pos in range(DAYS):
+            day = ring_days[pos]
+            if day < 0 or self._day - day >= DAYS:
+                continue
+            matrix[(day + _EPOCH_WEEKDAY) % DAYS] = list(ring[pos * HOURS:(pos + 1) * HOURS])
+        return matrix
+
+    def hourly(self, chat_id: int, rolling: bool = True, now: Optional[float] = None) -> List[int]:
+        """Сумма по часам суток (24 значения) за 7 дней или за всё время"""
+        matrix = self.rolling(chat_id, now) if rolling else self.cumulative(chat_id)
+        return [sum(day[hour] for day in matrix) for hour in range(HOURS)]
+
+    def reset(self, chat_id: int):
+        """Обнулить счётчики чата"""
+        slot = self._slots.get(chat_id)
+        if slot is None:
+            return
+        for cells in (self._cumulative[slot], self._ring[slot]):
+            for i in range(CELLS):
+                cells[i] = 0
+        for pos in range(DAYS):
+            self._ring_days[slot][pos] = -1
+
+    # ============= ЗАГРУЗКА =============
+
+    def load_hourly(self, chat_id: int, points: List[Dict], now: Optional[float] = None):
+        """Восстановить счётчики из часовых точек временного ряда ({'timestamp', 'total'})"""
+        now = now if now is not None else time.time()
+        self._refresh(now)
+        today = self._day
+        slot = self.slot(chat_id)
+
+        for point in points:
+            ts = point['timestamp']
+            count = int(point['total'])
+            offset = datetime.fromtimestamp(ts, self.timezone).utcoffset().total_seconds()
+            day, second = divmod(int(ts + offset), 86400)
+            hour = second // 3600
+
+            self._cumulative[slot][((day + _EPOCH_WEEKDAY) % DAYS) * HOURS + hour] += count
+
+            if 0 <= today - day < DAYS:
+                pos = day % DAYS
+                if self._ring_days[slot][pos] != day:
+                    for i in range(pos * HOURS, (pos + 1) * HOURS):
+                        self._ring[slot][i] = 0
+                    self._ring_days[slot][pos] = day
+                self._ring[slot][pos * HOURS + hour] += count
+
+        # Индексы текущей минуты остаются корректными
+        self._refresh(now)
+
+__all__ = ['ActivityHeatmap', 'HOURS', 'DAYS']
@@ -3,6 +3,7 @@ import logging
 from datetime import datetime
 from typing import Optional
 from config import Config
+from services.telegram_scheduler import bulk_priority
 
 logger = logging.getLogger(__name__)
 
@@ -129,19 +130,17 @@ class AdminNotificationService:
     
     async def send_statistics(self):
         """Отправить расширенную статистику в админскую группу"""
-        from data.user_data import user_data
+        from data.user_data import get_user_stats
         from data.games_data import word_games, roll_games
         from services.channel_stats import channel_stats
-        from datetime import timedelta
         
-        # Собираем статистику бота
-        total_users = len(user_data)
-        active_24h = sum(1 for data in user_data.values() if 
-                        datetime.now() - data['last_activity'] <= timedelta(days=1))
-        active_7d = sum(1 for data in user_data.values() if 
-                       datetime.now() - data['last_activity'] <= timedelta(days=7))
-        total_messages = sum(data['message_count'] for data in user_data.values())
-        banned_count = sum(1 for data in user_data.values() if data.get('banned'))
+        # Собираем статистику бота (поддерживаемые агрегаты, без прохода по пользователям)
+        stats = get_user_stats()
+        total_users = stats['total_users']
+        active_24h = stats['active_24h']
+        active_7d = stats['active_7d']
+        total_messages = stats['total_messages']
+        banned_count = stats['banned_count']
         
         # Собираем статистику игр
         games_stats = ""
@@ -152,9 +151,10 @@ class AdminNotificationService:
             
             games_stats += f"\n{version.upper()}: {active} Слов: {total_words}, Участников розыгрыша: {participants}"
         
-        # НОВОЕ: Собираем статистику каналов и чатов
+        # НОВОЕ: Собираем статистику каналов и чатов (массовые запросы уступают интерактивным)
         try:
-            channel_statistics = await channel_stats.get_all_stats()
+            with bulk_priority():
+                channel_statistics = await channel_stats.get_all_stats()
             channel_stats_text = "\n\n" + channel_stats.format_stats_message(channel_statistics)
         except Exception as e:
             logger.error(f"Error collecting channel stats: {e}")
@@ -170,12 +170,13 @@ class AdminNotificationService:
             f"• Забанено: {banned_count}\n\n"
             f"💬 СООБЩЕНИЯ:\n"
             f"• Всего: {total_messages}\n"
-            f"• Среднее на пользователя: {total_messages // total_users if total_users > 0 else 0}\n\n"
+            f"• Среднее на пользователя: {stats['avg_messages']}\n\n"
             f"🎮 ИГРЫ:{games_stats}"
             f"{channel_stats_text}"
         )
         
-        await self.send_notification(message)
+        with bulk_priority():
+            await self.send_notification(message)
         
         # Сбрасываем счетчики сообщений в чатах после отправки статистики
         for chat_id in Config.STATS_CHANNELS.values():
@@ -209,12 +210,31 @@ class AdminNotificationService:
         )
         await self.send_notification(message)
     
-    async def notify_broadcast(self, sent: int, failed: int, moderator: str):
-        """Уведомление о рассылке"""
-        message = (
-            f"📢 РАССЫЛКА ЗАВЕРШЕНА\n\n"
+    async def notify_broadcast(self, sent: int, failed: int, moderator: str,
+                               blocked: int = 0, total: Optional[int] = None,
+                               rate: Optional[float] = None, eta: Optional[float] = None,
+                               finished: bool = True):
+        """Уведомление о рассылке (итог или старт с оценкой времени)"""
+        title = "📢 РАССЫЛКА ЗАВЕРШЕНА" if finished else "📢 РАССЫЛКА ЗАПУЩЕНА"
+        message = f"{title}\n\n"
+        
+        if total is not None:
+            message += f"👥 Получателей: {total}\n"
+        
+        message += (
             f"✅ Отправлено: {sent}\n"
             f"❌ Не удалось: {failed}\n"
+        )
+        
+        if blocked:
+            message += f"🚫 Заблокировали бота (удалены): {blocked}\n"
+        if rate is not None:
+            message += f"⚡ Скорость: {rate:.1f} сообщ./сек\n"
+        if eta is not None:
+            label = "Длительность" if finished else "Ожидаемое время"
+            message += f"⏱️ {label}: {int(eta // 60)} мин {int(eta % 60)} сек\n"
+        
+        message += (
             f"👮 Инициатор: @{moderator}\n"
             f"⏰ Время: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
         )
@@ -1,14 +1,17 @@
 # -*- coding: utf-8 -*-
-import asyncio
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import logging
+import time
+from services.scheduler_service import scheduler_service, IntervalTrigger, DateTrigger, BUDAPEST_TZ
 
 logger = logging.getLogger(__name__)
 
 class AutopostService:
     """Сервис автопостинга сообщений"""
     
+    JOB_ID = 'autopost'
+    
     def __init__(self):
         self.data: Dict[str, Any] = {
             'enabled': False,
@@ -17,7 +20,6 @@ class AutopostService:
             'last_post': None,
             'target_chat_id': None
         }
-        self.task: Optional[asyncio.Task] = None
         self.bot = None
 
     def set_bot(self, bot):
@@ -25,7 +27,7 @@ class AutopostService:
         logger.info("Bot instance set for autopost service")
 
     async def start(self):
-        if self.task and not self.task.done():
+        if scheduler_service.get_job(self.JOB_ID):
             logger.warning("Autopost service already running")
             return
         
@@ -37,42 +39,33 @@ class AutopostService:
             logger.warning("No message set for autopost")
             return
         
-        self.task = asyncio.create_task(self._autopost_loop())
+        self._schedule_job()
         logger.info("Autopost service started")
 
     async def stop(self):
-        if self.task:
-            self.task.cancel()
-            try:
-                await self.task
-            except asyncio.CancelledError:
-                pass
-            self.task = None
+        scheduler_service.remove_job(self.JOB_ID)
         logger.info("Autopost service stopped")
 
-    async def _autopost_loop(self):
-        logger.info("Autopost loop started")
-        while True:
-            try:
-                if not self.data['enabled']:
-                    await asyncio.sleep(60)
-                    continue
-                
-                if await self._should_send_post():
-                    success = await self._send_autopost()
-                    if success:
-                        self.data['last_post'] = datetime.now()
-                        logger.info("Autopost sent successfully")
-                    else:
-                        logger.error("Failed to send autopost")
-                
-                await asyncio.sleep(60)
-            except asyncio.CancelledError:
-                logger.info("Autopost loop cancelled")
-                break
-            except Exception as e:
-                logger.error(f"Error in autopost loop: {e}")
-                await asyncio.sleep(60)
+    def _schedule_job(self):
+        """Поставить (или перепоставить) задачу автопоста с текущим интервалом"""
+        last_post = self.data['last_post']
+        first_run = last_post.timestamp() + self.data['interval'] if last_post else time.time()
+        scheduler_service.add_job(
+            self.JOB_ID, self._autopost_tick, IntervalTrigger(self.data['interval']),
+            next_run_at=max(first_run, time.time())
+        )
+
+    async def _autopost_tick(self):
+        """Запуск по расписанию планировщика"""
+        if not await self._should_send_post():
+            return
+        
+        success = await self._send_autopost()
+        if success:
+            self.data['last_post'] = datetime.now()
+            logger.info("Autopost sent successfully")
+        else:
+            logger.error("Failed to send autopost")
 
     async def _should_send_post(self) -> bool:
         if not self.data['enabled']:
@@ -84,10 +77,8 @@ class AutopostService:
         if not self.bot:
             logger.warning("Bot instance not set")
             return False
-        if not self.data['last_post']:
-            return True
-        time_since_last = datetime.now() - self.data['last_post']
-        return time_since_last >= timedelta(seconds=self.data['interval'])
+        # Интервал отсчитывает планировщик
+        return True
 
     async def _send_autopost(self) -> bool:
         if not self.bot or not self.data['target_chat_id']:
@@ -111,6 +102,8 @@ class AutopostService:
         if interval is not None:
             self.data['interval'] = max(60, interval)
             logger.info(f"Autopost interval updated: {self.data['interval']} seconds")
+            if scheduler_service.get_job(self.JOB_ID):
+                self._schedule_job()
         if enabled is not None:
             self.data['enabled'] = enabled
             logger.info(f"Autopost enabled: {enabled}")
@@ -125,14 +118,31 @@ class AutopostService:
             'interval': self.data['interval'],
             'last_post': self.data['last_post'],
             'target_chat_id': self.data['target_chat_id'],
-            'running': self.task is not None and not self.task.done(),
+            'running': scheduler_service.get_job(self.JOB_ID) is not None,
             'next_post': self._get_next_post_time()
         }
 
     def _get_next_post_time(self) -> Optional[datetime]:
-        if not self.data['enabled'] or not self.data['last_post']:
+        job = scheduler_service.get_job(self.JOB_ID)
+        if not self.data['enabled'] or not job or job.next_run is None:
             return None
-        return self.data['last_post'] + timedelta(seconds=self.data['interval'])
+        return datetime.fromtimestamp(job.next_run)
+
+    def schedule_once(self, hour: int, minute: int, message: str, chat_id: int) -> datetime:
+        """Разовый автопост в ближайшие hour:minute по Будапешту (переживает перезапуск)"""
+        now = datetime.now(BUDAPEST_TZ)
+        run_at = BUDAPEST_TZ.localize(
+            now.replace(tzinfo=None, hour=hour, minute=minute, second=0, microsecond=0)
+        )
+        if run_at <= now:
+            run_at = BUDAPEST_TZ.localize(run_at.replace(tzinfo=None) + timedelta(days=1))
+        
+        timestamp = run_at.timestamp()
+        scheduler_service.add_job(
+            f"autopost_once:{chat_id}:{int(timestamp)}", send_scheduled_autopost,
+            DateTrigger(timestamp), args=(chat_id, message)
+        )
+        return run_at
 
     async def send_test_post(self, chat_id: int) -> bool:
         if not self.bot:
@@ -151,3 +161,16 @@ class AutopostService:
 
 # Глобальный экземпляр
 autopost_service = AutopostService()
+
+async def send_scheduled_autopost(chat_id: int, message: str):
+    """Разовый автопост (функция уровня модуля - задача восстанавливается из БД после перезапуска)"""
+    if not autopost_service.bot:
+        logger.warning("Bot instance not set, scheduled autopost skipped")
+        return
+    
+    await autopost_service.bot.send_message(
+        chat_id=chat_id,
+        text=f"📢 **Автопост**\n\n{message}",
+        parse_mode='Markdown'
+    )
+    logger.info(f"Scheduled autopost sent to {chat_id}")
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Сервис рассылок
+Token bucket + ограниченная параллельность, RetryAfter, сохранение прогресса в БД
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from config import Config
+from services.db import db
+from services.telegram_scheduler import bulk_priority, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз пробуем отправить одному получателю при сетевых ошибках
+# (RetryAfter повторяет планировщик исходящих запросов)
+MAX_ATTEMPTS = 3
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (RetryAfter от Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        """Дождаться токена"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastService:
+    """Рассылка сообщений всем пользователям бота"""
+
+    def __init__(self):
+        self.bot = None
+        self.rate = Config.BROADCAST_RATE
+        self.concurrency = Config.BROADCAST_CONCURRENCY
+        self.progress_interval = Config.BROADCAST_PROGRESS_INTERVAL
+        self.active: Dict[int, asyncio.Task] = {}
+        self._local_ids = 0
+
+    def set_bot(self, bot):
+        """Устанавливает экземпляр бота"""
+        self.bot = bot
+        logger.info("Bot instance set for broadcast service")
+
+    # ============= ЗАПУСК =============
+
+    async def start(self, text: str, recipients: List[int], moderator: str,
+                    admin_chat_id: Optional[int] = None,
+                    status_message_id: Optional[int] = None) -> int:
+        """Создать задание рассылки и запустить его в фоне"""
+        job = {
+            'id': None,
+            'text': text,
+            'moderator': moderator,
+            'admin_chat_id': admin_chat_id,
+            'status_message_id': status_message_id,
+            'recipients': list(recipients),
+            'cursor': 0,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0
+        }
+
+        job['id'] = await self._create(job)
+
+        from services.admin_notifications import admin_notifications
+        await admin_notifications.notify_broadcast(
+            sent=0, failed=0, moderator=moderator,
+            total=len(job['recipients']),
+            rate=self.rate,
+            eta=len(job['recipients']) / self.rate,
+            finished=False
+        )
+
+        self._spawn(job)
+        return job['id']
+
+    async def resume_pending(self) -> int:
+        """Продолжить рассылки, прерванные перезапуском"""
+        if not db.session_maker:
+            return 0
+
+        try:
+            from models import BroadcastJob
+            from sqlalchemy import select
+
+            async with db.get_session() as session:
+                result = await session.execute(
+                    select(BroadcastJob).where(BroadcastJob.status == 'running')
+                )
+                rows = result.scalars().all()
+
+            for row in rows:
+                job = {
+                    'id': row.id,
+                    'text': row.text,
+                    'moderator': row.moderator,
+                    'admin_chat_id': row.admin_chat_id,
+                    'status_message_id': row.status_message_id,
+                    'recipients': list(row.recipients or []),
+                    'cursor': row.cursor or 0,
+                    'sent': row.sent or 0,
+                    'failed': row.failed or 0,
+                    'blocked': row.blocked or 0
+                }
+                logger.info(
+                    f"🔁 Resuming broadcast #{job['id']} from "
+                    f"{job['cursor']}/{len(job['recipients'])}"
+                )
+                self._spawn(job)
+
+            return len(rows)
+
+        except Exception as e:
+            logger.error(f"Error resuming broadcasts: {e}")
+            return 0
+
+    def _spawn(self, job: Dict):
+        """Запустить фоновую задачу рассылки"""
+        task = asyncio.create_task(self._run(job))
+        self.active[job['id']] = task
+        task.add_done_callback(lambda _: self.active.pop(job['id'], None))
+
+    async def stop(self):
+        """Остановить активные рассылки, сохранив прогресс"""
+        tasks = list(self.active.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ============= ВЫПОЛНЕНИЕ =============
+
+    async def _run(self, job: Dict):
+        """Разослать сообщение оставшимся получателям"""
+        # Рассылка уступает очередь интерактивным ответам
+        with bulk_priority():
+            await self._run_job(job)
+
+    async def _run_job(self, job: Dict):
+        """Выполнение задания рассылки"""
+        recipients = job['recipients']
+        total = len(recipients)
+        bucket = TokenBucket(self.rate)
+
+        started = time.monotonic()
+        started_cursor = job['cursor']
+        pending = iter(range(job['cursor'], total))
+        done = set()
+        last_report = started
+
+        async def worker():
+            nonlocal last_report
+            for index in pending:
+                user_id = recipients[index]
+                result = await self._deliver(bucket, user_id, job['text'])
+                job[result] += 1
+
+                if result == 'blocked':
+                    from services.user_store import user_store
+                    # Забаненных не удаляем - иначе бан пропадёт, когда пользователь вернётся
+                    if not user_store.is_banned(user_id):
+                        user_store.remove(user_id)
+
+                # Двигаем курсор по непрерывному префиксу обработанных
+                done.add(index)
+                while job['cursor'] in done:
+                    done.remove(job['cursor'])
+                    job['cursor'] += 1
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    await self._save(job)
+                    await self._report(job, started, started_cursor)
+
+        try:
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, total) or 1)]
+            try:
+                await asyncio.gather(*workers)
+            except asyncio.CancelledError:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+
+            job['cursor'] = total
+            await self._save(job, status='completed')
+            await self._report(job, started, started_cursor, finished=True)
+
+            elapsed = time.monotonic() - started
+            from services.admin_notifications import admin_notifications
+            await admin_notifications.notify_broadcast(
+                sent=job['sent'],
+                failed=job['failed'],
+                moderator=job['moderator'],
+                blocked=job['blocked'],
+                total=total,
+                rate=(total - started_cursor) / elapsed if elapsed > 0 else None,
+                eta=elapsed
+            )
+
+            logger.info(
+                f"✅ Broadcast #{job['id']} finished: sent={job['sent']}, "
+                f"failed={job['failed']}, blocked={job['blocked']}"
+            )
+
+        except asyncio.CancelledError:
+            await self._save(job)
+            logger.info(f"⏸️ Broadcast #{job['id']} paused at {job['cursor']}/{total}")
+            raise
+        except Exception as e:
+            await self._save(job)
+            logger.error(f"Error in broadcast #{job['id']}: {e}", exc_info=True)
+
+    async def _deliver(self, bucket: TokenBucket, user_id: int, text: str) -> str:
+        """Отправить одно сообщение: 'sent', 'failed' или 'blocked'"""
+        for _ in range(MAX_ATTEMPTS):
+            await bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return 'sent'
+            except RetryAfter as e:
+                # Планировщик уже выждал и повторил TG_MAX_RETRIES раз - только притормаживаем
+                # остальных исполнителей рассылки и считаем сообщение неотправленным
+                seconds = retry_after_seconds(e)
+                logger.warning(f"Broadcast flood control: pausing for {seconds}s, {user_id} skipped")
+                bucket.pause(seconds)
+                return 'failed'
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    return 'blocked'
+                logger.error(f"Failed to send broadcast to {user_id}: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Network error sending broadcast to {user_id}: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Failed to send broadcast to {user_id}: {e}")
+                return 'failed'
+
+        return 'failed'
+
+    # ============= ПРОГРЕСС =============
+
+    @staticmethod
+    def format_progress(job: Dict, rate: Optional[float], finished: bool = False) -> str:
+        """Текст статуса рассылки"""
+        total = len(job['recipients'])
+        processed = job['cursor']
+        percent = processed * 100 // total if total else 100
+
+        title = "✅ **Рассылка завершена!**" if finished else "📢 **Идёт рассылка...**"
+        text = (
+            f"{title}\n\n"
+            f"📤 Отправлено: {job['sent']}\n"
+            f"❌ Не удалось: {job['failed']}\n"
+            f"🚫 Заблокировали бота: {job['blocked']}\n"
+            f"📊 Прогресс: {processed}/{total} ({percent}%)\n"
+        )
+
+        if rate:
+            text += f"⚡ Скорость: {rate:.1f} сообщ./сек\n"
+            if not finished:
+                eta = (total - processed) / rate
+                text += f"⏱️ Осталось: ~{int(eta // 60)} мин {int(eta % 60)} сек\n"
+
+        return text
+
+    async def _report(self, job: Dict, started: float, started_cursor: int, finished: bool = False):
+        """Обновить статусное сообщение администратора"""
+        if not self.bot or not job['admin_chat_id'] or not job['status_message_id']:
+            return
+
+        elapsed = time.monotonic() - started
+        rate = (job['cursor'] - started_cursor) / elapsed if elapsed > 0 else None
+
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job['admin_chat_id'],
+                message_id=job['status_message_id'],
+                text=self.format_progress(job, rate, finished),
+                parse_mode='Markdown'
+            )
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"Could not update broadcast status: {e}")
+        except Exception as e:
+            logger.warning(f"Could not update broadcast status: {e}")
+
+    # ============= ПЕРСИСТЕНТНОСТЬ =============
+
+    async def _create(self, job: Dict) -> int:
+        """Сохранить новое задание, вернуть его ID"""
+        if db.session_maker:
+            try:
+                from models import BroadcastJob
+
+                async with db.get_session() as session:
+                    row = BroadcastJob(
+                        text=job['text'],
+                        moderator=job['moderator'],
+                        admin_chat_id=job['admin_chat_id'],
+                        status_message_id=job['status_message_id'],
+                        recipients=job['recipients']
+                    )
+                    session.add(row)
+                    await session.commit()
+                    return row.id
+            except Exception as e:
+                logger.error(f"Error saving broadcast job: {e}")
+
+        # Без БД задание живёт только в памяти
+        self._local_ids -= 1
+        return self._local_ids
+
+    async def _save(self, job: Dict, status: str = 'running'):
+        """Сохранить прогресс задания"""
+        if not db.session_maker or job['id'] < 0:
+            return
+
+        try:
+            from models import BroadcastJob
+            from sqlalchemy import update
+
+            async with db.get_session() as session:
+                await session.execute(
+                    update(BroadcastJob)
+                    .where(BroadcastJob.id == job['id'])
+                    .values(
+                        cursor=job['cursor'],
+                        sent=job['sent'],
+                        failed=job['failed'],
+                        blocked=job['blocked'],
+                        status=status,
+                        updated_at=datetime.now()
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error saving broadcast progress: {e}")
+
+# Глобальный экземпляр сервиса
+broadcast_service = BroadcastService()
+
+__all__ = ['TokenBucket', 'BroadcastService', 'broadcast_service']
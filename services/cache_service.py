@@ -1,15 +1,228 @@
-# services/cache_service.py
+# -*- coding: utf-8 -*-
+"""
+Асинхронный TTL + LRU кэш
+Ограничение по числу записей и примерному размеру, монотонные часы, single-flight загрузка,
+кэширование отсутствующих значений и счётчики попаданий
+"""
+import asyncio
+import functools
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Значение "загрузчик вернул None" (негативное кэширование)
+_NEGATIVE = object()
+_MISSING = object()
+
+def approx_size(value: Any, _depth: int = 0) -> int:
+    """Примерный размер значения в байтах (контейнеры - на 3 уровня вглубь)"""
+    size = sys.getsizeof(value)
+    if _depth < 3:
+        if isinstance(value, dict):
+            size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(approx_size(item, _depth + 1) for item in value)
+    return size
+
 class CacheService:
-    def __init__(self, ttl: int = 300):
-        self._cache = {}
-        self.ttl = ttl
-    
-    async def get(self, key: str):
-        if key in self._cache:
-            value, timestamp = self._cache[key]
-            if (datetime.now() - timestamp).total_seconds() < self.ttl:
-                return value
-        return None
-    
-    async def set(self, key: str, value):
-        self._cache[key] = (value, datetime.now())
+    """LRU-кэш с TTL на запись: get/set O(1), вытеснение самых старых по обращению"""
+
+    def __init__(self, name: str = 'default', max_entries: int = None, max_bytes: int = None,
+                 ttl: float = None, negative_ttl: float = None):
+        self.name = name
+        self.max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        self.ttl = Config.CACHE_DEFAULT_TTL if ttl is None else ttl
+        self.negative_ttl = Config.CACHE_NEGATIVE_TTL if negative_ttl is None else negative_ttl
+
+        # key -> (value, expires_at, size); порядок - от давно использованных к недавним
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.bytes = 0
+
+        # Счётчики
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ============= ЧТЕНИЕ / ЗАПИСЬ =============
+
+    def _lookup(self, key: Hashable) -> Any:
+        """Значение, _NEGATIVE или _MISSING; обновляет LRU-порядок и счётчики"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return _MISSING
+
+        value, expires_at, _ = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return _MISSING
+
+        self._entries.move_to_end(key)
+        if value is _NEGATIVE:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение из кэша или default"""
+        value = self._lookup(key)
+        if value is _MISSING or value is _NEGATIVE:
+            return default
+        return value
+
+    async def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Положить значение (ttl=None - TTL кэша, 0 - без срока)"""
+        self._store(key, value, self.ttl if ttl is None else ttl)
+
+    def _store(self, key: Hashable, value: Any, ttl: float):
+        if key in self._entries:
+            self._remove(key)
+
+        size = approx_size(value) if value is not _NEGATIVE else 0
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (value, expires_at, size)
+        self.bytes += size
+
+        # Вытесняем самые давно использованные
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    async def delete(self, key: Hashable):
+        """Удалить значение"""
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate_prefix(self, prefix: str) -> int:
+        """Удалить все строковые ключи с префиксом"""
+        keys = [k for k in self._entries if isinstance(k, str) and k.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        """Очистить кэш"""
+        self._entries.clear()
+        self.bytes = 0
+
+    # ============= ЗАГРУЗКА =============
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = None, negative_ttl: Optional[float] = None) -> Any:
+        """Значение из кэша или из loader(); одновременные промахи по ключу - один вызов loader
+
+        None от loader кэшируется на negative_ttl; исключения не кэшируются.
+        """
+        value = self._lookup(key)
+        if value is _NEGATIVE:
+            return None
+        if value is not _MISSING:
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменили загружавшую задачу, а не нас - загружаем сами
+                if future.cancelled():
+                    return await self.get_or_load(key, loader, ttl, negative_ttl)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.loads += 1
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получат ожидающие; без них не логируем "never retrieved"
+            future.exception()
+            raise
+        else:
+            if value is None:
+                self._store(key, _NEGATIVE, self.negative_ttl if negative_ttl is None else negative_ttl)
+            else:
+                self._store(key, value, self.ttl if ttl is None else ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    # ============= МЕТРИКИ =============
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Счётчики кэша"""
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.negative_hits) / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'loads': self.loads,
+            'coalesced': self.coalesced
+        }
+
+def cached(cache: Optional[CacheService] = None, ttl: Optional[float] = None,
+           key: Optional[Callable[..., Hashable]] = None, negative_ttl: Optional[float] = None):
+    """Декоратор async-функции: результат кэшируется по key(*args, **kwargs)
+
+    Без key ключ - имя функции и аргументы (они должны быть hashable).
+    Обёртка получает атрибут .cache для инвалидации.
+    """
+    def decorator(func):
+        target = cache or cache_service
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if key is not None:
+                cache_key = key(*args, **kwargs)
+            else:
+                cache_key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+            return await target.get_or_load(
+                cache_key, lambda: func(*args, **kwargs), ttl=ttl, negative_ttl=negative_ttl
+            )
+
+        wrapper.cache = target
+        return wrapper
+    return decorator
+
+# Общий кэш бота: метаданные чатов, строки пользователей, меню
+cache_service = CacheService('shared')
+
+__all__ = ['CacheService', 'cache_service', 'cached', 'approx_size']
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Реестр обработчиков callback-кнопок
+Модули регистрируют префикс и типы аргументов, main диспетчеризует одним поиском в словаре
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from services.unit_of_work import unit_of_work
+
+logger = logging.getLogger(__name__)
+
+class CallbackParseError(ValueError):
+    """callback_data не соответствует объявленным типам аргументов"""
+
+class CallbackRoute:
+    """Маршрут: префикс -> обработчик + парсеры аргументов"""
+
+    def __init__(self, prefix: str, handler: Callable, arg_types: tuple):
+        self.prefix = prefix
+        self.handler = handler
+        self.arg_types = arg_types
+
+        # Метрики
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=500)
+
+    def parse(self, parts: List[str]) -> List[Any]:
+        """Привести части callback_data к объявленным типам (недостающие - None)"""
+        args = []
+        for i, arg_type in enumerate(self.arg_types):
+            if i >= len(parts) or parts[i] == '':
+                args.append(None)
+                continue
+            try:
+                args.append(arg_type(parts[i]))
+            except (TypeError, ValueError) as e:
+                raise CallbackParseError(f"{self.prefix}: argument {i} {parts[i]!r}: {e}")
+        return args
+
+    def record(self, elapsed_ms: float, failed: bool):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.samples.append(elapsed_ms)
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        if failed:
+            self.errors += 1
+
+class CallbackRegistry:
+    """Диспетчер callback_query по префиксу до первого ':'"""
+
+    def __init__(self):
+        self.routes: Dict[str, CallbackRoute] = {}
+        self.unknown = 0
+
+    def register(self, prefix: str, handler: Callable, *arg_types: Callable):
+        """Зарегистрировать обработчик префикса
+
+        Без arg_types обработчик вызывается как handler(update, context) и сам разбирает query.data.
+        С arg_types - handler(update, context, *args), где args уже приведены к типам.
+        """
+        if prefix in self.routes and self.routes[prefix].handler is not handler:
+            logger.warning(f"Callback prefix '{prefix}' re-registered")
+
+        self.routes[prefix] = CallbackRoute(prefix, handler, arg_types)
+
+    def route(self, prefix: str, *arg_types: Callable):
+        """Декоратор для register"""
+        def decorator(handler: Callable) -> Callable:
+            self.register(prefix, handler, *arg_types)
+            return handler
+        return decorator
+
+    async def dispatch(self, update, context) -> bool:
+        """Вызвать обработчик для update.callback_query, False - префикс не найден"""
+        query = update.callback_query
+        prefix, _, rest = query.data.partition(':')
+
+        route = self.routes.get(prefix)
+        if route is None:
+            self.unknown += 1
+            await query.answer("⚠️ Неизвестная команда", show_alert=True)
+            return False
+
+        started = time.monotonic()
+        failed = False
+        try:
+            # Общая сессия на всё обновление, commit - после обработчика
+            async with unit_of_work():
+                if route.arg_types:
+                    args = route.parse(rest.split(':') if rest else [])
+                    await route.handler(update, context, *args)
+                else:
+                    await route.handler(update, context)
+        except CallbackParseError as e:
+            failed = True
+            logger.warning(f"Bad callback data {query.data!r}: {e}")
+            await self._answer_error(query, "⚠️ Неверные данные кнопки")
+        except Exception as e:
+            failed = True
+            logger.error(f"Error handling callback: {e}", exc_info=True)
+            await self._answer_error(query, "❌ Ошибка")
+        finally:
+            route.record((time.monotonic() - started) * 1000, failed)
+
+        return True
+
+    @staticmethod
+    async def _answer_error(query, text: str):
+        try:
+            await query.answer(text, show_alert=True)
+        except Exception:
+            pass
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Количество вызовов, ошибок и задержки (мс) по префиксам"""
+        metrics = {}
+        for prefix, route in self.routes.items():
+            samples = sorted(route.samples)
+            count = len(samples)
+            metrics[prefix] = {
+                'calls': route.calls,
+                'errors': route.errors,
+                'avg_ms': round(route.total_ms / route.calls, 1) if route.calls else 0.0,
+                'p95_ms': round(samples[min(count - 1, int(count * 0.95))], 1) if count else 0.0,
+                'max_ms': round(route.max_ms, 1)
+            }
+        return metrics
+
+# Глобальный реестр
+callback_registry = CallbackRegistry()
+
+__all__ = ['CallbackRegistry', 'CallbackParseError', 'callback_registry']
@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 from config import Config
+from services.activity_buffer import activity_buffer
+from services.cache_service import cached
+from services.timeseries import timeseries, MEMBERS, MESSAGES, HOUR
+from services.activity_heatmap import ActivityHeatmap
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -10,6 +16,16 @@ logger = logging.getLogger(__name__)
 # Timezone Будапешта
 BUDAPEST_TZ = pytz.timezone('Europe/Budapest')
 
+@cached(ttl=Config.CHAT_INFO_CACHE_TTL, key=lambda bot, chat_id: f"chat:{chat_id}")
+async def get_chat_cached(bot, chat_id: int):
+    """Chat из кэша: название и тип меняются редко"""
+    return await bot.get_chat(chat_id)
+
+@cached(ttl=Config.MEMBER_COUNT_CACHE_TTL, key=lambda bot, chat_id: f"members:{chat_id}")
+async def get_member_count_cached(bot, chat_id: int) -> int:
+    """Число участников чата из кэша"""
+    return await bot.get_chat_member_count(chat_id)
+
 class ChannelStatsService:
     """Сервис для сбора статистики каналов и хeatmap активности"""
     
@@ -17,7 +33,17 @@ class ChannelStatsService:
         self.bot = None
         self.previous_stats = {}  # Хранилище предыдущей статистики
         self.chat_messages = {}   # Счетчик сообщений в чатах
-        self.hourly_activity = {} # Heatmap активности по часам
+        self.heatmap = ActivityHeatmap(BUDAPEST_TZ)  # Heatmap активности по часам
+        for chat_id in Config.STATS_CHANNELS.values():
+            self.heatmap.slot(chat_id)
+        
+        # Часы текущей минуты для учёта сообщений (пересчитываются в _tick)
+        self._minute = 0
+        self._minute_until = 0.0
+        self._minute_local: Optional[datetime] = None
+        self._minute_naive: Optional[datetime] = None
+        # chat_id -> ключ минутного агрегата сообщений
+        self._message_slots: Dict[int, tuple] = {}
     
     def set_bot(self, bot):
         """Устанавливает экземпляр бота"""
@@ -31,16 +57,23 @@ class ChannelStatsService:
                 logger.warning("Bot instance not set")
                 return None
             
-            # Получаем информацию о чате
-            chat = await self.bot.get_chat(channel_id)
+            # Название и тип - из кэша, к API идёт только число участников
+            chat = await asyncio.wait_for(
+                get_chat_cached(self.bot, channel_id), Config.STATS_CALL_TIMEOUT
+            )
             
             # Получаем количество участников
             try:
-                member_count = await self.bot.get_chat_member_count(channel_id)
+                member_count = await asyncio.wait_for(
+                    get_member_count_cached(self.bot, channel_id), Config.STATS_CALL_TIMEOUT
+                )
             except Exception as e:
                 logger.warning(f"Could not get member count for {channel_name}: {e}")
                 member_count = None
             
+            if member_count is not None:
+                timeseries.record(MEMBERS, channel_id, member_count)
+            
             # Вычисляем изменения
             previous_count = self.previous_stats.get(channel_name, {}).get('member_count', 0)
             change = member_count - previous_count if member_count and previous_count else 0
@@ -64,6 +97,13 @@ class ChannelStatsService:
             logger.info(f"Stats collected for {channel_name}: {member_count} members")
             return stats
             
+        except asyncio.TimeoutError:
+            logger.warning(f"Timeout getting stats for {channel_name} ({channel_id})")
+            return {
+                'name': channel_name,
+                'error': 'timeout',
+                'timestamp': datetime.now(BUDAPEST_TZ)
+            }
         except Exception as e:
             logger.error(f"Error getting stats for {channel_name} ({channel_id}): {e}")
             return {
@@ -100,95 +140,160 @@ class ChannelStatsService:
                 'timestamp': datetime.now(BUDAPEST_TZ)
             }
     
+    def _tick(self, now: float):
+        """Время и ключи отсчётов на текущую минуту"""
+        self._minute = int(now // 60)
+        self._minute_until = (self._minute + 1) * 60
+        self._minute_local = datetime.fromtimestamp(now, BUDAPEST_TZ)
+        self._minute_naive = datetime.fromtimestamp(now)
+        self._message_slots.clear()
+    
     def increment_message_count(self, chat_id: int):
-        """Увеличить счетчик сообщений для чата"""
-        if chat_id not in self.chat_messages:
-            self.chat_messages[chat_id] = {
+        """Увеличить счетчик сообщений для чата (время - с точностью до минуты)"""
+        now = time.time()
+        if now >= self._minute_until or now < self._minute_until - 60:
+            self._tick(now)
+        
+        entry = self.chat_messages.get(chat_id)
+        if entry is None:
+            entry = self.chat_messages[chat_id] = {
                 'count': 0,
-                'last_reset': datetime.now(BUDAPEST_TZ)
+                'last_reset': self._minute_local
             }
+        entry['count'] += 1
         
-        self.chat_messages[chat_id]['count'] += 1
-        
-        # НОВОЕ: Добавляем в heatmap активности
-        current_hour = datetime.now(BUDAPEST_TZ).hour
-        chat_name = self._get_chat_name_by_id(chat_id)
+        activity_buffer.add_chat(chat_id, at=self._minute_naive)
         
-        if chat_name not in self.hourly_activity:
-            self.hourly_activity[chat_name] = {f"{h:02d}:00": 0 for h in range(24)}
+        slot = self._message_slots.get(chat_id)
+        if slot is None:
+            slot = self._message_slots[chat_id] = timeseries.minute_slot(MESSAGES, chat_id, self._minute)
+        timeseries.add(slot, 1)
         
-        self.hourly_activity[chat_name][f"{current_hour:02d}:00"] += 1
+        self.heatmap.increment(chat_id, now=now)
     
     def reset_message_count(self, chat_id: int):
         """Сбросить счетчик сообщений для чата"""
+        now = datetime.now(BUDAPEST_TZ)
         self.chat_messages[chat_id] = {
             'count': 0,
-            'last_reset': datetime.now(BUDAPEST_TZ)
+            'last_reset': now
         }
+        # В БД last_reset хранится в UTC без пояса
+        activity_buffer.reset_chat(chat_id, now.astimezone(pytz.utc).replace(tzinfo=None))
     
-    def _get_chat_name_by_id(self, chat_id: int) -> str:
-        """Получить название чата по ID"""
-        chat_names = {
-            -1002922212434: "Gambling chat",
-            -1002601716810: "Каталог услуг",
-            -1003033694255: "Куплю/Отдам/Продам",
-            -1002743668534: "Будапешт канал",
-            -1002883770818: "Будапешт чат",
-            -1002919380244: "Budapest Partners",
-        }
-        return chat_names.get(chat_id, f"chat_{chat_id}")
+    async def load_message_counts(self):
+        """Загрузить сохранённые счетчики сообщений чатов из БД"""
+        from services.db import db
+        
+        if not db.session_maker:
+            return
+        
+        try:
+            from models import ChatMessageCount
+            from sqlalchemy import select
+            
+            async with db.get_session() as session:
+                result = await session.execute(select(ChatMessageCount))
+                rows = result.scalars().all()
+            
+            for row in rows:
+                last_reset = row.last_reset or datetime.utcnow()
+                self.chat_messages[row.chat_id] = {
+                    'count': row.message_count or 0,
+                    'last_reset': pytz.utc.localize(last_reset).astimezone(BUDAPEST_TZ)
+                }
+            
+            logger.info(f"✅ Loaded message counters for {len(rows)} chats")
+        except Exception as e:
+            logger.error(f"Error loading message counters: {e}")
+        
+        # Последние известные числа участников - изменения считаются и после перезапуска
+        latest = await timeseries.latest(MEMBERS)
+        for name, chat_id in Config.STATS_CHANNELS.items():
+            if chat_id in latest:
+                self.previous_stats[name] = {
+                    'member_count': int(latest[chat_id]),
+                    'timestamp': datetime.now(BUDAPEST_TZ)
+                }
+        
+        # Heatmap - из часовых агрегатов сообщений
+        since = time.time() - Config.TIMESERIES_HOUR_RETENTION_DAYS * 86400
+        for chat_id in Config.STATS_CHANNELS.values():
+            points = await timeseries.query(MESSAGES, chat_id, since, resolution=HOUR)
+            if points:
+                self.heatmap.load_hourly(chat_id, points)
+    
+    async def _collect_channel(self, semaphore: asyncio.Semaphore, name: str,
+                               channel_id: int) -> Dict[str, Any]:
+        """Статистика одного канала с замером задержки"""
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                stats = await self.get_channel_stats(channel_id, name)
+            except Exception as e:
+                logger.error(f"Error collecting stats for {name}: {e}")
+                stats = {'name': name, 'error': str(e)}
+            if stats is not None:
+                stats['latency_ms'] = round((time.monotonic() - started) * 1000)
+            return stats
     
     async def get_all_stats(self) -> Dict[str, Any]:
-        """Собрать статистику по всем каналам и чатам"""
+        """Собрать статистику по всем каналам и чатам
+        
+        Каналы опрашиваются параллельно (не больше STATS_CONCURRENCY запросов сразу);
+        недоступный канал не срывает отчёт - он попадает в результат с ключом 'error'.
+        """
         try:
             all_stats = {
                 'timestamp': datetime.now(BUDAPEST_TZ),
                 'channels': [],
                 'chats': [],
-                'heatmap': self.hourly_activity
+                'heatmap': {},
+                'partial': False
             }
             
-            # Каналы для мониторинга
-            channels = {
-                'gambling_chat': -1002922212434,
-                'catalog': -1002601716810,
-                'trade': -1003033694255,
-                'budapest_main': -1002743668534,
-                'budapest_chat': -1002883770818,
-                'partners': -1002919380244,
-            }
+            channels = {name: chat_id for name, chat_id in Config.STATS_CHANNELS.items() if chat_id}
+            
+            # Heatmap за последние 7 дней: 24 значения по часам
+            for name, chat_id in channels.items():
+                all_stats['heatmap'][name] = self.heatmap.hourly(chat_id)
             
             # Собираем статистику по каналам
-            for name, channel_id in channels.items():
+            semaphore = asyncio.Semaphore(max(1, Config.STATS_CONCURRENCY))
+            started = time.monotonic()
+            results = await asyncio.gather(
+                *(self._collect_channel(semaphore, name, channel_id) for name, channel_id in channels.items())
+            )
+            for stats in results:
+                if stats:
+                    all_stats['channels'].append(stats)
+                    if 'error' in stats:
+                        all_stats['partial'] = True
+            all_stats['latency_ms'] = round((time.monotonic() - started) * 1000)
+            
+            # Неделя к неделе - из часовых агрегатов временных рядов
+            members_week = await timeseries.week_over_week(MEMBERS)
+            messages_week = await timeseries.week_over_week(MESSAGES)
+            for stats in all_stats['channels']:
+                week = members_week.get(channels.get(stats['name']))
+                if week:
+                    stats['week'] = week
+            
+            # Собираем статистику по чатам (сообщения)
+            for name, chat_id in channels.items():
                 try:
-                    stats = await self.get_channel_stats(channel_id, name)
+                    stats = await self.get_chat_message_stats(chat_id, name)
                     if stats:
-                        all_stats['channels'].append(stats)
+                        if chat_id in messages_week:
+                            stats['week'] = messages_week[chat_id]
+                        all_stats['chats'].append(stats)
                 except Exception as e:
-                    logger.error(f"Error collecting stats for {name}: {e}")
-                    all_stats['channels'].append({
-                        'name': name,
-                        'error': str(e)
-                    })
-            
-            # Собираем статистику по чатам (сообщения)
-            chat_ids = {
-                'gambling_chat': -1002922212434,
-                'catalog': -1002601716810,
-                'trade': -1003033694255,
-                'budapest_main': -1002743668534,
-                'budapest_chat': -1002883770818,
-                'partners': -1002919380244,
-            }
+                    logger.error(f"Error collecting message stats for {name}: {e}")
             
-            for name, chat_id in chat_ids.items():
-                if chat_id:
-                    try:
-                        stats = await self.get_chat_message_stats(chat_id, name)
-                        if stats:
-                            all_stats['chats'].append(stats)
-                    except Exception as e:
-                        logger.error(f"Error collecting message stats for {name}: {e}")
+            failed = [c['name'] for c in all_stats['channels'] if 'error' in c]
+            if failed:
+                logger.warning(f"Channel stats partial, failed: {', '.join(failed)}")
+            logger.info(f"Channel stats collected in {all_stats['latency_ms']} ms")
             
             return all_stats
             
@@ -199,9 +304,19 @@ class ChannelStatsService:
                 'error': str(e),
                 'channels': [],
                 'chats': [],
-                'heatmap': {}
+                'heatmap': {},
+                'partial': True
             }
     
+    @staticmethod
+    def _format_change(week: Dict[str, float]) -> str:
+        """Изменение неделя к неделе: +12 (+3.4%)"""
+        change = int(week['change'])
+        text = f"{change:+d}"
+        if week.get('change_pct') is not None:
+            text += f" ({week['change_pct']:+.1f}%)"
+        return text
+    
     def format_stats_message(self, stats: Dict[str, Any]) -> str:
         """Форматировать статистику в красивое сообщение с heatmap"""
         try:
@@ -220,11 +335,14 @@ class ChannelStatsService:
                     'trade': '🕵️‍♂️',
                     'budapest_main': '🙅‍♂️',
                     'budapest_chat': '🙅‍♀️',
-                    'partners': '🧶'
+                    'partners': '🧶',
+                    'budapest_people': '👥'
                 }
                 
+                failed = []
                 for channel in stats['channels']:
                     if 'error' in channel:
+                        failed.append(channel['name'])
                         continue
                     
                     emoji = channel_emojis.get(channel['name'], '📺')
@@ -241,7 +359,14 @@ class ChannelStatsService:
                         message += f" 📉 {change}\n"
                     else:
                         message += f" ➖\n"
+                    
+                    week = channel.get('week')
+                    if week:
+                        message += f"📅 За неделю: {self._format_change(week)}\n"
                     message += "\n"
+                
+                if failed:
+                    message += f"⚠️ Нет данных: {', '.join(name.replace('_', ' ') for name in failed)}\n\n"
             
             # ============ СТАТИСТИКА СООБЩЕНИЙ ============
             if stats.get('chats'):
@@ -259,7 +384,12 @@ class ChannelStatsService:
                     per_hour = chat.get('messages_per_hour', 0)
                     
                     message += f"📨 **{chat['name']}**\n"
-                    message += f"Сообщений: {count} ({per_hour}/час)\n\n"
+                    message += f"Сообщений: {count} ({per_hour}/час)\n"
+                    
+                    week = chat.get('week')
+                    if week:
+                        message += f"📅 За 7 дней: {int(week['current'])} ({self._format_change(week)})\n"
+                    message += "\n"
                 
                 if stats['chats']:
                     avg_per_hour = round(total_messages / len([c for c in stats['chats'] if 'error' not in c]), 1)
@@ -268,24 +398,22 @@ class ChannelStatsService:
                 message += f"📈 **Среднее:** {avg_per_hour}/час\n\n"
             
             # ============ HEATMAP АКТИВНОСТИ ============
-            if stats.get('heatmap'):
-                message += "🕑 **HEATMAP АКТИВНОСТИ ПО ЧАСАМ (Будапешт):**\n\n"
+            if any(any(hourly_data) for hourly_data in stats.get('heatmap', {}).values()):
+                message += "🕑 **HEATMAP АКТИВНОСТИ ПО ЧАСАМ ЗА 7 ДНЕЙ (Будапешт):**\n\n"
                 
                 for chat_name, hourly_data in stats['heatmap'].items():
-                    if not hourly_data:
+                    if not any(hourly_data):
                         continue
                     
-                    message += f"**{chat_name.upper()}**\n"
+                    message += f"**{chat_name.replace('_', ' ').upper()}**\n"
                     
                     # Находим пиковые часы
-                    max_hour = max(hourly_data, key=hourly_data.get)
+                    max_hour = max(range(len(hourly_data)), key=hourly_data.__getitem__)
                     max_value = hourly_data[max_hour]
                     
                     # Форматируем heatmap в виде строки
                     heatmap_line = ""
-                    for hour in sorted(hourly_data.keys()):
-                        value = hourly_data[hour]
-                        
+                    for value in hourly_data:
                         if value == 0:
                             heatmap_line += "⬜"
                         elif value <= max_value * 0.25:
@@ -304,18 +432,16 @@ class ChannelStatsService:
                     message += hours_legend
                     
                     # Пиковое время
-                    message += f"🔥 **Пик активности:** {max_hour} ({max_value} сообщений)\n\n"
+                    message += f"🔥 **Пик активности:** {max_hour:02d}:00 ({max_value} сообщений)\n\n"
             
             # ============ СТАТИСТИКА БОТА ============
-            from data.user_data import user_data
+            from data.user_data import get_user_stats
             message += "🤖 **СТАТИСТИКА БОТА:**\n\n"
             
-            total_users = len(user_data)
-            active_24h = sum(1 for data in user_data.values() if 
-                            datetime.now() - data['last_activity'] <= timedelta(days=1))
+            user_stats = get_user_stats()
             
-            message += f"👥 Всего пользователей: {total_users}\n"
-            message += f"🟢 Активных за 24ч: {active_24h}\n\n"
+            message += f"👥 Всего пользователей: {user_stats['total_users']}\n"
+            message += f"🟢 Активных за 24ч: {user_stats['active_24h']}\n\n"
             
             message += f"📈 Следующая статистика через {Config.STATS_INTERVAL_HOURS} часов"
             
@@ -129,6 +129,10 @@ class Database:
             
             logger.info("✅ Engine created")
             
+            # Задержки запросов по обработчикам и ожидание пула
+            from services.query_stats import query_stats
+            query_stats.instrument(self.engine)
+            
             # Создаем session maker
             self.session_maker = async_sessionmaker(
                 self.engine,
@@ -138,26 +142,11 @@ class Database:
             
             logger.info("✅ Session maker created")
             
-            # Тестируем подключение
-            logger.info("⏳ Testing connection...")
-            try:
-                async with self.engine.connect() as conn:
-                    from sqlalchemy import text
-                    result = await conn.execute(text("SELECT 1"))
-                    value = result.scalar()
-                    logger.info(f"✅ Connection test successful (result: {value})")
-            except Exception as test_error:
-                logger.error(f"❌ Connection test failed: {test_error}")
-                logger.error(f"   Type: {type(test_error).__name__}")
-                logger.error(f"   Message: {str(test_error)[:200]}")
-                raise
+            # Схема по ревизиям: если она актуальна - один SELECT по schema_migrations, без DDL
+            # (заодно проверяет подключение)
+            from services.migrations import migration_runner
+            await migration_runner.run(self.engine)
             
-            # Создаем таблицы
-            logger.info("⏳ Creating tables...")
-            async with self.engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            
-            logger.info("✅ Tables created")
             logger.info("✅ Database initialized successfully")
             
         except Exception as e:
@@ -217,6 +206,35 @@ class Database:
             finally:
                 await session.close()
     
+    def build_upsert(self, table, rows: list, index_elements: list, update_columns: list,
+                     increment_columns: list = None, min_columns: list = None,
+                     max_columns: list = None):
+        """Собрать INSERT ... ON CONFLICT DO UPDATE для текущего диалекта
+        
+        increment_columns прибавляются к текущему значению вместо перезаписи,
+        min_columns / max_columns сохраняют меньшее / большее из двух значений
+        """
+        from sqlalchemy import func
+        
+        if self.engine is not None and self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            least, greatest = func.least, func.greatest
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            # В SQLite min()/max() с двумя аргументами - скалярные функции
+            least, greatest = func.min, func.max
+        
+        stmt = insert(table).values(rows)
+        set_ = {column: stmt.excluded[column] for column in update_columns}
+        for column in increment_columns or []:
+            set_[column] = table.c[column] + stmt.excluded[column]
+        for column in min_columns or []:
+            set_[column] = least(table.c[column], stmt.excluded[column])
+        for column in max_columns or []:
+            set_[column] = greatest(table.c[column], stmt.excluded[column])
+        
+        return stmt.on_conflict_do_update(index_elements=index_elements, set_=set_)
+    
     async def close(self):
         """Закрыть соединение с базой данных"""
         if self.engine:
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище ограничений со сроком действия
+Кулдауны, муты, медленный режим и блокировки чатов: проверка O(1) по словарю,
+истечение - по куче сроков с колбэками (ближайший срок - разовая задача планировщика),
+запись в БД сразу после изменения
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from services.db import db
+from services.scheduler_service import scheduler_service, DateTrigger
+
+logger = logging.getLogger(__name__)
+
+# Колбэк истечения: (key, value) -> None
+ExpireCallback = Callable[[Hashable, Any], Awaitable[None]]
+
+# Пространства имён
+COOLDOWN = 'cooldown'
+MUTE = 'mute'
+SLOWMODE = 'slowmode'
+SLOWMODE_USER = 'slowmode_user'
+LOCKDOWN = 'lockdown'
+
+class _Namespace:
+    """Записи одного вида: key -> (value, expires_at по time.time() или None)"""
+
+    __slots__ = ('name', 'entries', 'on_expire', 'persist')
+
+    def __init__(self, name: str, on_expire: Optional[ExpireCallback], persist: bool):
+        self.name = name
+        self.entries: Dict[Hashable, Tuple[Any, Optional[float]]] = {}
+        self.on_expire = on_expire
+        self.persist = persist
+
+class ExpiringStore:
+    """Ключи со сроком действия по пространствам имён"""
+
+    JOB_ID = 'expiring_store'
+
+    def __init__(self):
+        self._namespaces: Dict[str, _Namespace] = {}
+        # (expires_at, seq, namespace, key); устаревшие элементы пропускаются при извлечении
+        self._heap: List[Tuple[float, int, str, Hashable]] = []
+        self._seq = itertools.count()
+        # Несохранённые изменения: (namespace, key) -> (value, expires_at) или None (удаление)
+        self._dirty: Dict[Tuple[str, Hashable], Optional[Tuple[Any, Optional[float]]]] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self.bot = None
+        self.is_running = False
+        self.loaded = False
+
+        self.expired = 0
+        self.callback_errors = 0
+
+    def set_bot(self, bot):
+        """Бот для колбэков истечения (снятие блокировки и т.п.)"""
+        self.bot = bot
+
+    def register(self, namespace: str, on_expire: Optional[ExpireCallback] = None,
+                 persist: bool = True):
+        """Объявить пространство имён (persist - ключи int, строки в expiring_state)"""
+        ns = self._namespaces.get(namespace)
+        if ns is None:
+            self._namespaces[namespace] = _Namespace(namespace, on_expire, persist)
+        else:
+            ns.on_expire = on_expire or ns.on_expire
+            ns.persist = persist
+
+    def _ns(self, namespace: str) -> _Namespace:
+        ns = self._namespaces.get(namespace)
+        if ns is None:
+            ns = self._namespaces[namespace] = _Namespace(namespace, None, True)
+        return ns
+
+    # ============= ПРОВЕРКИ (горячий путь) =============
+
+    def get(self, namespace: str, key: Hashable, default: Any = None) -> Any:
+        """Значение действующей записи или default"""
+        ns = self._namespaces.get(namespace)
+        entry = ns.entries.get(key) if ns else None
+        if entry is None:
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            return default
+        return value
+
+    def contains(self, namespace: str, key: Hashable) -> bool:
+        """Есть ли действующая запись"""
+        ns = self._namespaces.get(namespace)
+        entry = ns.entries.get(key) if ns else None
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def expires_at(self, namespace: str, key: Hashable) -> Optional[float]:
+        """Срок действующей записи (timestamp) или None"""
+        ns = self._namespaces.get(namespace)
+        entry = ns.entries.get(key) if ns else None
+        if entry is None or entry[1] is None or entry[1] <= time.time():
+            return None
+        return entry[1]
+
+    def remaining(self, namespace: str, key: Hashable) -> float:
+        """Секунд до истечения записи (0 - записи нет или она бессрочная)"""
+        expires_at = self.expires_at(namespace, key)
+        return max(0.0, expires_at - time.time()) if expires_at else 0.0
+
+    def items(self, namespace: str) -> List[Tuple[Hashable, Any, Optional[float]]]:
+        """Действующие записи: (key, value, expires_at)"""
+        ns = self._namespaces.get(namespace)
+        if not ns:
+            return []
+        now = time.time()
+        return [
+            (key, value, expires_at) for key, (value, expires_at) in ns.entries.items()
+            if expires_at is None or expires_at > now
+        ]
+
+    def count(self, namespace: str) -> int:
+        ns = self._namespaces.get(namespace)
+        return len(ns.entries) if ns else 0
+
+    # ============= ИЗМЕНЕНИЕ =============
+
+    def set(self, namespace: str, key: Hashable, ttl: Optional[float] = None, value: Any = None,
+            expires_at: Optional[float] = None, persist: bool = True):
+        """Записать ключ на ttl секунд (или до expires_at; оба None - бессрочно)"""
+        if ttl is not None:
+            expires_at = time.time() + ttl
+
+        ns = self._ns(namespace)
+        ns.entries[key] = (value, expires_at)
+
+        if expires_at is not None:
+            heapq.heappush(self._heap, (expires_at, next(self._seq), namespace, key))
+            # Новый срок раньше текущего - переносим разовую задачу
+            if self._heap[0][2] == namespace and self._heap[0][3] == key:
+                self._reschedule()
+
+        if persist and ns.persist:
+            self._mark_dirty(namespace, key, (value, expires_at))
+
+    def delete(self, namespace: str, key: Hashable, persist: bool = True) -> bool:
+        """Удалить ключ без вызова колбэка истечения"""
+        ns = self._namespaces.get(namespace)
+        if not ns or ns.entries.pop(key, None) is None:
+            return False
+        if persist and ns.persist:
+            self._mark_dirty(namespace, key, None)
+        return True
+
+    def clear(self, namespace: str):
+        """Очистить пространство имён (только память)"""
+        ns = self._namespaces.get(namespace)
+        if ns:
+            ns.entries.clear()
+
+    # ============= ИСТЕЧЕНИЕ =============
+
+    def _pop_expired(self, now: float) -> List[Tuple[_Namespace, Hashable, Any]]:
+        """Извлечь из кучи истёкшие записи (устаревшие элементы кучи отбрасываются)"""
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, _, namespace, key = heapq.heappop(heap)
+            ns = self._namespaces.get(namespace)
+            entry = ns.entries.get(key) if ns else None
+            # Ключ удалён или продлён - элемент кучи устарел
+            if entry is None or entry[1] != expires_at:
+                continue
+            del ns.entries[key]
+            expired.append((ns, key, entry[0]))
+        return expired
+
+    async def expire_due(self) -> int:
+        """Обработать все истёкшие записи, вернуть их количество"""
+        expired = self._pop_expired(time.time())
+        for ns, key, value in expired:
+            self.expired += 1
+            if ns.persist:
+                self._mark_dirty(ns.name, key, None)
+            if ns.on_expire:
+                try:
+                    await ns.on_expire(key, value)
+                except Exception as e:
+                    self.callback_errors += 1
+                    logger.error(f"Error in expiry callback {ns.name}:{key}: {e}")
+        return len(expired)
+
+    async def _on_timer(self):
+        """Разовая задача планировщика: обработать сроки и встать на следующий"""
+        try:
+            await self.expire_due()
+        finally:
+            self._reschedule()
+
+    def _reschedule(self):
+        """Разовая задача планировщика на ближайший срок в куче"""
+        if self.is_running and self._heap:
+            scheduler_service.add_job(
+                self.JOB_ID, self._on_timer, DateTrigger(self._heap[0][0]),
+                misfire_grace_time=float('inf'), persist=False
+            )
+
+    async def start(self):
+        """Запуск обработки сроков (истёкшие за время простоя сработают сразу)"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self._reschedule()
+        logger.info(f"✅ Expiring store started ({len(self._heap)} timers)")
+
+    async def stop(self):
+        """Снять задачу планировщика и дождаться записи в БД"""
+        self.is_running = False
+        scheduler_service.remove_job(self.JOB_ID)
+        await self.flush()
+
+    # ============= ПЕРСИСТЕНТНОСТЬ =============
+
+    def _mark_dirty(self, namespace: str, key: Hashable, state):
+        """Запомнить изменение и запустить запись, если она не идёт"""
+        if not db.session_maker:
+            return
+        self._dirty[(namespace, key)] = state
+
+        if self._writer is None or self._writer.done():
+            try:
+                self._writer = asyncio.get_running_loop().create_task(self._write())
+            except RuntimeError:
+                pass  # нет event loop - запишется при следующем изменении или flush()
+
+    async def _write(self):
+        """Записывать изменения, пока они есть; по ключу пишется последнее состояние"""
+        from models import ExpiringState
+        from sqlalchemy import delete
+
+        while self._dirty:
+            batch, self._dirty = self._dirty, {}
+
+            upserts = []
+            deletes = []
+            for (namespace, key), state in batch.items():
+                if state is None:
+                    deletes.append((namespace, key))
+                else:
+                    value, expires_at = state
+                    upserts.append({
+                        'namespace': namespace,
+                        'key': key,
+                        'value': value,
+                        'expires_at': datetime.utcfromtimestamp(expires_at) if expires_at is not None else None
+                    })
+
+            try:
+                async with db.get_session() as session:
+                    if upserts:
+                        await session.execute(db.build_upsert(
+                            ExpiringState.__table__, upserts,
+                            index_elements=['namespace', 'key'],
+                            update_columns=['value', 'expires_at']
+                        ))
+                    for namespace, key in deletes:
+                        await session.execute(
+                            delete(ExpiringState).where(
+                                ExpiringState.namespace == namespace,
+                                ExpiringState.key == key
+                            )
+                        )
+                    await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving expiring state ({len(batch)} changes): {e}")
+                # Возвращаем несохранённое, не затирая более новые изменения
+                for slot, state in batch.items():
+                    self._dirty.setdefault(slot, state)
+                return
+
+    async def load(self) -> int:
+        """Восстановить записи из БД (истёкшие за время простоя сработают при старте цикла)"""
+        if not db.session_maker:
+            return 0
+
+        try:
+            from models import ExpiringState
+            from sqlalchemy import select
+
+            async with db.get_session() as session:
+                result = await session.execute(select(ExpiringState))
+                rows = result.scalars().all()
+
+            for row in rows:
+                expires_at = None
+                if row.expires_at is not None:
+                    expires_at = (row.expires_at - datetime(1970, 1, 1)).total_seconds()
+                self.set(row.namespace, row.key, value=row.value,
+                         expires_at=expires_at, persist=False)
+
+            self.loaded = True
+            logger.info(f"✅ Expiring store loaded: {len(rows)} entries")
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Error loading expiring store: {e}")
+            return 0
+
+    async def flush(self):
+        """Дождаться записи всех изменений в БД"""
+        if self._writer is not None and not self._writer.done():
+            await self._writer
+        if self._dirty and db.session_maker:
+            await self._write()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'namespaces': {name: len(ns.entries) for name, ns in self._namespaces.items()},
+            'timers': len(self._heap),
+            'expired': self.expired,
+            'callback_errors': self.callback_errors
+        }
+
+# Глобальный экземпляр хранилища
+expiring_store = ExpiringStore()
+
+__all__ = [
+    'ExpiringStore',
+    'expiring_store',
+    'COOLDOWN',
+    'MUTE',
+    'SLOWMODE',
+    'SLOWMODE_USER',
+    'LOCKDOWN'
+]
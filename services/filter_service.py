@@ -1,125 +1,276 @@
 from config import Config
+import json
+import logging
+import os
 import re
-from typing import List, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны по умолчанию: (regex, причина)
+DEFAULT_SPAM_PATTERNS = [
+    (r'(?:earn|make)\s+\$?\d+\s*(?:daily|weekly|monthly)', "Financial spam"),
+    (r'(?:click|visit)\s+(?:here|this|link)', "Clickbait spam"),
+    (r'(?:100%|guaranteed)\s+(?:free|profit|income)', "Guarantee spam"),
+    (r'(?:whatsapp|telegram|viber)\s*:\s*\+?\d{10,}', "Contact spam"),
+    (r'(?:crypto|bitcoin|forex)\s+(?:signals|trading|investment)', "Crypto spam")
+]
+
+# Части общего шаблона scan(); регистр задаётся флагом внутри группы
+# Без схемы ссылка начинается только в начале слова: внутри слова findall её бы не нашёл
+URL_PATTERN = r'(?i:(?:(?:https?|ftp):\/\/|(?<![\w-]))(?P<host>(?:[\w-]++\.)+[a-z]{2,})(?:\/[^\s]*)?)'
+MENTION_PATTERN = r'@[a-zA-Z][a-zA-Z0-9_]{4,}'
+# С учётом регистра: "aAaAaA" - не повтор
+REPEAT_PATTERN = r'(?P<repeat_char>.)(?P=repeat_char){5,}'
+# Серия заглавных (латиница, венгерские, кириллица) - начало серии считается один раз
+CAPS_CLASS = 'A-ZÀ-ÖØ-ÞŐŰА-ЯЁ'
+CAPS_PATTERN = rf'(?<![{CAPS_CLASS}])[{CAPS_CLASS}]+'
+# Именованная группа или ссылка на неё: (?P<name> / (?P=name)
+GROUP_NAME_RE = re.compile(r'\(\?P([<=])(\w+)')
+
+WHITESPACE_RE = re.compile(r'\s+')
+PHONE_STRIP_RE = re.compile(r'[\s\-\(\)]')
+PHONE_RE = re.compile(r'^\+?\d{10,15}$')
+USERNAME_RE = re.compile(r'^@?[a-zA-Z][a-zA-Z0-9_]{4,31}$')
+
+# Как часто проверять файл правил на изменения (сек)
+RULES_CHECK_INTERVAL = 30
+
+class FilterResult:
+    """Результат одного прохода по тексту"""
+
+    __slots__ = ('links', 'mentions', 'banned_links', 'reasons')
+
+    def __init__(self):
+        self.links: List[str] = []
+        self.mentions: List[str] = []
+        self.banned_links: List[str] = []
+        self.reasons: List[str] = []
+
+    @property
+    def has_banned_link(self) -> bool:
+        return bool(self.banned_links)
+
+    @property
+    def is_spam(self) -> bool:
+        return bool(self.reasons)
+
+class _CompiledRules:
+    """Скомпилированные правила: общий шаблон проверки + альтернация доменов
+
+    Каждая проверка - именованная группа в опережающей проверке (?=(?P<name>...)),
+    поэтому один finditer находит и пересекающиеся совпадения: "@tinyurl.com/abc" даёт
+    и упоминание, и ссылку. Альтернация сообщает первую сработавшую проверку позиции,
+    следующие за ней проверяются в этой же позиции отдельно (такие позиции редки).
+    """
+
+    def __init__(self, banned_domains: List[str], spam_patterns: List[Tuple[str, str]]):
+        self.banned_domains = [d.lower() for d in banned_domains if d]
+        self.spam_patterns = list(spam_patterns)
+
+        # Домен или любой его поддомен; длинные домены первыми
+        domains = sorted(set(self.banned_domains), key=len, reverse=True)
+        self.banned_re = re.compile(
+            r'(?:^|\.)(?:' + '|'.join(map(re.escape, domains)) + r')$'
+        ) if domains else None
+
+        # Именованные группы шаблонов спама получают префикс; нумерованные обратные
+        # ссылки в них не поддерживаются - номера групп в общем шаблоне сдвигаются
+        checks = [('url', URL_PATTERN), ('mention', MENTION_PATTERN)]
+        self.reasons: Dict[str, str] = {}
+        for i, (pattern, reason) in enumerate(self.spam_patterns):
+            name = f'spam{i}'
+            checks.append((name, '(?i:' + GROUP_NAME_RE.sub(rf'(?P\1{name}_\2', pattern) + ')'))
+            self.reasons[name] = reason
+        checks += [('repeat', REPEAT_PATTERN), ('caps', CAPS_PATTERN)]
+
+        self.scan_re = re.compile('|'.join(f'(?=(?P<{name}>{pattern}))' for name, pattern in checks))
+        self.check_res = {name: re.compile(pattern) for name, pattern in checks}
+        names = [name for name, _ in checks]
+        self.later = {name: names[i + 1:] for i, name in enumerate(names)}
+
+        # Порядок причин в результате - как в исходной последовательности проверок
+        self.reason_order = {
+            reason: i for i, reason in enumerate(
+                [reason for _, reason in self.spam_patterns]
+                + ["Excessive capital letters", "Repeated characters spam"]
+            )
+        }
 
 class FilterService:
     """Service for filtering content"""
-    
-    def __init__(self):
-        self.banned_domains = Config.BANNED_DOMAINS
-        
+
+    def __init__(self, banned_domains: Optional[List[str]] = None,
+                 spam_patterns: Optional[List[Tuple[str, str]]] = None):
+        self.rules_file = Config.FILTER_RULES_FILE
+        self._rules_mtime = None
+        self._rules_checked = 0.0
+        self._rules = _CompiledRules(
+            banned_domains if banned_domains is not None else Config.BANNED_DOMAINS,
+            spam_patterns if spam_patterns is not None else DEFAULT_SPAM_PATTERNS
+        )
+        if banned_domains is None and spam_patterns is None:
+            self._check_rules_file(force=True)
+
+    @property
+    def banned_domains(self) -> List[str]:
+        return self._rules.banned_domains
+
+    # ============= ПРАВИЛА =============
+
+    def reload(self, banned_domains: Optional[List[str]] = None,
+               spam_patterns: Optional[List[Tuple[str, str]]] = None) -> bool:
+        """Перекомпилировать правила без перезапуска (None - оставить текущие)"""
+        try:
+            rules = _CompiledRules(
+                banned_domains if banned_domains is not None else self._rules.banned_domains,
+                spam_patterns if spam_patterns is not None else self._rules.spam_patterns
+            )
+        except re.error as e:
+            logger.error(f"Invalid filter pattern, keeping previous rules: {e}")
+            return False
+
+        # Подмена одной ссылкой - параллельные проверки видят старые или новые правила целиком
+        self._rules = rules
+        logger.info(
+            f"🔄 Filter rules loaded: {len(rules.banned_domains)} domains, "
+            f"{len(rules.reasons)} spam patterns"
+        )
+        return True
+
+    def _check_rules_file(self, force: bool = False):
+        """Перечитать FILTER_RULES_FILE, если он изменился"""
+        if not self.rules_file:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._rules_checked < RULES_CHECK_INTERVAL:
+            return
+        self._rules_checked = now
+
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError:
+            return
+        if mtime == self._rules_mtime:
+            return
+        self._rules_mtime = mtime
+
+        try:
+            with open(self.rules_file, encoding='utf-8') as f:
+                data = json.load(f)
+            patterns = data.get('spam_patterns')
+            self.reload(
+                banned_domains=data.get('banned_domains'),
+                spam_patterns=[tuple(p) for p in patterns] if patterns is not None else None
+            )
+        except Exception as e:
+            logger.error(f"Error loading filter rules from {self.rules_file}: {e}")
+
+    # ============= ПРОВЕРКА =============
+
+    def scan(self, text: str) -> FilterResult:
+        """Проверка текста: ссылки, упоминания, запрещённые домены и признаки спама"""
+        result = FilterResult()
+        if not text:
+            return result
+
+        self._check_rules_file()
+        rules = self._rules
+        reasons = set()
+        check_res, later, banned_re = rules.check_res, rules.later, rules.banned_re
+
+        # Один проход; ссылки и упоминания не пересекаются между собой, как у findall
+        url_end = mention_end = 0
+        caps = 0
+        repeat = False
+        for match in rules.scan_re.finditer(text):
+            pos = match.start()
+            first = match.lastgroup
+            found = [(first, match.group(first), match.end(first), match.group('host'))]
+            for name in later[first]:
+                extra = check_res[name].match(text, pos)
+                if extra is not None:
+                    found.append((name, extra.group(), extra.end(), extra.groupdict().get('host')))
+
+            for name, value, end, host in found:
+                if name == 'url':
+                    if pos >= url_end:
+                        url_end = end
+                        result.links.append(value)
+                        if banned_re is not None and banned_re.search(host.lower()):
+                            result.banned_links.append(value)
+                elif name == 'mention':
+                    if pos >= mention_end:
+                        mention_end = end
+                        result.mentions.append(value)
+                elif name == 'caps':
+                    caps += end - pos
+                elif name == 'repeat':
+                    repeat = True
+                else:
+                    reasons.add(rules.reasons[name])
+
+        # Check for excessive caps
+        if len(text) > 20 and caps / len(text) > 0.7:
+            reasons.add("Excessive capital letters")
+
+        if repeat:
+            reasons.add("Repeated characters spam")
+
+        if reasons:
+            result.reasons = sorted(reasons, key=rules.reason_order.get)
+
+        return result
+
     def contains_banned_link(self, text: str) -> bool:
         """Check if text contains banned links"""
-        if not text:
-            return False
-        
-        text_lower = text.lower()
-        
-        # Check for banned domains
-        for domain in self.banned_domains:
-            if domain in text_lower:
-                return True
-        
-        # Check for URL patterns
-        url_pattern = r'(?:(?:https?|ftp):\/\/)?(?:[\w-]+\.)+[a-z]{2,}'
-        urls = re.findall(url_pattern, text_lower)
-        
-        if urls:
-            # Check if any found URL is in banned list
-            for url in urls:
-                for domain in self.banned_domains:
-                    if domain in url:
-                        return True
-        
-        return False
-    
+        return self.scan(text).has_banned_link
+
     def extract_links(self, text: str) -> List[str]:
         """Extract all links from text"""
-        if not text:
-            return []
-        
-        # Pattern for URLs
-        url_pattern = r'(?:(?:https?|ftp):\/\/)?(?:[\w-]+\.)+[a-z]{2,}(?:\/[^\s]*)?'
-        urls = re.findall(url_pattern, text, re.IGNORECASE)
-        
-        # Pattern for Telegram usernames
-        tg_pattern = r'@[a-zA-Z][a-zA-Z0-9_]{4,}'
-        tg_usernames = re.findall(tg_pattern, text)
-        
-        return urls + tg_usernames
-    
+        result = self.scan(text)
+        return result.links + result.mentions
+
     def clean_text(self, text: str) -> str:
         """Clean text from unwanted content"""
         if not text:
             return ""
-        
-        # Remove multiple spaces
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove leading/trailing whitespace
-        text = text.strip()
-        
-        return text
-    
+
+        return WHITESPACE_RE.sub(' ', text).strip()
+
     def check_spam_patterns(self, text: str) -> Tuple[bool, str]:
         """
         Check for spam patterns
         Returns: (is_spam: bool, reason: str)
         """
-        if not text:
-            return False, ""
-        
-        text_lower = text.lower()
-        
-        # Common spam patterns
-        spam_patterns = [
-            (r'(?:earn|make)\s+\$?\d+\s*(?:daily|weekly|monthly)', "Financial spam"),
-            (r'(?:click|visit)\s+(?:here|this|link)', "Clickbait spam"),
-            (r'(?:100%|guaranteed)\s+(?:free|profit|income)', "Guarantee spam"),
-            (r'(?:whatsapp|telegram|viber)\s*:\s*\+?\d{10,}', "Contact spam"),
-            (r'(?:crypto|bitcoin|forex)\s+(?:signals|trading|investment)', "Crypto spam")
-        ]
-        
-        for pattern, reason in spam_patterns:
-            if re.search(pattern, text_lower):
-                return True, reason
-        
-        # Check for excessive caps
-        if len(text) > 20:
-            caps_ratio = sum(1 for c in text if c.isupper()) / len(text)
-            if caps_ratio > 0.7:
-                return True, "Excessive capital letters"
-        
-        # Check for repeated characters
-        if re.search(r'(.)\1{5,}', text):
-            return True, "Repeated characters spam"
-        
+        result = self.scan(text)
+        if result.is_spam:
+            return True, result.reasons[0]
         return False, ""
-    
+
     def is_valid_phone(self, phone: str) -> bool:
         """Validate phone number format"""
-        # Remove spaces and dashes
-        phone = re.sub(r'[\s\-\(\)]', '', phone)
-        
-        # Check if it matches phone pattern
-        pattern = r'^\+?\d{10,15}$'
-        return bool(re.match(pattern, phone))
-    
+        return bool(PHONE_RE.match(PHONE_STRIP_RE.sub('', phone)))
+
     def is_valid_username(self, username: str) -> bool:
         """Validate Telegram username"""
-        pattern = r'^@?[a-zA-Z][a-zA-Z0-9_]{4,31}$'
-        return bool(re.match(pattern, username))
-    
+        return bool(USERNAME_RE.match(username))
+
     def sanitize_html(self, text: str) -> str:
         """Sanitize text for HTML display"""
         if not text:
             return ""
-        
+
         # Escape HTML special characters
         text = text.replace('&', '&amp;')
         text = text.replace('<', '&lt;')
         text = text.replace('>', '&gt;')
         text = text.replace('"', '&quot;')
         text = text.replace("'", '&#39;')
-        
+
         return text
+
+# Глобальный экземпляр: правила компилируются один раз
+filter_service = FilterService()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальный лидерборд
+Отсортированный индекс с обновлением по ключу и группами-фильтрами
+"""
+from bisect import bisect_left, insort
+from itertools import count
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+class Leaderboard:
+    """Отсортированный по убыванию очков индекс: update O(log n + сдвиг), top(k) O(k)
+
+    group_of - функция key -> метка группы (например, пол) для фильтрованных топов.
+    При равных очках выше тот, кто попал в лидерборд раньше.
+    """
+
+    def __init__(self, group_of: Optional[Callable[[Hashable], Any]] = None):
+        self.group_of = group_of
+
+        # key -> (−score, seq) - позиция ключа в отсортированных списках
+        self._positions: Dict[Hashable, Tuple[float, int]] = {}
+        self._groups: Dict[Hashable, Any] = {}
+
+        # Отсортированные списки (−score, seq, key): общий и по группам
+        self._order: List[Tuple[float, int, Hashable]] = []
+        self._group_order: Dict[Any, List[Tuple[float, int, Hashable]]] = {}
+
+        self._seq = count()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._positions
+
+    @staticmethod
+    def _discard(order: List[Tuple[float, int, Hashable]], entry: Tuple[float, int, Hashable]):
+        """Удалить запись из отсортированного списка"""
+        index = bisect_left(order, entry[:2])
+        if index < len(order) and order[index][:2] == entry[:2]:
+            del order[index]
+
+    def update(self, key: Hashable, score: float, group: Any = None):
+        """Установить очки ключа (и группу, если задана явно)"""
+        if group is None and self.group_of is not None:
+            group = self.group_of(key)
+
+        position = self._positions.get(key)
+        if position is not None:
+            if position[0] == -score and self._groups.get(key) == group:
+                return
+            seq = position[1]
+            self._remove_entry(key, position)
+        else:
+            seq = next(self._seq)
+
+        entry = (-score, seq, key)
+        self._positions[key] = entry[:2]
+        insort(self._order, entry)
+
+        if group is not None:
+            self._groups[key] = group
+            insort(self._group_order.setdefault(group, []), entry)
+
+    def _remove_entry(self, key: Hashable, position: Tuple[float, int]):
+        """Убрать ключ из отсортированных списков"""
+        entry = (*position, key)
+        self._discard(self._order, entry)
+
+        group = self._groups.pop(key, None)
+        if group is not None:
+            self._discard(self._group_order[group], entry)
+
+    def remove(self, key: Hashable):
+        """Удалить ключ из лидерборда"""
+        position = self._positions.pop(key, None)
+        if position is not None:
+            self._remove_entry(key, position)
+
+    def score(self, key: Hashable) -> Optional[float]:
+        """Текущие очки ключа"""
+        position = self._positions.get(key)
+        return -position[0] if position is not None else None
+
+    def top(self, limit: int = 10, group: Any = None) -> List[Tuple[Hashable, float]]:
+        """Первые limit ключей (в группе group, если указана) как [(key, score)]"""
+        order = self._order if group is None else self._group_order.get(group, [])
+        return [(key, -neg_score) for neg_score, _, key in order[:limit]]
+
+    def count(self, group: Any = None) -> int:
+        """Размер лидерборда или группы"""
+        if group is None:
+            return len(self._order)
+        return len(self._group_order.get(group, []))
+
+    def clear(self):
+        """Очистить лидерборд"""
+        self._positions.clear()
+        self._groups.clear()
+        self._order.clear()
+        self._group_order.clear()
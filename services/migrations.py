@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Версионированные миграции схемы БД
+Все модели живут в одном Base (services.db). Применённые ревизии и их контрольные суммы
+хранятся в schema_migrations: если схема актуальна, запуск стоит один SELECT без DDL
+"""
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import CheckConstraint, Column, DateTime, Integer, String, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+from services.db import Base
+
+logger = logging.getLogger(__name__)
+
+class SchemaMigration(Base):
+    """Применённая ревизия схемы"""
+    __tablename__ = 'schema_migrations'
+
+    revision = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(255), nullable=False)
+    checksum = Column(String(64), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# ============= ОПЕРАЦИИ =============
+# DDL колонок, индексов и ограничений заморожен в аргументах операции: он входит в repr
+# (а значит, в контрольную сумму ревизии) и не зависит от текущих моделей. Расхождение
+# модели с последней ревизией, описавшей объект, показывает MigrationRunner.model_drift()
+
+class CreateTables:
+    """Создать таблицы из метаданных (существующие пропускаются)
+
+    Таблицы создаются по текущим моделям - дальнейшие изменения их колонок, индексов
+    и ограничений оформляются отдельными операциями ниже.
+    """
+
+    def __init__(self, *tables: str):
+        self.tables = tables
+
+    def __repr__(self):
+        return f"CreateTables{self.tables!r}"
+
+    def apply(self, conn):
+        tables = [Base.metadata.tables[name] for name in self.tables]
+        Base.metadata.create_all(conn, tables=tables, checkfirst=True)
+
+class AddColumn:
+    """Добавить колонку в существующую таблицу"""
+
+    def __init__(self, table: str, column: str, column_type: str):
+        self.table = table
+        self.column = column
+        self.column_type = column_type
+
+    def __repr__(self):
+        return f"AddColumn({self.table!r}, {self.column!r}, {self.column_type!r})"
+
+    @property
+    def key(self):
+        return ('column', self.table, self.column)
+
+    def drift(self) -> Optional[str]:
+        """Отличие модели от замороженного DDL (None - совпадает)"""
+        return _column_drift(self.table, self.column, self.column_type)
+
+    def apply(self, conn):
+        existing = {c['name'] for c in inspect(conn).get_columns(self.table)}
+        if self.column in existing:
+            return
+        conn.execute(text(f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.column_type}"))
+
+class AlterColumnType:
+    """Сменить тип колонки (в SQLite типы не строгие - пропускается)"""
+
+    def __init__(self, table: str, column: str, column_type: str):
+        self.table = table
+        self.column = column
+        self.column_type = column_type
+
+    def __repr__(self):
+        return f"AlterColumnType({self.table!r}, {self.column!r}, {self.column_type!r})"
+
+    @property
+    def key(self):
+        return ('column', self.table, self.column)
+
+    def drift(self) -> Optional[str]:
+        return _column_drift(self.table, self.column, self.column_type)
+
+    def apply(self, conn):
+        if conn.dialect.name != 'postgresql':
+            return
+        conn.execute(text(
+            f"ALTER TABLE {self.table} ALTER COLUMN {self.column} TYPE {self.column_type}"
+        ))
+
+class CreateIndex:
+    """Создать индекс по колонкам"""
+
+    def __init__(self, table: str, name: str, *columns: str):
+        self.table = table
+        self.name = name
+        self.columns = columns
+
+    def __repr__(self):
+        return f"CreateIndex({self.table!r}, {self.name!r}, *{self.columns!r})"
+
+    @property
+    def key(self):
+        return ('index', self.table, self.name)
+
+    def drift(self) -> Optional[str]:
+        index = next((i for i in Base.metadata.tables[self.table].indexes if i.name == self.name), None)
+        if index is None:
+            return f"index {self.name} is missing from the model"
+        columns = tuple(c.name for c in index.columns)
+        if columns != self.columns:
+            return f"index {self.name} is {columns!r} in the model, {self.columns!r} in the migration"
+        return None
+
+    def apply(self, conn):
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {self.name} ON {self.table} ({', '.join(self.columns)})"
+        ))
+
+class AddCheckConstraint:
+    """Добавить ограничение CHECK
+
+    SQLite не умеет добавлять ограничения в существующую таблицу - там они действуют
+    только для таблиц, созданных по актуальной модели.
+    """
+
+    def __init__(self, table: str, name: str, sqltext: str):
+        self.table = table
+        self.name = name
+        self.sqltext = sqltext
+
+    def __repr__(self):
+        return f"AddCheckConstraint({self.table!r}, {self.name!r}, {self.sqltext!r})"
+
+    @property
+    def key(self):
+        return ('constraint', self.table, self.name)
+
+    def drift(self) -> Optional[str]:
+        constraint = _check_constraint(self.table, self.name)
+        if constraint is None:
+            return f"check {self.name} is missing from the model"
+        if str(constraint.sqltext) != self.sqltext:
+            return (
+                f"check {self.name} is {str(constraint.sqltext)!r} in the model, "
+                f"{self.sqltext!r} in the migration"
+            )
+        return None
+
+    def apply(self, conn):
+        if conn.dialect.name != 'postgresql':
+            return
+        existing = {c['name'] for c in inspect(conn).get_check_constraints(self.table)}
+        if self.name in existing:
+            return
+        conn.execute(text(
+            f"ALTER TABLE {self.table} ADD CONSTRAINT {self.name} CHECK ({self.sqltext})"
+        ))
+
+class DropCheckConstraint:
+    """Удалить ограничение CHECK (в SQLite - пропускается, как и добавление)"""
+
+    def __init__(self, table: str, name: str):
+        self.table = table
+        self.name = name
+
+    def __repr__(self):
+        return f"DropCheckConstraint({self.table!r}, {self.name!r})"
+
+    @property
+    def key(self):
+        return ('constraint', self.table, self.name)
+
+    def drift(self) -> Optional[str]:
+        if _check_constraint(self.table, self.name) is not None:
+            return f"check {self.name} was dropped but is still in the model"
+        return None
+
+    def apply(self, conn):
+        if conn.dialect.name != 'postgresql':
+            return
+        conn.execute(text(f"ALTER TABLE {self.table} DROP CONSTRAINT IF EXISTS {self.name}"))
+
+def _column_drift(table: str, column: str, column_type: str) -> Optional[str]:
+    model_column = Base.metadata.tables[table].c.get(column)
+    if model_column is None:
+        return f"column {table}.{column} is missing from the model"
+    model_type = model_column.type.compile()
+    if model_type != column_type:
+        return f"column {table}.{column} is {model_type} in the model, {column_type} in the migration"
+    return None
+
+def _check_constraint(table: str, name: str) -> Optional[CheckConstraint]:
+    return next(
+        (c for c in Base.metadata.tables[table].constraints
+         if isinstance(c, CheckConstraint) and c.name == name),
+        None
+    )
+
+class Migration:
+    """Ревизия схемы: номер, название и список операций"""
+
+    def __init__(self, revision: int, name: str, *operations):
+        self.revision = revision
+        self.name = name
+        self.operations = operations
+        self.checksum = hashlib.sha256(
+            f"{revision}:{name}:{operations!r}".encode('utf-8')
+        ).hexdigest()
+
+    def apply(self, conn):
+        for operation in self.operations:
+            operation.apply(conn)
+
+# ============= РЕВИЗИИ =============
+# Применённые ревизии не редактируются - изменения схемы только новой ревизией в конце
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1, "baseline",
+        CreateTables(
+            'publications', 'piar_requests',
+            'users', 'posts', 'user_activity', 'chat_message_counts', 'broadcast_jobs',
+            'trix_users', 'trix_tasks', 'trix_confirmations', 'trix_stats', 'trix_subscriptions'
+        )
+    ),
+    Migration(
+        2, "moderation and confirmation indexes",
+        CreateIndex('posts', 'ix_posts_status_created_at', 'status', 'created_at'),
+        CreateIndex('posts', 'ix_posts_user_id', 'user_id'),
+        CreateIndex('trix_confirmations', 'ix_trix_confirmations_status_deadline', 'status', 'deadline')
+    ),
+    Migration(
+        3, "expiring state store",
+        CreateTables('expiring_state')
+    ),
+    Migration(
+        4, "scheduled jobs",
+        CreateTables('scheduled_jobs')
+    ),
+    Migration(
+        5, "channel statistics time series",
+        CreateTables('timeseries_points')
+    ),
+    Migration(
+        6, "trixiki ledger and 64-bit telegram ids",
+        CreateTables('trix_ledger'),
+        AddColumn('trix_users', 'ledger_seq', 'BIGINT'),
+        AlterColumnType('trix_users', 'user_id', 'BIGINT'),
+        AlterColumnType('trix_tasks', 'creator_id', 'BIGINT'),
+        AlterColumnType('trix_tasks', 'performer_id', 'BIGINT'),
+        AlterColumnType('trix_confirmations', 'creator_id', 'BIGINT'),
+        AlterColumnType('trix_confirmations', 'performer_id', 'BIGINT'),
+        AlterColumnType('trix_stats', 'user_id', 'BIGINT'),
+        AlterColumnType('trix_subscriptions', 'user_id', 'BIGINT'),
+        AlterColumnType('trix_subscriptions', 'approved_by', 'BIGINT')
+    ),
+    Migration(
+        7, "trixiki balance check constraints",
+        AddCheckConstraint('trix_users', 'ck_trix_users_balance', 'balance >= 0 AND balance <= max_balance'),
+        AddCheckConstraint('trix_users', 'ck_trix_users_frozen', 'frozen_trixiki >= 0')
+    ),
+    Migration(
+        8, "trixiki balance without upper bound",
+        DropCheckConstraint('trix_users', 'ck_trix_users_balance'),
+        AddCheckConstraint('trix_users', 'ck_trix_users_balance', 'balance >= 0')
+    ),
+]
+
+class MigrationRunner:
+    """Применяет недостающие ревизии и проверяет контрольные суммы применённых"""
+
+    def __init__(self, migrations: List[Migration]):
+        self.migrations = sorted(migrations, key=lambda m: m.revision)
+        self.head = self.migrations[-1].revision if self.migrations else 0
+
+    async def applied(self, engine) -> Optional[Dict[int, str]]:
+        """revision -> checksum из schema_migrations, None - таблицы ещё нет"""
+        try:
+            async with engine.connect() as conn:
+                result = await conn.execute(
+                    select(SchemaMigration.revision, SchemaMigration.checksum)
+                )
+                return {row.revision: row.checksum for row in result}
+        except DBAPIError as e:
+            if 'schema_migrations' not in str(e.orig):
+                raise
+            return None
+
+    def verify(self, applied: Dict[int, str]):
+        """Предупредить, если применённая ревизия изменилась после применения"""
+        for migration in self.migrations:
+            checksum = applied.get(migration.revision)
+            if checksum and checksum != migration.checksum:
+                logger.error(
+                    f"❌ Migration {migration.revision} ({migration.name}) was modified "
+                    f"after it was applied - add a new revision instead"
+                )
+
+    def model_drift(self) -> List[str]:
+        """Объекты, которые в моделях отличаются от последней описавшей их ревизии"""
+        latest = {}
+        for migration in self.migrations:
+            for operation in migration.operations:
+                if hasattr(operation, 'key'):
+                    latest[operation.key] = (migration.revision, operation)
+
+        problems = []
+        for revision, operation in latest.values():
+            problem = operation.drift()
+            if problem:
+                problems.append(f"revision {revision}: {problem}")
+        return problems
+
+    async def run(self, engine) -> int:
+        """Привести схему к последней ревизии, вернуть число применённых ревизий"""
+        # Регистрируем все модели в общем Base
+        import models  # noqa: F401
+        import trix_activity_database  # noqa: F401
+
+        for problem in self.model_drift():
+            logger.error(f"❌ Model changed without a migration - {problem}")
+
+        applied = await self.applied(engine)
+        if applied is not None:
+            self.verify(applied)
+            if all(m.revision in applied for m in self.migrations):
+                logger.info(f"✅ Database schema is current (revision {self.head})")
+                return 0
+
+        pending = [m for m in self.migrations if m.revision not in (applied or {})]
+
+        async with engine.begin() as conn:
+            if applied is None:
+                await conn.run_sync(
+                    lambda sync_conn: SchemaMigration.__table__.create(sync_conn, checkfirst=True)
+                )
+
+            for migration in pending:
+                logger.info(f"⏳ Applying migration {migration.revision}: {migration.name}")
+                await conn.run_sync(migration.apply)
+                await conn.execute(
+                    SchemaMigration.__table__.insert().values(
+                        revision=migration.revision,
+                        name=migration.name,
+                        checksum=migration.checksum,
+                        applied_at=datetime.utcnow()
+                    )
+                )
+
+        logger.info(f"✅ Database schema migrated to revision {self.head} ({len(pending)} applied)")
+        return len(pending)
+
+# Глобальный раннер миграций
+migration_runner = MigrationRunner(MIGRATIONS)
+
+__all__ = [
+    'SchemaMigration',
+    'Migration',
+    'CreateTables',
+    'AddColumn',
+    'AlterColumnType',
+    'CreateIndex',
+    'AddCheckConstraint',
+    'DropCheckConstraint',
+    'MIGRATIONS',
+    'MigrationRunner',
+    'migration_runner'
+]
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Инструментирование SQL-запросов
+Задержка и число строк каждого запроса с меткой обработчика, перцентили, лог медленных запросов
+и время ожидания соединения из пула
+"""
+import contextvars
+import logging
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних замеров хранить для перцентилей
+SAMPLES_PER_STATEMENT = 256
+GLOBAL_SAMPLES = 2048
+MAX_STATEMENT_LENGTH = 300
+
+# Обработчик, от имени которого идут запросы (команда, префикс callback, фоновая задача)
+_query_tag: contextvars.ContextVar[str] = contextvars.ContextVar('query_tag', default='background')
+
+# IN (?, ?, ?) / VALUES (...), (...) с разным числом параметров - один и тот же запрос
+_PARAM_LIST_RE = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)\s*\)')
+_REPEATED_VALUES_RE = re.compile(r'(\(…\))(?:\s*,\s*\(…\))+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Длинный список колонок SELECT не нужен для поиска горячих запросов
+_SELECT_COLUMNS_RE = re.compile(r'^SELECT (?:(?! FROM ).)+ FROM ')
+
+@contextmanager
+def query_tag(tag: str):
+    """Пометить запросы внутри блока меткой tag"""
+    token = _query_tag.set(tag)
+    try:
+        yield
+    finally:
+        _query_tag.reset(token)
+
+def set_query_tag(tag: str):
+    """Установить метку для запросов текущей задачи"""
+    _query_tag.set(tag)
+
+def _percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+class _StatementStats:
+    """Счётчики одного запроса"""
+
+    __slots__ = ('count', 'total', 'max', 'rows', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLES_PER_STATEMENT)
+
+class QueryStats:
+    """Сбор статистики запросов через события SQLAlchemy"""
+
+    def __init__(self):
+        self.enabled = Config.QUERY_STATS_ENABLED
+        self.slow_ms = Config.SLOW_QUERY_MS
+        self.statements: Dict[Tuple[str, str], _StatementStats] = {}
+        self.samples = deque(maxlen=GLOBAL_SAMPLES)
+        self.slow_count = 0
+        self.pool_waits = deque(maxlen=GLOBAL_SAMPLES)
+        self.pool_wait_max = 0.0
+        self._pool = None
+        self._normalized: Dict[str, str] = {}
+
+    # ============= ПОДКЛЮЧЕНИЕ =============
+
+    def instrument(self, engine):
+        """Подписаться на события движка (AsyncEngine или Engine)"""
+        if not self.enabled:
+            return
+
+        sync_engine = getattr(engine, 'sync_engine', engine)
+        event.listen(sync_engine, 'before_cursor_execute', self._before_execute)
+        event.listen(sync_engine, 'after_cursor_execute', self._after_execute)
+        event.listen(sync_engine, 'handle_error', self._on_error)
+
+        # У пула нет события "начали ждать" - замеряем сам вызов выдачи соединения
+        pool = sync_engine.pool
+        checkout = pool.connect
+
+        def timed_checkout():
+            started = time.perf_counter()
+            try:
+                return checkout()
+            finally:
+                self._record_pool_wait(time.perf_counter() - started)
+
+        pool.connect = timed_checkout
+        self._pool = pool
+        logger.info(f"✅ Query instrumentation enabled (slow query threshold {self.slow_ms} ms)")
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        # rowcount известен для DML; для SELECT драйверы обычно отдают -1
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        self.record(self.normalize(statement), _query_tag.get(), elapsed_ms, rows)
+
+    def _on_error(self, context):
+        # Запрос упал - снимаем его отметку времени
+        conn = context.connection
+        if conn is not None and conn.info.get('query_started'):
+            conn.info['query_started'].pop()
+
+    # ============= ЗАПИСЬ =============
+
+    def normalize(self, statement: str) -> str:
+        """Привести текст запроса к ключу: без переносов и с одинаковыми списками параметров"""
+        key = self._normalized.get(statement)
+        if key is None:
+            key = _WHITESPACE_RE.sub(' ', statement).strip()
+            key = _SELECT_COLUMNS_RE.sub('SELECT … FROM ', key)
+            key = _PARAM_LIST_RE.sub('(…)', key)
+            key = _REPEATED_VALUES_RE.sub(r'\1, …', key)[:MAX_STATEMENT_LENGTH]
+            if len(self._normalized) < 10000:
+                self._normalized[statement] = key
+        return key
+
+    def record(self, statement: str, tag: str, elapsed_ms: float, rows: int = 0):
+        """Учесть выполненный запрос"""
+        stats = self.statements.get((tag, statement))
+        if stats is None:
+            stats = self.statements[(tag, statement)] = _StatementStats()
+
+        stats.count += 1
+        stats.total += elapsed_ms
+        stats.rows += rows
+        stats.samples.append(elapsed_ms)
+        if elapsed_ms > stats.max:
+            stats.max = elapsed_ms
+
+        self.samples.append(elapsed_ms)
+
+        if elapsed_ms >= self.slow_ms:
+            self.slow_count += 1
+            logger.warning(f"🐢 Slow query {elapsed_ms:.0f} ms [{tag}] rows={rows}: {statement}")
+
+    def _record_pool_wait(self, seconds: float):
+        ms = seconds * 1000
+        self.pool_waits.append(ms)
+        if ms > self.pool_wait_max:
+            self.pool_wait_max = ms
+
+    # ============= ОТЧЁТ =============
+
+    def top(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Запросы с наибольшим суммарным временем"""
+        ranked = sorted(self.statements.items(), key=lambda item: item[1].total, reverse=True)
+        result = []
+        for (tag, statement), stats in ranked[:limit]:
+            samples = sorted(stats.samples)
+            result.append({
+                'tag': tag,
+                'statement': statement,
+                'count': stats.count,
+                'total_ms': round(stats.total, 1),
+                'avg_ms': round(stats.total / stats.count, 2),
+                'p95_ms': round(_percentile(samples, 0.95), 2),
+                'max_ms': round(stats.max, 2),
+                'rows': stats.rows
+            })
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Общие перцентили запросов и ожидания пула (мс)"""
+        samples = sorted(self.samples)
+        waits = sorted(self.pool_waits)
+        metrics = {
+            'queries': sum(s.count for s in self.statements.values()),
+            'statements': len(self.statements),
+            'slow': self.slow_count,
+            'p50_ms': round(_percentile(samples, 0.5), 2),
+            'p95_ms': round(_percentile(samples, 0.95), 2),
+            'p99_ms': round(_percentile(samples, 0.99), 2),
+            'pool_wait_p50_ms': round(_percentile(waits, 0.5), 2),
+            'pool_wait_p95_ms': round(_percentile(waits, 0.95), 2),
+            'pool_wait_max_ms': round(self.pool_wait_max, 2)
+        }
+
+        if self._pool is not None and hasattr(self._pool, 'checkedout'):
+            metrics['pool_checked_out'] = self._pool.checkedout()
+            metrics['pool_size'] = self._pool.size()
+
+        return metrics
+
+    def format_report(self, limit: int = 10) -> str:
+        """Текст отчёта для администратора"""
+        metrics = self.get_metrics()
+        text = (
+            f"🗄 Статистика SQL\n\n"
+            f"Запросов: {metrics['queries']} (уникальных: {metrics['statements']}, "
+            f"медленных ≥{self.slow_ms} мс: {metrics['slow']})\n"
+            f"p50/p95/p99: {metrics['p50_ms']} / {metrics['p95_ms']} / {metrics['p99_ms']} мс\n"
+            f"Ожидание пула p50/p95/max: {metrics['pool_wait_p50_ms']} / "
+            f"{metrics['pool_wait_p95_ms']} / {metrics['pool_wait_max_ms']} мс\n"
+        )
+        if 'pool_checked_out' in metrics:
+            text += f"Соединений занято: {metrics['pool_checked_out']}/{metrics['pool_size']}\n"
+
+        top = self.top(limit)
+        if not top:
+            return text + "\nЗапросов ещё не было"
+
+        text += f"\nТоп-{len(top)} по суммарному времени:\n"
+        for i, row in enumerate(top, 1):
+            text += (
+                f"\n{i}. [{row['tag']}] {row['total_ms']} мс всего, {row['count']}×, "
+                f"avg {row['avg_ms']} / p95 {row['p95_ms']} / max {row['max_ms']} мс, "
+                f"строк {row['rows']}\n{row['statement'][:200]}\n"
+            )
+        return text
+
+    def reset(self):
+        """Сбросить накопленную статистику"""
+        self.statements.clear()
+        self.samples.clear()
+        self.pool_waits.clear()
+        self.pool_wait_max = 0.0
+        self.slow_count = 0
+
+# Команды, для которых есть CommandHandler (собираются при первом обновлении)
+_known_commands: Optional[FrozenSet[str]] = None
+
+def _command_tag(text: str, application) -> str:
+    """Метка команды; несуществующие /xyz сводятся в одну метку"""
+    global _known_commands
+    if _known_commands is None:
+        from telegram.ext import CommandHandler
+
+        _known_commands = frozenset(
+            command
+            for handlers in application.handlers.values()
+            for handler in handlers if isinstance(handler, CommandHandler)
+            for command in handler.commands
+        )
+
+    command = text.split()[0][1:].split('@')[0].lower()
+    return f"/{command}" if command in _known_commands else '/other'
+
+async def tag_update(update, context):
+    """Ранний обработчик: метка запросов по команде или префиксу callback
+
+    Метки ограничены зарегистрированными командами и префиксами, иначе выдуманные
+    пользователями /xyz раздували бы statements и топ /dbstats.
+    """
+    if update.callback_query and update.callback_query.data:
+        from services.callback_registry import callback_registry
+
+        prefix = update.callback_query.data.partition(':')[0]
+        tag = f"cb:{prefix if prefix in callback_registry.routes else 'other'}"
+    elif update.message and update.message.text and update.message.text.startswith('/'):
+        tag = _command_tag(update.message.text, context.application)
+    elif update.message:
+        tag = 'message'
+    else:
+        tag = 'update'
+    set_query_tag(tag)
+
+# Глобальный экземпляр статистики запросов
+query_stats = QueryStats()
+
+__all__ = ['QueryStats', 'query_stats', 'query_tag', 'set_query_tag', 'tag_update']
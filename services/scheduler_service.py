@@ -1,56 +1,562 @@
-import logging
+# -*- coding: utf-8 -*-
+"""
+Планировщик фоновых задач
+Куча сроков: цикл спит ровно до ближайшей задачи. Триггеры cron / interval / date
+в часовом поясе Будапешта, jitter, обработка пропущенных запусков и хранение задач в БД
+"""
 import asyncio
-from typing import Optional
+import heapq
+import importlib
+import itertools
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pytz
+
+from config import Config
+from services.db import db
 
 logger = logging.getLogger(__name__)
 
+# Timezone Будапешта
+BUDAPEST_TZ = pytz.timezone('Europe/Budapest')
+
+# ============= ТРИГГЕРЫ =============
+
+def _parse_cron_field(spec: str, low: int, high: int) -> List[int]:
+    """Поле cron: *, N, N-M, */S, N-M/S и списки через запятую"""
+    values = set()
+    for part in spec.split(','):
+        step = 1
+        if '/' in part:
+            part, step_spec = part.split('/', 1)
+            step = int(step_spec)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Invalid cron field '{spec}'")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+class _CronExpression:
+    """Одно выражение 'минуты часы дни месяцы дни_недели' (0 и 7 - воскресенье)"""
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: '{expr}'")
+        self.expr = expr
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = set(_parse_cron_field(fields[2], 1, 31))
+        self.months = set(_parse_cron_field(fields[3], 1, 12))
+        self.weekdays = {d % 7 for d in _parse_cron_field(fields[4], 0, 7)}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays
+        # Как в cron: если ограничены оба поля, достаточно совпадения одного
+        if not self.any_day and not self.any_weekday:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, after: float, tz) -> Optional[float]:
+        local = datetime.fromtimestamp(after, tz)
+        start = local.replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+
+        # 4 года покрывают 29 февраля
+        for _ in range(366 * 4):
+            if self._day_matches(day):
+                for hour in self.hours:
+                    if day == start.date() and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if day == start.date() and hour == start.hour and minute < start.minute:
+                            continue
+                        naive = datetime(day.year, day.month, day.day, hour, minute)
+                        fire_at = tz.normalize(tz.localize(naive)).timestamp()
+                        if fire_at > after:
+                            return fire_at
+            day += timedelta(days=1)
+        return None
+
+class CronTrigger:
+    """Запуск по одному или нескольким cron-выражениям (ближайшее из них)"""
+
+    kind = 'cron'
+
+    def __init__(self, *expressions: str, timezone: str = 'Europe/Budapest'):
+        self.expressions = [_CronExpression(expr) for expr in expressions]
+        self.timezone = timezone
+        self._tz = pytz.timezone(timezone)
+
+    def next_fire(self, previous: Optional[float], now: float) -> Optional[float]:
+        after = previous if previous is not None else now
+        candidates = [e.next_after(after, self._tz) for e in self.expressions]
+        candidates = [c for c in candidates if c is not None]
+        return min(candidates) if candidates else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'expressions': [e.expr for e in self.expressions],
+                'timezone': self.timezone}
+
+    def __repr__(self):
+        return f"cron[{', '.join(e.expr for e in self.expressions)}]"
+
+class IntervalTrigger:
+    """Запуск каждые seconds секунд (отсчёт от запланированного времени - без дрейфа)"""
+
+    kind = 'interval'
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_fire(self, previous: Optional[float], now: float) -> Optional[float]:
+        return (previous if previous is not None else now) + self.seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'seconds': self.seconds}
+
+    def __repr__(self):
+        return f"every {self.seconds:g}s"
+
+class DateTrigger:
+    """Однократный запуск в момент run_at (timestamp)"""
+
+    kind = 'date'
+
+    def __init__(self, run_at: float):
+        self.run_at = run_at
+
+    def next_fire(self, previous: Optional[float], now: float) -> Optional[float]:
+        return self.run_at if previous is None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'kind': self.kind, 'run_at': self.run_at}
+
+    def __repr__(self):
+        return f"once at {datetime.fromtimestamp(self.run_at, BUDAPEST_TZ):%d.%m.%Y %H:%M}"
+
+def trigger_from_dict(data: Dict[str, Any]):
+    """Восстановить триггер из сохранённого описания"""
+    kind = data.get('kind')
+    if kind == 'cron':
+        return CronTrigger(*data['expressions'], timezone=data.get('timezone', 'Europe/Budapest'))
+    if kind == 'interval':
+        return IntervalTrigger(data['seconds'])
+    if kind == 'date':
+        return DateTrigger(data['run_at'])
+    raise ValueError(f"Unknown trigger kind: {kind}")
+
+# ============= ЗАДАЧИ =============
+
+class Job:
+    """Зарегистрированная задача и её состояние"""
+
+    def __init__(self, job_id: str, func: Callable, trigger, args: tuple = (),
+                 kwargs: Optional[Dict[str, Any]] = None, jitter: float = 0,
+                 misfire_grace_time: Optional[float] = None, coalesce: bool = True,
+                 persist: bool = True):
+        self.id = job_id
+        self.func = func
+        self.trigger = trigger
+        self.args = tuple(args)
+        self.kwargs = kwargs or {}
+        self.jitter = jitter
+        self.misfire_grace_time = (
+            Config.SCHEDULER_MISFIRE_GRACE if misfire_grace_time is None else misfire_grace_time
+        )
+        self.coalesce = coalesce
+        self.persist = persist
+
+        # Срок по триггеру и фактический (с jitter)
+        self.scheduled_at: Optional[float] = None
+        self.next_run: Optional[float] = None
+        self.last_run: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.errors = 0
+        self.misfires = 0
+        self.last_duration = 0.0
+
+    @property
+    def func_ref(self) -> str:
+        return f"{self.func.__module__}:{self.func.__qualname__}"
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+def _resolve(func_ref: str) -> Optional[Callable]:
+    """Функция по 'module:qualname' (только функции уровня модуля)"""
+    module_name, _, qualname = func_ref.partition(':')
+    # Методы и вложенные функции без экземпляра не восстановить
+    if '.' in qualname:
+        return None
+    try:
+        target = importlib.import_module(module_name)
+        target = getattr(target, qualname)
+        return target if callable(target) else None
+    except Exception:
+        return None
+
+def _to_datetime(timestamp: Optional[float]) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(timestamp) if timestamp is not None else None
+
+def _to_timestamp(value: Optional[datetime]) -> Optional[float]:
+    return (value - datetime(1970, 1, 1)).total_seconds() if value is not None else None
+
 class SchedulerService:
-    """Simple scheduler service without APScheduler dependency"""
-    
+    """Асинхронный планировщик на куче сроков"""
+
     def __init__(self):
         self.running = False
         self.task: Optional[asyncio.Task] = None
-        logger.info("SchedulerService initialized (simple mode)")
-    
+
+        self.jobs: Dict[str, Job] = {}
+        # (next_run, seq, job_id); устаревшие элементы пропускаются
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+
+        # Сохранённое состояние задач из БД: job_id -> строка
+        self._stored: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    # ============= РЕГИСТРАЦИЯ =============
+
+    def add_job(self, job_id: str, func: Callable, trigger, args: tuple = (),
+                kwargs: Optional[Dict[str, Any]] = None, jitter: float = 0,
+                misfire_grace_time: Optional[float] = None, coalesce: bool = True,
+                persist: bool = True, next_run_at: Optional[float] = None) -> Job:
+        """Добавить или заменить задачу (func - корутинная функция)
+
+        next_run_at - первый запуск вместо вычисленного триггером.
+        persist=True сохраняет описание и сроки в БД: пропущенный за время простоя запуск
+        обрабатывается по misfire_grace_time, а задачи с функцией уровня модуля
+        восстанавливаются после перезапуска.
+        """
+        job = Job(job_id, func, trigger, args, kwargs, jitter, misfire_grace_time, coalesce, persist)
+        previous = self.jobs.get(job_id)
+        if previous is not None:
+            job.task = previous.task
+            job.last_run = previous.last_run
+
+        now = time.time()
+        stored = self._stored.get(job_id)
+        if next_run_at is not None:
+            scheduled = next_run_at
+        elif stored and persist and stored['next_run_at'] and stored['trigger'] == trigger.to_dict():
+            # Определение не менялось - продолжаем с сохранённого срока
+            scheduled = _to_timestamp(stored['next_run_at'])
+            job.last_run = _to_timestamp(stored['last_run_at'])
+        else:
+            scheduled = trigger.next_fire(None, now)
+
+        self.jobs[job_id] = job
+        self._schedule(job, scheduled)
+        logger.debug(f"📅 Job '{job_id}' scheduled: {trigger!r}, next {self._format(job.next_run)}")
+        return job
+
+    def remove_job(self, job_id: str, keep_state: bool = False) -> bool:
+        """Удалить задачу (keep_state - оставить сохранённые сроки для следующего запуска)"""
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return False
+        if job.persist and not keep_state:
+            self._stored.pop(job_id, None)
+            self._mark_dirty(job_id, None)
+        logger.debug(f"🗑 Job '{job_id}' removed")
+        return True
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def reschedule(self, job_id: str, run_at: float) -> bool:
+        """Перенести следующий запуск задачи"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        self._schedule(job, run_at, jitter=False)
+        return True
+
+    def _schedule(self, job: Job, scheduled: Optional[float], jitter: bool = True):
+        """Поставить задачу в кучу на scheduled (+ jitter)"""
+        job.scheduled_at = scheduled
+        if scheduled is None:
+            job.next_run = None
+        else:
+            job.next_run = scheduled + (random.uniform(0, job.jitter) if jitter and job.jitter else 0)
+            heapq.heappush(self._heap, (job.next_run, next(self._seq), job.id))
+            if self._heap[0][2] == job.id:
+                self._wakeup.set()
+
+        if job.persist:
+            self._mark_dirty(job.id, {
+                'id': job.id,
+                'func_ref': job.func_ref,
+                'trigger': job.trigger.to_dict(),
+                'args': list(job.args),
+                'kwargs': job.kwargs,
+                'next_run_at': _to_datetime(job.scheduled_at),
+                'last_run_at': _to_datetime(job.last_run),
+                'updated_at': datetime.utcnow()
+            })
+
+    # ============= ЦИКЛ =============
+
     async def start(self):
         """Start the scheduler"""
         if self.running:
             logger.warning("Scheduler is already running")
             return
-        
+
+        await self.load()
         self.running = True
-        logger.info("Scheduler started (simple mode)")
-        
-        # В простой версии не запускаем задачи
-        # Можно добавить функционал позже если нужен
-    
+        self.task = asyncio.create_task(self._run())
+        logger.info(f"✅ Scheduler started: {len(self.jobs)} jobs")
+
     async def stop(self):
         """Stop the scheduler"""
         if not self.running:
             return
-        
+
         self.running = False
-        
+
         if self.task and not self.task.done():
             self.task.cancel()
             try:
                 await self.task
             except asyncio.CancelledError:
                 pass
-        
+
+        await self.flush()
         logger.info("Scheduler stopped")
-    
+
     def is_running(self) -> bool:
         """Check if scheduler is running"""
         return self.running
-    
-    async def add_job(self, func, **kwargs):
-        """Placeholder for adding jobs"""
-        logger.info(f"Job scheduling not implemented: {func.__name__}")
-    
-    async def remove_job(self, job_id: str):
-        """Placeholder for removing jobs"""
-        logger.info(f"Job removal not implemented: {job_id}")
+
+    async def _run(self):
+        """Спим до ближайшего срока или до добавления более ранней задачи"""
+        while self.running:
+            self._wakeup.clear()
+            self.run_due(time.time())
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def run_due(self, now: float) -> int:
+        """Запустить все наступившие задачи, вернуть число запусков"""
+        started = 0
+        while self._heap and self._heap[0][0] <= now:
+            run_at, _, job_id = heapq.heappop(self._heap)
+            job = self.jobs.get(job_id)
+            # Задача удалена или перенесена - элемент кучи устарел
+            if job is None or job.next_run != run_at:
+                continue
+
+            scheduled = job.scheduled_at
+            late = now - run_at
+            if late > job.misfire_grace_time:
+                job.misfires += 1
+                logger.warning(
+                    f"⏭ Job '{job_id}' missed run at {self._format(run_at)} "
+                    f"by {late:.0f}s (grace {job.misfire_grace_time:g}s)"
+                )
+            elif job.running:
+                logger.warning(f"⏭ Job '{job_id}' is still running, skipping this run")
+            else:
+                job.task = asyncio.create_task(self._execute(job))
+                started += 1
+
+            # Следующий срок считается от запланированного, пропущенные при coalesce - сливаются
+            next_scheduled = job.trigger.next_fire(scheduled, now)
+            if job.coalesce:
+                while next_scheduled is not None and next_scheduled <= now:
+                    next_scheduled = job.trigger.next_fire(next_scheduled, now)
+
+            if next_scheduled is None:
+                # Однократная задача отработала
+                self.jobs.pop(job_id, None)
+                if job.persist:
+                    self._stored.pop(job_id, None)
+                    self._mark_dirty(job_id, None)
+            else:
+                self._schedule(job, next_scheduled)
+        return started
+
+    async def _execute(self, job: Job):
+        """Выполнить задачу с меткой SQL-запросов и учётом ошибок"""
+        from services.query_stats import set_query_tag
+        set_query_tag(f"job:{job.id}")
+
+        started = time.monotonic()
+        job.last_run = time.time()
+        try:
+            await job.func(*job.args, **job.kwargs)
+            job.runs += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.errors += 1
+            logger.error(f"Error in job '{job.id}': {e}", exc_info=True)
+        finally:
+            job.last_duration = time.monotonic() - started
+
+    @staticmethod
+    def _format(timestamp: Optional[float]) -> str:
+        if timestamp is None:
+            return "never"
+        return datetime.fromtimestamp(timestamp, BUDAPEST_TZ).strftime('%d.%m.%Y %H:%M:%S')
+
+    # ============= ПЕРСИСТЕНТНОСТЬ =============
+
+    def _mark_dirty(self, job_id: str, row: Optional[Dict[str, Any]]):
+        """Запомнить изменение задачи и запустить запись, если она не идёт"""
+        if not db.session_maker:
+            return
+        self._dirty[job_id] = row
+
+        if self._writer is None or self._writer.done():
+            try:
+                self._writer = asyncio.get_running_loop().create_task(self._write())
+            except RuntimeError:
+                pass  # нет event loop - запишется при следующем изменении или flush()
+
+    async def _write(self):
+        """Записывать изменения, пока они есть; по задаче пишется последнее состояние"""
+        from models import ScheduledJob
+        from sqlalchemy import delete
+
+        while self._dirty:
+            batch, self._dirty = self._dirty, {}
+            rows = [row for row in batch.values() if row is not None]
+            removed = [job_id for job_id, row in batch.items() if row is None]
+
+            try:
+                async with db.get_session() as session:
+                    if rows:
+                        await session.execute(db.build_upsert(
+                            ScheduledJob.__table__, rows,
+                            index_elements=['id'],
+                            update_columns=['func_ref', 'trigger', 'args', 'kwargs',
+                                            'next_run_at', 'last_run_at', 'updated_at']
+                        ))
+                    if removed:
+                        await session.execute(
+                            delete(ScheduledJob).where(ScheduledJob.id.in_(removed))
+                        )
+                    await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving scheduled jobs: {e}")
+                for job_id, row in batch.items():
+                    self._dirty.setdefault(job_id, row)
+                return
+
+    async def load(self) -> int:
+        """Загрузить сохранённые задачи: сроки для зарегистрированных, остальные - восстановить"""
+        if not db.session_maker:
+            return 0
+
+        try:
+            from models import ScheduledJob
+            from sqlalchemy import select
+
+            async with db.get_session() as session:
+                result = await session.execute(select(ScheduledJob))
+                rows = result.scalars().all()
+        except Exception as e:
+            logger.error(f"Error loading scheduled jobs: {e}")
+            return 0
+
+        restored = 0
+        for row in rows:
+            stored = {
+                'trigger': row.trigger,
+                'next_run_at': row.next_run_at,
+                'last_run_at': row.last_run_at
+            }
+            self._stored[row.id] = stored
+
+            job = self.jobs.get(row.id)
+            if job is not None:
+                # Зарегистрирована до старта - продолжаем с сохранённого срока
+                if job.persist and row.trigger == job.trigger.to_dict() and row.next_run_at:
+                    job.last_run = _to_timestamp(row.last_run_at)
+                    self._schedule(job, _to_timestamp(row.next_run_at))
+                continue
+
+            func = _resolve(row.func_ref)
+            if func is None:
+                continue
+            try:
+                self.add_job(row.id, func, trigger_from_dict(row.trigger),
+                             args=tuple(row.args or ()), kwargs=row.kwargs or {})
+                restored += 1
+            except Exception as e:
+                logger.error(f"Could not restore job '{row.id}': {e}")
+
+        logger.info(f"✅ Scheduled jobs loaded: {len(rows)} stored, {restored} restored")
+        return restored
+
+    async def flush(self):
+        """Дождаться записи всех изменений в БД"""
+        if self._writer is not None and not self._writer.done():
+            await self._writer
+        if self._dirty and db.session_maker:
+            await self._write()
+
+    # ============= МЕТРИКИ =============
+
+    def get_jobs_info(self) -> List[Dict[str, Any]]:
+        """Задачи в порядке следующего запуска"""
+        jobs = sorted(self.jobs.values(), key=lambda j: j.next_run or float('inf'))
+        return [
+            {
+                'id': job.id,
+                'trigger': repr(job.trigger),
+                'next_run': self._format(job.next_run),
+                'last_run': self._format(job.last_run),
+                'runs': job.runs,
+                'errors': job.errors,
+                'misfires': job.misfires,
+                'running': job.running,
+                'last_duration_ms': round(job.last_duration * 1000, 1)
+            }
+            for job in jobs
+        ]
 
 # Global instance
 scheduler_service = SchedulerService()
+
+__all__ = [
+    'SchedulerService',
+    'scheduler_service',
+    'Job',
+    'CronTrigger',
+    'IntervalTrigger',
+    'DateTrigger',
+    'trigger_from_dict',
+    'BUDAPEST_TZ'
+]
@@ -1,9 +1,7 @@
 # -*- coding: utf-8 -*-
-import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Optional
-from config import Config
+from datetime import datetime
+from services.scheduler_service import scheduler_service, CronTrigger
 import pytz
 
 logger = logging.getLogger(__name__)
@@ -24,11 +22,10 @@ STATS_TIMES_BUDAPEST = [
 class StatsScheduler:
     """Планировщик автоматической статистики с фиксированными временами"""
     
+    JOB_ID = 'stats'
+    
     def __init__(self):
-        self.task: Optional[asyncio.Task] = None
-        self.running = False
         self.admin_notifications = None
-        self._stop_event = asyncio.Event()
     
     def set_admin_notifications(self, admin_notifications):
         """Устанавливает сервис уведомлений"""
@@ -36,8 +33,8 @@ class StatsScheduler:
         logger.info("Admin notifications service set for stats scheduler")
     
     async def start(self):
-        """Запустить планировщик статистики"""
-        if self.task and not self.task.done():
+        """Зарегистрировать отправку статистики в общем планировщике"""
+        if scheduler_service.get_job(self.JOB_ID):
             logger.warning("Stats scheduler already running")
             return
         
@@ -45,9 +42,9 @@ class StatsScheduler:
             logger.error("Admin notifications service not set")
             return
         
-        self.running = True
-        self._stop_event.clear()
-        self.task = asyncio.create_task(self._stats_loop())
+        # Одно cron-выражение на каждое время из расписания
+        trigger = CronTrigger(*[f"{minute} {hour} * * *" for hour, minute in STATS_TIMES_BUDAPEST])
+        scheduler_service.add_job(self.JOB_ID, self._send_scheduled_stats, trigger)
         logger.info("Stats scheduler started")
         
         # Логируем расписание
@@ -56,94 +53,23 @@ class StatsScheduler:
             logger.info(f"  ⏰ {hour:02d}:{minute:02d}")
     
     async def stop(self):
-        """Остановить планировщик корректно"""
-        logger.info("Stopping stats scheduler...")
-        self.running = False
-        self._stop_event.set()
-        
-        if self.task:
-            try:
-                # Даём задаче 5 секунд на завершение
-                await asyncio.wait_for(self.task, timeout=5.0)
-                logger.info("Stats scheduler task completed")
-            except asyncio.TimeoutError:
-                logger.warning("Stats scheduler task timeout, cancelling...")
-                self.task.cancel()
-                try:
-                    await self.task
-                except asyncio.CancelledError:
-                    logger.info("Stats scheduler task cancelled")
-            except asyncio.CancelledError:
-                logger.info("Stats scheduler task was cancelled")
-            except Exception as e:
-                logger.error(f"Error stopping stats scheduler: {e}")
-            finally:
-                self.task = None
-        
+        """Снять задачу (сохранённый срок остаётся для следующего запуска)"""
+        scheduler_service.remove_job(self.JOB_ID, keep_state=True)
         logger.info("Stats scheduler stopped")
     
-    async def _stats_loop(self):
-        """Основной цикл отправки статистики"""
-        logger.info("Stats loop started")
-        
+    async def _send_scheduled_stats(self):
+        """Отправка статистики по расписанию"""
+        budapest_now = datetime.now(BUDAPEST_TZ)
+        logger.info(f"⏰ Stats time reached: {budapest_now:%H:%M} Budapest")
         try:
-            while self.running:
-                try:
-                    # Получаем текущее время в Будапеште
-                    budapest_now = datetime.now(BUDAPEST_TZ)
-                    current_hour = budapest_now.hour
-                    current_minute = budapest_now.minute
-                    
-                    # Проверяем, совпадает ли текущее время с расписанием
-                    should_send = False
-                    for scheduled_hour, scheduled_minute in STATS_TIMES_BUDAPEST:
-                        if current_hour == scheduled_hour and current_minute == scheduled_minute:
-                            should_send = True
-                            break
-                    
-                    if should_send and self.running:
-                        logger.info(f"⏰ Stats time reached: {current_hour:02d}:{current_minute:02d} Budapest")
-                        try:
-                            await self.admin_notifications.send_statistics()
-                            logger.info("✅ Statistics sent successfully")
-                        except Exception as e:
-                            logger.error(f"Error sending statistics: {e}")
-                        
-                        # Ждём 2 минуты чтобы не отправить статистику дважды
-                        await asyncio.sleep(120)
-                    
-                    # Проверяем каждые 30 секунд
-                    try:
-                        await asyncio.wait_for(
-                            self._stop_event.wait(),
-                            timeout=30
-                        )
-                        # Если stop event сработал - выходим
-                        if not self.running:
-                            logger.info("Stats loop received stop signal")
-                            break
-                    except asyncio.TimeoutError:
-                        # Timeout - нормально, продолжаем
-                        pass
-                    
-                except asyncio.CancelledError:
-                    logger.info("Stats loop cancelled")
-                    raise
-                except Exception as e:
-                    logger.error(f"Error in stats loop: {e}")
-                    await asyncio.sleep(60)
-                    
-        except asyncio.CancelledError:
-            logger.info("Stats loop cancelled (outer)")
-            raise
+            await self.admin_notifications.send_statistics()
+            logger.info("✅ Statistics sent successfully")
         except Exception as e:
-            logger.error(f"Unexpected error in stats loop: {e}", exc_info=True)
-        finally:
-            logger.info("Stats loop finished")
+            logger.error(f"Error sending statistics: {e}")
     
     def is_running(self) -> bool:
         """Проверить, запущен ли планировщик"""
-        return self.running and self.task and not self.task.done()
+        return scheduler_service.is_running() and scheduler_service.get_job(self.JOB_ID) is not None
     
     async def send_stats_now(self):
         """Отправить статистику немедленно (для команды)"""
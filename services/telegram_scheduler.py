@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Центральный планировщик исходящих запросов к Telegram API
+Подключается к Application как rate limiter: глобальный и per-chat лимиты,
+приоритет интерактивных ответов над массовыми задачами, повтор при RetryAfter.
+Корзины чатов, простаивающие с полным запасом, удаляются периодической чисткой
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Как часто чистить простаивающие корзины чатов (сек)
+SWEEP_INTERVAL = 60.0
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_BULK: 'bulk'
+}
+
+# Приоритет текущей задачи (наследуется asyncio-задачами, созданными внутри)
+_current_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    'outbound_priority', default=PRIORITY_INTERACTIVE
+)
+
+@contextmanager
+def bulk_priority():
+    """Пометить запросы внутри блока как массовые (рассылка, tagall, purge, статистика)"""
+    token = _current_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Секунды ожидания из RetryAfter (int или timedelta в разных версиях PTB)"""
+    value = getattr(error, 'retry_after', 1)
+    if hasattr(value, 'total_seconds'):
+        return value.total_seconds()
+    return float(value)
+
+class _Bucket:
+    """Token bucket без блокировок: take() возвращает 0 или сколько ждать"""
+
+    def __init__(self, limit: float, period: float):
+        self.capacity = limit
+        self.refill = limit / period
+        self.tokens = limit
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def take(self) -> float:
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.refill
+
+    def is_idle(self, now: float) -> bool:
+        """Запас восстановлен полностью и паузы нет - корзину можно удалить"""
+        return (
+            now >= self.paused_until
+            and self.tokens + (now - self.updated) * self.refill >= self.capacity
+        )
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # После паузы - один запрос сразу, дальше в обычном темпе без всплеска
+        self.tokens = min(self.tokens, 1)
+
+class OutboundScheduler(BaseRateLimiter[Dict[str, Any]]):
+    """Очередь исходящих запросов с flood control"""
+
+    def __init__(self, global_rate: float = None, group_rate: float = None,
+                 max_retries: int = None):
+        self.global_rate = global_rate or Config.TG_GLOBAL_RATE
+        self.group_rate = group_rate or Config.TG_GROUP_RATE_PER_MIN
+        self.max_retries = Config.TG_MAX_RETRIES if max_retries is None else max_retries
+
+        self._global = _Bucket(self.global_rate, 1.0)
+        self._chats: Dict[Union[int, str], _Bucket] = {}
+        self._last_sweep = time.monotonic()
+        self.evicted = 0
+        self._waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BULK: 0}
+
+        # Метрики ожидания в очереди по приоритетам
+        self._wait_samples = {p: deque(maxlen=1000) for p in PRIORITY_NAMES}
+        self._wait_max = {p: 0.0 for p in PRIORITY_NAMES}
+        self._requests = {p: 0 for p in PRIORITY_NAMES}
+        self.retries = 0
+
+    async def initialize(self) -> None:
+        logger.info(
+            f"✅ Outbound scheduler: {self.global_rate}/s global, "
+            f"{self.group_rate}/min per group"
+        )
+
+    async def shutdown(self) -> None:
+        pass
+
+    # ============= ЛИМИТЫ =============
+
+    @staticmethod
+    def _is_limited(endpoint: str) -> bool:
+        """Чтение (get*) не ограничиваем"""
+        return not endpoint.lower().startswith('get')
+
+    @staticmethod
+    def _is_group_send(endpoint: str, chat_id) -> bool:
+        """Отправка в группу/канал - действует лимит сообщений на чат"""
+        if chat_id is None:
+            return False
+        endpoint = endpoint.lower()
+        if not (endpoint.startswith('send') or endpoint in ('copymessage', 'forwardmessage')):
+            return False
+        if isinstance(chat_id, str):
+            return chat_id.startswith('@') or chat_id.startswith('-')
+        return chat_id < 0
+
+    def _chat_bucket(self, chat_id) -> _Bucket:
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep(now)
+
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = _Bucket(self.group_rate, 60.0)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удалить корзины чатов с полным запасом (новая корзина создаётся такой же)"""
+        if now is None:
+            now = time.monotonic()
+        self._last_sweep = now
+
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.is_idle(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def _acquire(self, priority: int, chat_bucket: Optional[_Bucket]):
+        """Дождаться разрешения: сначала лимит чата, затем глобальный"""
+        if chat_bucket is not None:
+            while True:
+                delay = chat_bucket.take()
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+
+        self._waiting[priority] += 1
+        try:
+            tick = 1.0 / self.global_rate
+            while True:
+                # Массовые запросы уступают, пока ждут интерактивные
+                if priority > PRIORITY_INTERACTIVE and self._waiting[PRIORITY_INTERACTIVE]:
+                    await asyncio.sleep(tick)
+                    continue
+
+                delay = self._global.take()
+                if not delay:
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            self._waiting[priority] -= 1
+
+    # ============= ВЫПОЛНЕНИЕ =============
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], None]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], None]:
+        if not self._is_limited(endpoint):
+            return await callback(*args, **kwargs)
+
+        priority = _current_priority.get()
+        if rate_limit_args and 'priority' in rate_limit_args:
+            priority = rate_limit_args['priority']
+
+        chat_id = data.get('chat_id')
+        chat_bucket = self._chat_bucket(chat_id) if self._is_group_send(endpoint, chat_id) else None
+
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            await self._acquire(priority, chat_bucket)
+            self._record_wait(priority, time.monotonic() - queued)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+
+                attempt += 1
+                self.retries += 1
+                seconds = retry_after_seconds(e)
+                logger.warning(f"RetryAfter {seconds}s on {endpoint} (chat {chat_id}), retry {attempt}")
+
+                # Лимит группы - пауза только этого чата, иначе всего бота
+                (chat_bucket or self._global).pause(seconds)
+
+    # ============= МЕТРИКИ =============
+
+    def _record_wait(self, priority: int, seconds: float):
+        self._requests[priority] += 1
+        self._wait_samples[priority].append(seconds)
+        if seconds > self._wait_max[priority]:
+            self._wait_max[priority] = seconds
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Время ожидания в очереди по приоритетам (мс)"""
+        metrics = {
+            'retries': self.retries,
+            'tracked_chats': len(self._chats),
+            'evicted_chats': self.evicted
+        }
+
+        for priority, name in PRIORITY_NAMES.items():
+            samples = sorted(self._wait_samples[priority])
+            count = len(samples)
+            metrics[name] = {
+                'requests': self._requests[priority],
+                'waiting': self._waiting[priority],
+                'wait_p50_ms': round(samples[count // 2] * 1000, 1) if count else 0.0,
+                'wait_p95_ms': round(samples[min(count - 1, int(count * 0.95))] * 1000, 1) if count else 0.0,
+                'wait_max_ms': round(self._wait_max[priority] * 1000, 1)
+            }
+
+        return metrics
+
+# Глобальный экземпляр планировщика
+outbound_scheduler = OutboundScheduler()
+
+__all__ = [
+    'OutboundScheduler',
+    'outbound_scheduler',
+    'bulk_priority',
+    'retry_after_seconds',
+    'PRIORITY_INTERACTIVE',
+    'PRIORITY_BULK'
+]
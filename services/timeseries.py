@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+"""
+Временные ряды статистики чатов
+Отсчёты (участники, сообщения) копятся в памяти по минутам и пачкой пишутся в БД
+сразу в три разрешения: минута, час, сутки. Старые точки удаляются по срокам хранения
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from services.db import db
+from services.scheduler_service import scheduler_service, CronTrigger, IntervalTrigger
+
+logger = logging.getLogger(__name__)
+
+# Метрики
+MEMBERS = 'members'    # число участников (значение на момент отсчёта)
+MESSAGES = 'messages'  # сообщения (отсчёт - приращение)
+
+# Разрешения, секунд в интервале
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+WEEK = 7 * DAY
+
+# Больше точек запрос не возвращает - выбирается более грубое разрешение
+MAX_QUERY_POINTS = 1000
+
+# Строк в одном INSERT (лимит переменных SQLite)
+UPSERT_CHUNK = 500
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Агрегат интервала: [samples, total, min, max, last]
+Aggregate = List[float]
+
+def _merge(older: Aggregate, newer: Aggregate):
+    """Дописать более поздний агрегат в older"""
+    older[0] += newer[0]
+    older[1] += newer[1]
+    if newer[2] < older[2]:
+        older[2] = newer[2]
+    if newer[3] > older[3]:
+        older[3] = newer[3]
+    older[4] = newer[4]
+
+def _to_ts(value: datetime) -> float:
+    """Наивный UTC datetime из БД -> timestamp"""
+    return (value - _EPOCH).total_seconds()
+
+class TimeSeriesStore:
+    """Append-only отсчёты с агрегацией минута -> час -> сутки и запросами по диапазону"""
+
+    FLUSH_JOB_ID = 'timeseries_flush'
+    RETENTION_JOB_ID = 'timeseries_retention'
+
+    def __init__(self):
+        # (metric, chat_id, минута от эпохи) -> агрегат; ещё не записано в БД
+        self._pending: Dict[Tuple[str, int, int], Aggregate] = {}
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Сроки хранения по разрешениям, секунд
+        self.retention = {
+            MINUTE: Config.TIMESERIES_MINUTE_RETENTION_DAYS * DAY,
+            HOUR: Config.TIMESERIES_HOUR_RETENTION_DAYS * DAY,
+            DAY: Config.TIMESERIES_DAY_RETENTION_DAYS * DAY,
+        }
+
+        self.samples = 0
+        self.rows_written = 0
+        self.rows_deleted = 0
+        self.failed_flushes = 0
+
+    # ============= ЗАПИСЬ (горячий путь) =============
+
+    def record(self, metric: str, chat_id: int, value: float, now: Optional[float] = None):
+        """Добавить отсчёт (для MESSAGES value - приращение)"""
+        self.add(self.minute_slot(metric, chat_id, int((now or time.time()) // MINUTE)), value)
+
+    @staticmethod
+    def minute_slot(metric: str, chat_id: int, minute: int) -> Tuple[str, int, int]:
+        """Ключ минутного агрегата; частые писатели держат его до смены минуты"""
+        return (metric, chat_id, minute)
+
+    def add(self, slot: Tuple[str, int, int], value: float):
+        """Добавить отсчёт по готовому ключу minute_slot"""
+        if not db.session_maker:
+            return
+
+        agg = self._pending.get(slot)
+        if agg is None:
+            self._pending[slot] = [1, value, value, value, value]
+        else:
+            agg[0] += 1
+            agg[1] += value
+            if value < agg[2]:
+                agg[2] = value
+            if value > agg[3]:
+                agg[3] = value
+            agg[4] = value
+
+        self.samples += 1
+        if len(self._pending) >= Config.TIMESERIES_MAX_PENDING:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flusher is None or self._flusher.done():
+            try:
+                self._flusher = asyncio.get_running_loop().create_task(self.flush())
+            except RuntimeError:
+                pass  # нет event loop - запишется при следующем сбросе
+
+    # ============= СБРОС =============
+
+    @staticmethod
+    def _rollup(pending: Dict[Tuple[str, int, int], Aggregate]) -> List[Dict[str, Any]]:
+        """Минутные агрегаты -> строки всех разрешений"""
+        buckets: Dict[Tuple[str, int, int, int], Aggregate] = {}
+        # По возрастанию времени, чтобы last_value был самым поздним
+        for (metric, chat_id, minute), agg in sorted(pending.items(), key=lambda item: item[0][2]):
+            ts = minute * MINUTE
+            for resolution in RESOLUTIONS:
+                key = (metric, chat_id, resolution, ts - ts % resolution)
+                current = buckets.get(key)
+                if current is None:
+                    buckets[key] = list(agg)
+                else:
+                    _merge(current, agg)
+
+        return [
+            {
+                'metric': metric,
+                'chat_id': chat_id,
+                'resolution': resolution,
+                'bucket': datetime.utcfromtimestamp(bucket),
+                'samples': int(agg[0]),
+                'total': agg[1],
+                'min_value': agg[2],
+                'max_value': agg[3],
+                'last_value': agg[4]
+            }
+            for (metric, chat_id, resolution, bucket), agg in buckets.items()
+        ]
+
+    async def flush(self) -> int:
+        """Записать накопленные отсчёты одной транзакцией, вернуть число строк"""
+        async with self._lock:
+            if not self._pending or not db.session_maker:
+                return 0
+
+            pending, self._pending = self._pending, {}
+            rows = self._rollup(pending)
+
+            try:
+                from models import TimeSeriesPoint
+
+                async with db.get_session() as session:
+                    for i in range(0, len(rows), UPSERT_CHUNK):
+                        await session.execute(db.build_upsert(
+                            TimeSeriesPoint.__table__, rows[i:i + UPSERT_CHUNK],
+                            index_elements=['metric', 'chat_id', 'resolution', 'bucket'],
+                            update_columns=['last_value'],
+                            increment_columns=['samples', 'total'],
+                            min_columns=['min_value'],
+                            max_columns=['max_value']
+                        ))
+                    await session.commit()
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Error flushing time series ({len(rows)} rows): {e}")
+                # Несохранённое - раньше нового, новые значения остаются последними
+                for slot, agg in self._pending.items():
+                    older = pending.get(slot)
+                    if older is None:
+                        pending[slot] = agg
+                    else:
+                        _merge(older, agg)
+                self._pending = pending
+                return 0
+
+            self.rows_written += len(rows)
+            logger.debug(f"Time series flush: {len(pending)} minutes -> {len(rows)} rows")
+            return len(rows)
+
+    async def apply_retention(self, now: Optional[float] = None) -> int:
+        """Удалить точки старше срока хранения своего разрешения"""
+        if not db.session_maker:
+            return 0
+
+        now = now or time.time()
+        try:
+            from models import TimeSeriesPoint
+            from sqlalchemy import delete
+
+            deleted = 0
+            async with db.get_session() as session:
+                for resolution, keep in self.retention.items():
+                    result = await session.execute(
+                        delete(TimeSeriesPoint).where(
+                            TimeSeriesPoint.resolution == resolution,
+                            TimeSeriesPoint.bucket < datetime.utcfromtimestamp(now - keep)
+                        )
+                    )
+                    deleted += result.rowcount or 0
+                await session.commit()
+
+            self.rows_deleted += deleted
+            logger.info(f"🧹 Time series retention: {deleted} points removed")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error applying time series retention: {e}")
+            return 0
+
+    # ============= ЗАПРОСЫ =============
+
+    def pick_resolution(self, start: float, end: float, now: Optional[float] = None) -> int:
+        """Самое подробное разрешение, которое хранится за весь диапазон и даёт не больше MAX_QUERY_POINTS точек"""
+        now = now or time.time()
+        for resolution in RESOLUTIONS:
+            if start >= now - self.retention[resolution] and (end - start) / resolution <= MAX_QUERY_POINTS:
+                return resolution
+        return DAY
+
+    async def query(self, metric: str, chat_id: int, start: float, end: Optional[float] = None,
+                    resolution: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Точки ряда с bucket в [start, end), по возрастанию времени"""
+        if not db.session_maker:
+            return []
+
+        end = end or time.time()
+        resolution = resolution or self.pick_resolution(start, end)
+        await self.flush()
+
+        try:
+            from models import TimeSeriesPoint
+            from sqlalchemy import select
+
+            async with db.get_session() as session:
+                result = await session.execute(
+                    select(TimeSeriesPoint).where(
+                        TimeSeriesPoint.metric == metric,
+                        TimeSeriesPoint.chat_id == chat_id,
+                        TimeSeriesPoint.resolution == resolution,
+                        TimeSeriesPoint.bucket >= datetime.utcfromtimestamp(start - start % resolution),
+                        TimeSeriesPoint.bucket < datetime.utcfromtimestamp(end)
+                    ).order_by(TimeSeriesPoint.bucket)
+                )
+                rows = result.scalars().all()
+
+            return [
+                {
+                    'timestamp': _to_ts(row.bucket),
+                    'resolution': resolution,
+                    'samples': row.samples,
+                    'total': row.total,
+                    'avg': row.total / row.samples if row.samples else 0.0,
+                    'min': row.min_value,
+                    'max': row.max_value,
+                    'last': row.last_value
+                }
+                for row in rows
+            ]
+        except Exception as e:
+            logger.error(f"Error querying time series {metric}:{chat_id}: {e}")
+            return []
+
+    async def _last_values(self, metric: str, start: float, end: float) -> Dict[int, float]:
+        """Последнее значение каждого чата по часовым точкам в [start, end)"""
+        from models import TimeSeriesPoint
+        from sqlalchemy import select
+
+        async with db.get_session() as session:
+            result = await session.execute(
+                select(TimeSeriesPoint.chat_id, TimeSeriesPoint.last_value).where(
+                    TimeSeriesPoint.metric == metric,
+                    TimeSeriesPoint.resolution == HOUR,
+                    TimeSeriesPoint.bucket >= datetime.utcfromtimestamp(start),
+                    TimeSeriesPoint.bucket < datetime.utcfromtimestamp(end)
+                ).order_by(TimeSeriesPoint.bucket)
+            )
+            # Более поздние строки перезаписывают более ранние
+            return {chat_id: value for chat_id, value in result.all()}
+
+    async def latest(self, metric: str, within: float = 2 * DAY) -> Dict[int, float]:
+        """Последнее сохранённое значение по каждому чату (за последние within секунд)"""
+        if not db.session_maker:
+            return {}
+        try:
+            await self.flush()
+            now = time.time()
+            return await self._last_values(metric, now - within, now + HOUR)
+        except Exception as e:
+            logger.error(f"Error loading latest {metric}: {e}")
+            return {}
+
+    async def week_over_week(self, metric: str, now: Optional[float] = None) -> Dict[int, Dict[str, float]]:
+        """Изменение за неделю по каждому чату: {'current', 'previous', 'change', 'change_pct'}
+
+        MEMBERS - последнее значение сейчас и неделю назад,
+        MESSAGES - сумма за последние 7 дней и за 7 дней до них.
+        """
+        if not db.session_maker:
+            return {}
+
+        now = now or time.time()
+        try:
+            await self.flush()
+
+            if metric == MESSAGES:
+                from models import TimeSeriesPoint
+                from sqlalchemy import select, func, case
+
+                week_start = datetime.utcfromtimestamp(now - WEEK)
+                async with db.get_session() as session:
+                    result = await session.execute(
+                        select(
+                            TimeSeriesPoint.chat_id,
+                            func.sum(case((TimeSeriesPoint.bucket >= week_start, TimeSeriesPoint.total), else_=0)),
+                            func.sum(case((TimeSeriesPoint.bucket < week_start, TimeSeriesPoint.total), else_=0))
+                        ).where(
+                            TimeSeriesPoint.metric == metric,
+                            TimeSeriesPoint.resolution == HOUR,
+                            TimeSeriesPoint.bucket >= datetime.utcfromtimestamp(now - 2 * WEEK)
+                        ).group_by(TimeSeriesPoint.chat_id)
+                    )
+                    pairs = {chat_id: (current or 0, previous or 0) for chat_id, current, previous in result.all()}
+            else:
+                current = await self._last_values(metric, now - DAY, now + HOUR)
+                previous = await self._last_values(metric, now - WEEK - DAY, now - WEEK + HOUR)
+                pairs = {chat_id: (value, previous.get(chat_id)) for chat_id, value in current.items()}
+
+            changes = {}
+            for chat_id, (current, previous) in pairs.items():
+                if previous is None:
+                    continue
+                change = current - previous
+                changes[chat_id] = {
+                    'current': current,
+                    'previous': previous,
+                    'change': change,
+                    'change_pct': round(change / previous * 100, 1) if previous else None
+                }
+            return changes
+        except Exception as e:
+            logger.error(f"Error computing week-over-week for {metric}: {e}")
+            return {}
+
+    # ============= ЖИЗНЕННЫЙ ЦИКЛ =============
+
+    async def start(self):
+        """Зарегистрировать сброс и чистку в общем планировщике"""
+        scheduler_service.add_job(
+            self.FLUSH_JOB_ID, self.flush,
+            IntervalTrigger(Config.TIMESERIES_FLUSH_INTERVAL), persist=False
+        )
+        scheduler_service.add_job(
+            self.RETENTION_JOB_ID, self.apply_retention,
+            CronTrigger("40 4 * * *"), persist=False
+        )
+        logger.info(f"✅ Time series store started (flush every {Config.TIMESERIES_FLUSH_INTERVAL}s)")
+
+    async def stop(self):
+        """Снять задачи и дописать накопленное"""
+        scheduler_service.remove_job(self.FLUSH_JOB_ID)
+        scheduler_service.remove_job(self.RETENTION_JOB_ID)
+        if self._flusher is not None and not self._flusher.done():
+            await self._flusher
+        await self.flush()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'pending_minutes': len(self._pending),
+            'samples': self.samples,
+            'rows_written': self.rows_written,
+            'rows_deleted': self.rows_deleted,
+            'failed_flushes': self.failed_flushes
+        }
+
+# Глобальное хранилище временных рядов
+timeseries = TimeSeriesStore()
+
+__all__ = [
+    'TimeSeriesStore',
+    'timeseries',
+    'MEMBERS',
+    'MESSAGES',
+    'MINUTE',
+    'HOUR',
+    'DAY'
+]
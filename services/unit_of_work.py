@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Unit of work на одно обновление Telegram
+Одна сессия БД на update, пользователь загружается не более одного раза, commit в конце
+"""
+import contextvars
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from services.db import db
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Активный unit of work текущего обновления
+_current: contextvars.ContextVar[Optional['UnitOfWork']] = contextvars.ContextVar(
+    'unit_of_work', default=None
+)
+
+class UnitOfWork:
+    """Общая сессия и identity map пользователей в пределах одного обновления"""
+
+    def __init__(self):
+        self._session = None
+        self._users: Dict[int, object] = {}
+        self.queries = 0
+
+    @property
+    def started(self) -> bool:
+        """Открыта ли сессия (до первого обращения к БД соединение не берётся)"""
+        return self._session is not None
+
+    def session(self):
+        """Сессия обновления, создаётся при первом обращении"""
+        if self._session is None:
+            if not db.session_maker:
+                raise RuntimeError("Database not initialized")
+            self._session = db.session_maker()
+        return self._session
+
+    async def get_user(self, user_id: int):
+        """User по ID: первый вызов идёт в БД, дальше - из identity map (в т.ч. None)"""
+        user = self._users.get(user_id, _MISSING)
+        if user is _MISSING:
+            from models import User
+
+            result = await self.session().execute(select(User).where(User.id == user_id))
+            user = result.scalar_one_or_none()
+            self._users[user_id] = user
+            self.queries += 1
+        return user
+
+    def add(self, obj):
+        """Добавить объект в сессию"""
+        self.session().add(obj)
+
+    async def flush(self):
+        """Отправить изменения в БД без commit (например, чтобы получить ID)"""
+        if self._session is not None:
+            await self._session.flush()
+
+    @property
+    def has_changes(self) -> bool:
+        session = self._session
+        return session is not None and bool(session.new or session.dirty or session.deleted)
+
+    async def commit(self):
+        """Зафиксировать изменения (без запроса, если их нет)"""
+        if self._session is not None and (self.has_changes or self._session.in_transaction()):
+            await self._session.commit()
+
+    async def rollback(self):
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._users.clear()
+
+def current_uow() -> Optional[UnitOfWork]:
+    """Unit of work текущего обновления или None"""
+    return _current.get()
+
+@asynccontextmanager
+async def unit_of_work():
+    """Открыть unit of work (вложенный вызов переиспользует внешний)
+
+    На выходе - commit, при исключении - rollback; соединение возвращается в пул.
+    """
+    outer = _current.get()
+    if outer is not None:
+        yield outer
+        return
+
+    uow = UnitOfWork()
+    token = _current.set(uow)
+    try:
+        yield uow
+        await uow.commit()
+    except Exception:
+        try:
+            await uow.rollback()
+        except Exception as rollback_error:
+            logger.error(f"Error rolling back unit of work: {rollback_error}")
+        raise
+    finally:
+        _current.reset(token)
+        await uow.close()
+
+__all__ = ['UnitOfWork', 'unit_of_work', 'current_uow']
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище пользователей бота
+Кэш в памяти с вторичными индексами поверх services.db
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, List, Set
+
+from services.db import db
+from services.activity_buffer import activity_buffer
+from services.activity_aggregates import ActivityAggregates
+from services.leaderboard import Leaderboard
+from services.expiring_store import expiring_store, MUTE
+
+logger = logging.getLogger(__name__)
+
+# Поля модерации, которые сохраняются сразу (счётчики идут через activity_buffer)
+MODERATION_FIELDS = ('banned', 'ban_reason', 'banned_at', 'muted_until')
+
+class UserStore:
+    """Репозиторий пользователей: read-through кэш, индексы и запись в БД"""
+
+    def __init__(self):
+        self.users: Dict[int, Dict] = {}
+
+        # Вторичные индексы
+        self._by_username: Dict[str, int] = {}
+        self._by_activity: "OrderedDict[int, None]" = OrderedDict()  # от давних к недавним
+        self._banned: Set[int] = set()
+        self._by_messages = Leaderboard()
+
+        # Поддерживаемые агрегаты для статистики
+        self.stats = ActivityAggregates()
+
+        self._pending: Set[asyncio.Task] = set()
+        self.loaded = False
+
+        # Действующие муты - только в expiring_store (срок сохраняется в user_activity,
+        # поэтому persist=False); muted_until в записи - копия для БД
+        expiring_store.register(MUTE, on_expire=self._on_mute_expired, persist=False)
+
+    # ============= ИНДЕКСЫ =============
+
+    @staticmethod
+    def _username_key(username: Optional[str]) -> Optional[str]:
+        """Ключ индекса по username"""
+        if not username:
+            return None
+        return username.lower().lstrip('@')
+
+    def _set_username(self, user: Dict, username: str):
+        """Сменить username с обновлением индекса"""
+        old_key = self._username_key(user.get('username'))
+        if old_key and self._by_username.get(old_key) == user['id']:
+            del self._by_username[old_key]
+
+        user['username'] = username
+        new_key = self._username_key(username)
+        if new_key:
+            self._by_username[new_key] = user['id']
+
+    def _touch_activity(self, user_id: int):
+        """Переместить пользователя в конец индекса активности"""
+        self._by_activity[user_id] = None
+        self._by_activity.move_to_end(user_id)
+
+    def _insert_activity(self, user: Dict):
+        """Поставить пользователя в индекс активности по last_activity
+
+        OrderedDict не вставляет в середину: записи по одну сторону от места
+        переносятся в край, поэтому стоимость - расстояние до ближайшего края.
+        """
+        order = self._by_activity
+        user_id, at = user['id'], user['last_activity']
+        order.pop(user_id, None)
+        half = len(order) // 2
+
+        # Место в новой половине: более новые записи - после пользователя
+        newer = []
+        for other in reversed(order):
+            if self.users[other]['last_activity'] <= at or len(newer) > half:
+                break
+            newer.append(other)
+        if len(newer) <= half:
+            order[user_id] = None
+            for other in reversed(newer):
+                order.move_to_end(other)
+            return
+
+        # Иначе - с начала: более давние записи - перед пользователем
+        older = []
+        for other in order:
+            if self.users[other]['last_activity'] > at:
+                break
+            older.append(other)
+        order[user_id] = None
+        order.move_to_end(user_id, last=False)
+        for other in reversed(older):
+            order.move_to_end(other, last=False)
+
+    def _index(self, user: Dict):
+        """Добавить запись в кэш и все индексы"""
+        user_id = user['id']
+        self.users[user_id] = user
+
+        key = self._username_key(user.get('username'))
+        if key:
+            self._by_username[key] = user_id
+
+        self._touch_activity(user_id)
+
+        if user.get('banned'):
+            self._banned.add(user_id)
+        if user.get('muted_until'):
+            expiring_store.set(MUTE, user_id, expires_at=user['muted_until'].timestamp())
+
+        self._by_messages.update(user_id, user['message_count'])
+        self.stats.add_user(user)
+
+    def _unindex(self, user_id: int) -> Optional[Dict]:
+        """Убрать запись из кэша и всех индексов"""
+        user = self.users.pop(user_id, None)
+        if not user:
+            return None
+
+        key = self._username_key(user.get('username'))
+        if key and self._by_username.get(key) == user_id:
+            del self._by_username[key]
+
+        self._by_activity.pop(user_id, None)
+        self._banned.discard(user_id)
+        expiring_store.delete(MUTE, user_id)
+        self._by_messages.remove(user_id)
+        self.stats.remove_user(user)
+        return user
+
+    # ============= ЧТЕНИЕ =============
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Получить пользователя из кэша"""
+        return self.users.get(user_id)
+
+    async def fetch(self, user_id: int) -> Optional[Dict]:
+        """Получить пользователя, при промахе кэша - из БД"""
+        user = self.users.get(user_id)
+        if user or not db.session_maker:
+            return user
+
+        try:
+            from models import UserActivity
+
+            async with db.get_session() as session:
+                row = await session.get(UserActivity, user_id)
+
+            if row:
+                user = self._row_to_user(row)
+                self._index(user)
+                # Возвращаем пользователя на его реальное место в индексе активности
+                self._insert_activity(user)
+            return user
+        except Exception as e:
+            logger.warning(f"Could not load user {user_id} from DB: {e}")
+            return None
+
+    def get_by_username(self, username: str) -> Optional[Dict]:
+        """Найти пользователя по username (O(1))"""
+        user_id = self._by_username.get(self._username_key(username))
+        if user_id is None:
+            return None
+        return self.users.get(user_id)
+
+    def is_banned(self, user_id: int) -> bool:
+        """Проверить бан по индексу"""
+        return user_id in self._banned
+
+    def is_muted(self, user_id: int) -> bool:
+        """Проверить мут (O(1), истёкшие муты снимает expiring_store)"""
+        return expiring_store.contains(MUTE, user_id)
+
+    def banned_users(self) -> List[Dict]:
+        """Все забаненные пользователи"""
+        return [self.users[user_id] for user_id in self._banned if user_id in self.users]
+
+    def muted_users(self) -> List[Dict]:
+        """Все пользователи с действующим мутом"""
+        return [
+            self.users[user_id] for user_id, _, _ in expiring_store.items(MUTE)
+            if user_id in self.users
+        ]
+
+    def active_since(self, threshold: datetime) -> List[Dict]:
+        """Пользователи, активные после threshold (обход с конца индекса)"""
+        result = []
+        for user_id in reversed(self._by_activity):
+            user = self.users[user_id]
+            if user['last_activity'] <= threshold:
+                break
+            result.append(user)
+        return result
+
+    def inactive_before(self, threshold: datetime) -> List[Dict]:
+        """Пользователи, неактивные с threshold (обход с начала индекса)"""
+        result = []
+        for user_id in self._by_activity:
+            user = self.users[user_id]
+            if user['last_activity'] >= threshold:
+                break
+            result.append(user)
+        return result
+
+    def summary(self) -> Dict:
+        """Сводная статистика пользователей из агрегатов (без прохода по всем)"""
+        total_users = len(self.users)
+        total_messages = self.stats.total_messages
+
+        return {
+            'total_users': total_users,
+            'active_24h': self.stats.active_count(24),
+            'active_7d': self.stats.active_count(168),
+            'total_messages': total_messages,
+            'banned_count': len(self._banned),
+            'muted_count': len(expiring_store.items(MUTE)),
+            'avg_messages': total_messages // total_users if total_users > 0 else 0
+        }
+
+    def top(self, limit: int = 10) -> List[Dict]:
+        """Топ пользователей по количеству сообщений"""
+        return [self.users[user_id] for user_id, _ in self._by_messages.top(limit)]
+
+    # ============= ЗАПИСЬ =============
+
+    def touch(self, user_id: int, username: Optional[str] = None, count: int = 1) -> Dict:
+        """Зарегистрировать активность пользователя"""
+        now = datetime.now()
+        user = self.users.get(user_id)
+
+        if user is None:
+            user = {
+                'id': user_id,
+                'username': username or f"user_{user_id}",
+                'join_date': now,
+                'last_activity': now,
+                'message_count': 0,
+                'banned': False,
+                'ban_reason': None,
+                'banned_at': None,
+                'muted_until': None
+            }
+            self._index(user)
+        else:
+            user['last_activity'] = now
+            self._touch_activity(user_id)
+            if username and username != user['username']:
+                self._set_username(user, username)
+
+        user['message_count'] += count
+        self._by_messages.update(user_id, user['message_count'])
+        self.stats.add_messages(count)
+        self.stats.mark_active(user_id, now)
+        activity_buffer.add_user(user_id, user['username'], user['join_date'], now, count)
+        return user
+
+    def ban(self, user_id: int, reason: str):
+        """Забанить пользователя"""
+        user = self.users.get(user_id)
+        if not user:
+            return
+
+        user['banned'] = True
+        user['ban_reason'] = reason
+        user['banned_at'] = datetime.now()
+        self._banned.add(user_id)
+        self._schedule_save(user_id)
+
+    def unban(self, user_id: int):
+        """Разбанить пользователя"""
+        user = self.users.get(user_id)
+        if not user:
+            return
+
+        user['banned'] = False
+        user['ban_reason'] = None
+        user['banned_at'] = None
+        self._banned.discard(user_id)
+        self._schedule_save(user_id)
+
+    def mute(self, user_id: int, until: datetime):
+        """Замутить пользователя до until"""
+        user = self.users.get(user_id)
+        if not user:
+            return
+
+        user['muted_until'] = until
+        expiring_store.set(MUTE, user_id, expires_at=until.timestamp())
+        self._schedule_save(user_id)
+
+    def unmute(self, user_id: int):
+        """Снять мут"""
+        user = self.users.get(user_id)
+        if not user:
+            return
+
+        user['muted_until'] = None
+        expiring_store.delete(MUTE, user_id)
+        self._schedule_save(user_id)
+
+    async def _on_mute_expired(self, user_id: int, value):
+        """Срок мута истёк - снимаем его и сохраняем"""
+        user = self.users.get(user_id)
+        if user and user.get('muted_until'):
+            self.unmute(user_id)
+            logger.info(f"🔊 Mute expired for user {user_id}")
+
+    def remove(self, user_id: int) -> bool:
+        """Удалить пользователя (например, заблокировавшего бота)"""
+        if not self._unindex(user_id):
+            return False
+
+        self._schedule(self._delete_rows([user_id]))
+        return True
+
+    def remove_inactive(self, threshold: datetime) -> int:
+        """Удалить неактивных (и не забаненных) пользователей"""
+        to_remove = [
+            user['id'] for user in self.inactive_before(threshold)
+            if not user.get('banned')
+        ]
+
+        for user_id in to_remove:
+            self._unindex(user_id)
+
+        if to_remove:
+            self._schedule(self._delete_rows(to_remove))
+
+        return len(to_remove)
+
+    # ============= ПЕРСИСТЕНТНОСТЬ =============
+
+    @staticmethod
+    def _row_to_user(row) -> Dict:
+        """Преобразовать строку UserActivity в запись кэша"""
+        return {
+            'id': row.id,
+            'username': row.username or f"user_{row.id}",
+            'join_date': row.join_date or datetime.now(),
+            'last_activity': row.last_activity or datetime.now(),
+            'message_count': row.message_count or 0,
+            'banned': bool(row.banned),
+            'ban_reason': row.ban_reason,
+            'banned_at': row.banned_at,
+            'muted_until': row.muted_until
+        }
+
+    def _reorder_activity(self):
+        """Пересобрать индекс активности по last_activity"""
+        ordered = sorted(self.users.values(), key=lambda u: u['last_activity'])
+        self._by_activity = OrderedDict((user['id'], None) for user in ordered)
+
+    async def load(self) -> int:
+        """Загрузить всех пользователей из БД в кэш"""
+        if not db.session_maker:
+            logger.warning("Database not available, user store works in memory only")
+            return 0
+
+        try:
+            from models import UserActivity
+            from sqlalchemy import select
+
+            async with db.get_session() as session:
+                result = await session.execute(
+                    select(UserActivity).order_by(UserActivity.last_activity)
+                )
+                rows = result.scalars().all()
+
+            for row in rows:
+                # Не затираем пользователей, которые успели написать до загрузки
+                if row.id not in self.users:
+                    self._index(self._row_to_user(row))
+
+            self._reorder_activity()
+            self.loaded = True
+            logger.info(f"✅ User store loaded: {len(rows)} users")
+            return len(rows)
+
+        except Exception as e:
+            logger.error(f"Error loading user store: {e}")
+            return 0
+
+    def _schedule(self, coro):
+        """Запустить фоновую запись, если есть event loop"""
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return
+
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def _schedule_save(self, user_id: int):
+        """Запланировать сохранение пользователя"""
+        if db.session_maker:
+            self._schedule(self._save_rows([user_id]))
+
+    async def _save_rows(self, user_ids: List[int]):
+        """Сохранить поля модерации пользователей в БД (upsert)"""
+        rows = []
+        for user_id in user_ids:
+            user = self.users.get(user_id)
+            if user:
+                # message_count = 0: несохранённые сообщения досчитает activity_buffer
+                row = {
+                    'id': user_id,
+                    'username': user['username'],
+                    'join_date': user['join_date'],
+                    'last_activity': user['last_activity'],
+                    'message_count': 0
+                }
+                row.update({field: user[field] for field in MODERATION_FIELDS})
+                rows.append(row)
+
+        if not rows:
+            return
+
+        try:
+            from models import UserActivity
+
+            stmt = db.build_upsert(
+                UserActivity.__table__, rows,
+                index_elements=['id'],
+                update_columns=list(MODERATION_FIELDS)
+            )
+            async with db.get_session() as session:
+                await session.execute(stmt)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error saving users {user_ids}: {e}")
+
+    async def _delete_rows(self, user_ids: List[int]):
+        """Удалить пользователей из БД"""
+        if not db.session_maker:
+            return
+
+        try:
+            from models import UserActivity
+            from sqlalchemy import delete
+
+            async with db.get_session() as session:
+                await session.execute(
+                    delete(UserActivity).where(UserActivity.id.in_(user_ids))
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error deleting users: {e}")
+
+    async def flush(self):
+        """Дождаться завершения всех фоновых записей и сбросить счётчики"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+        await activity_buffer.flush()
+
+# Глобальный экземпляр хранилища
+user_store = UserStore()
+
+__all__ = ['UserStore', 'user_store']
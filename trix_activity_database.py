@@ -4,12 +4,21 @@ TrixActivity - Database Models для сохранения данных
 Интеграция с SQLAlchemy и PostgreSQL
 """
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, Float, Text
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, DateTime, Boolean, JSON, Float, Text, Index, CheckConstraint
+)
 from datetime import datetime
+from typing import Any, Dict, List, Optional
+import asyncio
 import json
+import logging
 
-Base = declarative_base()
+from config import Config
+
+# Единый реестр метаданных с остальными моделями бота
+from services.db import Base, db
+
+logger = logging.getLogger(__name__)
 
 # ============= DATABASE MODELS =============
 
@@ -18,7 +27,7 @@ class TrixUser(Base):
     __tablename__ = 'trix_users'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, unique=True, nullable=False, index=True)
+    user_id = Column(BigInteger, unique=True, nullable=False, index=True)
     username = Column(String(255), nullable=False)
     instagram = Column(String(255))
     threads = Column(String(255))
@@ -27,6 +36,8 @@ class TrixUser(Base):
     balance = Column(Integer, default=0)
     max_balance = Column(Integer, default=15)
     frozen_trixiki = Column(Integer, default=0)
+    # Снимок баланса: проводки журнала с seq <= ledger_seq уже учтены в balance/frozen_trixiki
+    ledger_seq = Column(BigInteger, default=0)
     
     # Статус
     enabled = Column(Boolean, default=True)
@@ -41,6 +52,12 @@ class TrixUser(Base):
     last_daily_claim = Column(DateTime)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    __table_args__ = (
+        # Верхней границы нет: выплаты за задания могут поднять баланс выше max_balance
+        CheckConstraint('balance >= 0', name='ck_trix_users_balance'),
+        CheckConstraint('frozen_trixiki >= 0', name='ck_trix_users_frozen'),
+    )
+    
     def __repr__(self):
         return f"<TrixUser {self.user_id} ({self.username})>"
 
@@ -50,7 +67,7 @@ class TrixTask(Base):
     
     id = Column(Integer, primary_key=True)
     task_id = Column(Integer, unique=True, nullable=False, index=True)
-    creator_id = Column(Integer, nullable=False, index=True)
+    creator_id = Column(BigInteger, nullable=False, index=True)
     
     # Тип и содержание
     task_type = Column(String(50), nullable=False)  # like, comment, follow
@@ -58,8 +75,8 @@ class TrixTask(Base):
     cost = Column(Integer, nullable=False)
     
     # Статус
-    status = Column(String(50), default='active', index=True)  # active, completed, disputed
-    performer_id = Column(Integer, index=True)
+    status = Column(String(50), default='active', index=True)  # active, completed, disputed, cancelled
+    performer_id = Column(BigInteger, index=True)
     
     # Даты
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -76,8 +93,8 @@ class TrixConfirmation(Base):
     
     id = Column(Integer, primary_key=True)
     task_id = Column(Integer, nullable=False, index=True)
-    creator_id = Column(Integer, nullable=False, index=True)
-    performer_id = Column(Integer, nullable=False, index=True)
+    creator_id = Column(BigInteger, nullable=False, index=True)
+    performer_id = Column(BigInteger, nullable=False, index=True)
     
     # Статус
     status = Column(String(50), default='pending')  # pending, approved, rejected, auto_confirmed
@@ -89,6 +106,10 @@ class TrixConfirmation(Base):
     confirmed_at = Column(DateTime)
     confirmed_by = Column(String(50))  # creator, auto, admin
     
+    __table_args__ = (
+        Index('ix_trix_confirmations_status_deadline', 'status', 'deadline'),
+    )
+    
     def __repr__(self):
         return f"<TrixConfirmation task_{self.task_id}>"
 
@@ -97,7 +118,7 @@ class TrixStats(Base):
     __tablename__ = 'trix_stats'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, unique=True, nullable=False, index=True)
+    user_id = Column(BigInteger, unique=True, nullable=False, index=True)
     
     # Счетчики
     tasks_created = Column(Integer, default=0)
@@ -121,12 +142,18 @@ class TrixStats(Base):
     def __repr__(self):
         return f"<TrixStats user_{self.user_id}>"
 
+# Счётчики trix_stats, которые можно увеличивать через increment_stat
+STAT_COLUMNS = (
+    'tasks_created', 'tasks_completed', 'tasks_disputed',
+    'trixiki_earned', 'trixiki_spent', 'daily_claims'
+)
+
 class TrixSubscription(Base):
     """Запросы проверки подписок"""
     __tablename__ = 'trix_subscriptions'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(BigInteger, nullable=False, index=True)
     
     # Статус
     status = Column(String(50), default='pending')  # pending, approved, rejected
@@ -134,11 +161,26 @@ class TrixSubscription(Base):
     # Даты
     created_at = Column(DateTime, default=datetime.utcnow)
     approved_at = Column(DateTime)
-    approved_by = Column(Integer)
+    approved_by = Column(BigInteger)
     
     def __repr__(self):
         return f"<TrixSubscription user_{self.user_id}>"
 
+class TrixLedgerEntry(Base):
+    """Проводка журнала триксиков (только добавление)"""
+    __tablename__ = 'trix_ledger'
+    
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    user_id = Column(BigInteger, nullable=False, index=True)
+    kind = Column(String(20), nullable=False)  # daily_claim, task_create, freeze, payout, ...
+    amount = Column(Integer, default=0)  # изменение баланса
+    frozen = Column(Integer, default=0)  # изменение замороженных
+    task_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False)  # локальное время сервера, как last_daily_claim
+    
+    def __repr__(self):
+        return f"<TrixLedgerEntry {self.seq} {self.kind} user_{self.user_id}>"
+
 # ============= DATABASE SERVICE =============
 
 class TrixActivityDatabase:
@@ -166,20 +208,28 @@ class TrixActivityDatabase:
             )
             return result.scalar_one_or_none()
     
-    async def update_user_balance(self, user_id: int, amount: int):
-        """Обновить баланс"""
+    async def update_user_balance(self, user_id: int, amount: int) -> Optional[int]:
+        """Изменить баланс одним UPDATE (в пределах 0..max_balance), вернуть новый баланс"""
         async with self.session_maker() as session:
-            from sqlalchemy import select, update
+            from sqlalchemy import update, case
             
-            user = await session.execute(
-                select(TrixUser).where(TrixUser.user_id == user_id)
+            new_balance = TrixUser.balance + amount
+            result = await session.execute(
+                update(TrixUser)
+                .where(TrixUser.user_id == user_id)
+                .values(
+                    balance=case(
+                        (new_balance > TrixUser.max_balance, TrixUser.max_balance),
+                        (new_balance < 0, 0),
+                        else_=new_balance
+                    ),
+                    updated_at=datetime.utcnow()
+                )
+                .returning(TrixUser.balance)
             )
-            user = user.scalar_one_or_none()
-            
-            if user:
-                user.balance = max(0, min(user.balance + amount, user.max_balance))
-                user.updated_at = datetime.utcnow()
-                await session.commit()
+            balance = result.scalar_one_or_none()
+            await session.commit()
+            return balance
     
     async def update_user_socials(self, user_id: int, instagram: str, threads: str):
         """Обновить социальные аккаунты"""
@@ -295,21 +345,18 @@ class TrixActivityDatabase:
             )
             return result.scalars().all()
     
-    async def confirm_task(self, task_id: int, status: str, confirmed_by: str):
-        """Подтвердить задание"""
+    async def confirm_task(self, task_id: int, status: str, confirmed_by: str) -> bool:
+        """Подтвердить задание одним UPDATE; False - подтверждение уже закрыто или его нет"""
         async with self.session_maker() as session:
-            from sqlalchemy import select
+            from sqlalchemy import update
             
-            conf = await session.execute(
-                select(TrixConfirmation).where(TrixConfirmation.task_id == task_id)
+            result = await session.execute(
+                update(TrixConfirmation)
+                .where(TrixConfirmation.task_id == task_id, TrixConfirmation.status == 'pending')
+                .values(status=status, confirmed_at=datetime.utcnow(), confirmed_by=confirmed_by)
             )
-            conf = conf.scalar_one_or_none()
-            
-            if conf:
-                conf.status = status
-                conf.confirmed_at = datetime.utcnow()
-                conf.confirmed_by = confirmed_by
-                await session.commit()
+            await session.commit()
+            return result.rowcount > 0
     
     # ============= STATS OPERATIONS =============
     
@@ -334,23 +381,19 @@ class TrixActivityDatabase:
             return result.scalar_one_or_none()
     
     async def increment_stat(self, user_id: int, stat_name: str, amount: int = 1):
-        """Увеличить статистику"""
+        """Увеличить статистику (upsert со сложением на стороне БД)"""
+        if stat_name not in STAT_COLUMNS:
+            return
+        
         async with self.session_maker() as session:
-            from sqlalchemy import select
-            
-            stats = await session.execute(
-                select(TrixStats).where(TrixStats.user_id == user_id)
-            )
-            stats = stats.scalar_one_or_none()
-            
-            if not stats:
-                stats = TrixStats(user_id=user_id)
-                session.add(stats)
-            
-            # Увеличиваем нужную статистику
-            if hasattr(stats, stat_name):
-                setattr(stats, stat_name, getattr(stats, stat_name, 0) + amount)
-            
+            now = datetime.utcnow()
+            await session.execute(db.build_upsert(
+                TrixStats.__table__,
+                [{'user_id': user_id, stat_name: amount, 'created_at': now, 'updated_at': now}],
+                index_elements=['user_id'],
+                update_columns=['updated_at'],
+                increment_columns=[stat_name]
+            ))
             await session.commit()
     
     # ============= SUBSCRIPTION OPERATIONS =============
@@ -400,6 +443,329 @@ class TrixActivityDatabase:
                     user.max_balance = 20
                     await session.commit()
 
+# ============= ЖУРНАЛ ТРИКСИКОВ =============
+
+# Виды проводок
+DAILY_CLAIM = 'daily_claim'
+TASK_CREATE = 'task_create'
+FREEZE = 'freeze'
+PAYOUT = 'payout'
+UNFREEZE = 'unfreeze'
+ADMIN_GRANT = 'admin_grant'
+REFUND = 'refund'
+ADJUST = 'adjust'
+
+# Колонки профиля - перезаписываются при каждом сохранении аккаунта
+PROFILE_COLUMNS = [
+    'username', 'instagram', 'threads', 'max_balance', 'enabled',
+    'active_like', 'active_comment', 'active_follow', 'updated_at'
+]
+# Колонки снимка баланса
+SNAPSHOT_COLUMNS = ['balance', 'frozen_trixiki', 'last_daily_claim', 'ledger_seq']
+TASK_COLUMNS = ['status', 'performer_id', 'performed_at', 'confirmation_deadline', 'completed_at']
+
+# Строк в одном INSERT (лимит переменных SQLite)
+INSERT_CHUNK = 500
+
+class TrixLedger:
+    """Журнал проводок триксиков с group commit и снимками балансов
+    
+    Проводки, профили, задания и подтверждения копятся в памяти и пишутся одной
+    транзакцией раз в commit_delay секунд. Каждые snapshot_every проводок в ту же
+    транзакцию попадают балансы изменившихся аккаунтов - при старте проигрывается только хвост.
+    """
+    
+    def __init__(self, session_maker, commit_delay: float = None, snapshot_every: int = None):
+        self.session_maker = session_maker
+        self.commit_delay = Config.TRIX_LEDGER_COMMIT_DELAY if commit_delay is None else commit_delay
+        self.snapshot_every = snapshot_every or Config.TRIX_SNAPSHOT_EVERY
+        self.next_seq = 1
+        
+        # Ещё не записанное
+        self._entries: List[Dict[str, Any]] = []
+        self._profiles: Dict[int, Any] = {}   # user_id -> аккаунт
+        self._balances: Dict[int, Any] = {}   # user_id -> аккаунт, изменившийся после снимка
+        self._tasks: Dict[int, Any] = {}      # task_id -> задание
+        self._confirmations: List[tuple] = []  # ('create', row) / ('resolve', task_id, status, by, at)
+        self._since_snapshot = 0
+        self._snapshot_due = False
+        self._writer: Optional[asyncio.Task] = None
+        
+        self.entries_written = 0
+        self.commits = 0
+        self.snapshots = 0
+        self.failed_commits = 0
+    
+    # ============= НАКОПЛЕНИЕ (синхронно, в памяти) =============
+    
+    def append(self, account, kind: str, amount: int = 0, frozen: int = 0,
+               task_id: int = None, at: datetime = None) -> int:
+        """Добавить проводку, вернуть её seq"""
+        seq = self.next_seq
+        self.next_seq += 1
+        self._entries.append({
+            'seq': seq,
+            'user_id': account.user_id,
+            'kind': kind,
+            'amount': amount,
+            'frozen': frozen,
+            'task_id': task_id,
+            'created_at': at or datetime.now()
+        })
+        self._balances[account.user_id] = account
+        
+        self._since_snapshot += 1
+        if self._since_snapshot >= self.snapshot_every:
+            self._snapshot_due = True
+        self._wake()
+        return seq
+    
+    def save_account(self, account):
+        """Сохранить профиль аккаунта (соцсети, лимит, функции)"""
+        self._profiles[account.user_id] = account
+        self._wake()
+    
+    def save_task(self, task):
+        """Сохранить текущее состояние задания"""
+        self._tasks[task.task_id] = task
+        self._wake()
+    
+    def create_confirmation(self, task, deadline: datetime):
+        """Записать ожидающее подтверждение задания"""
+        self._confirmations.append(('create', {
+            'task_id': task.task_id,
+            'creator_id': task.creator_id,
+            'performer_id': task.performer_id,
+            'amount': task.cost,
+            'status': 'pending',
+            'created_at': datetime.now(),
+            'deadline': deadline
+        }))
+        self._wake()
+    
+    def resolve_confirmation(self, task_id: int, status: str, confirmed_by: str):
+        """Закрыть ожидающее подтверждение (approved, rejected, auto_confirmed)"""
+        self._confirmations.append(('resolve', task_id, status, confirmed_by, datetime.now()))
+        self._wake()
+    
+    def request_snapshot(self):
+        """Снять балансы изменившихся аккаунтов при следующей записи"""
+        self._snapshot_due = True
+        self._wake()
+    
+    def _has_pending(self) -> bool:
+        return bool(
+            self._entries or self._profiles or self._tasks or self._confirmations
+            or (self._snapshot_due and self._balances)
+        )
+    
+    def _wake(self):
+        """Запустить запись, если она не идёт"""
+        if self._writer is None or self._writer.done():
+            try:
+                self._writer = asyncio.get_running_loop().create_task(self._write())
+            except RuntimeError:
+                pass  # нет event loop - запишется при следующем изменении или commit()
+    
+    # ============= ЗАПИСЬ =============
+    
+    @staticmethod
+    def _account_row(account, snapshot: bool) -> Dict[str, Any]:
+        """Строка trix_users; без snapshot баланс нулевой (для вставки - проигрываются все проводки)"""
+        return {
+            'user_id': account.user_id,
+            'username': account.username or str(account.user_id),
+            'instagram': account.instagram,
+            'threads': account.threads,
+            'max_balance': account.max_balance,
+            'enabled': account.enabled,
+            'active_like': account.active_functions.get('like', True),
+            'active_comment': account.active_functions.get('comment', True),
+            'active_follow': account.active_functions.get('follow', True),
+            'updated_at': datetime.utcnow(),
+            'balance': account.balance if snapshot else 0,
+            'frozen_trixiki': account.frozen_trixiki if snapshot else 0,
+            'last_daily_claim': account.last_daily_claim if snapshot else None,
+            'ledger_seq': account.ledger_seq if snapshot else 0
+        }
+    
+    @staticmethod
+    def _task_row(task) -> Dict[str, Any]:
+        return {
+            'task_id': task.task_id,
+            'creator_id': task.creator_id,
+            'task_type': task.task_type,
+            'content': task.content,
+            'cost': task.cost,
+            'status': task.status,
+            'performer_id': task.performer_id,
+            'created_at': task.created_at,
+            'performed_at': task.performed_at,
+            'confirmation_deadline': task.confirmation_deadline,
+            'completed_at': task.completed_at
+        }
+    
+    def _take(self) -> Dict[str, Any]:
+        """Забрать накопленное; строки снимаются сейчас, пока состояние согласовано с журналом"""
+        batch = {
+            'entries': self._entries,
+            'profiles': self._profiles,
+            'tasks': self._tasks,
+            'confirmations': self._confirmations,
+            'balances': {}
+        }
+        batch['profile_rows'] = [self._account_row(a, snapshot=False) for a in self._profiles.values()]
+        batch['task_rows'] = [self._task_row(t) for t in self._tasks.values()]
+        
+        if self._snapshot_due and self._balances:
+            batch['balances'] = self._balances
+            self._balances = {}
+            self._since_snapshot = 0
+        self._snapshot_due = False
+        batch['snapshot_rows'] = [self._account_row(a, snapshot=True) for a in batch['balances'].values()]
+        
+        self._entries, self._profiles, self._tasks, self._confirmations = [], {}, {}, []
+        return batch
+    
+    def _restore(self, batch: Dict[str, Any]):
+        """Вернуть несохранённое в очередь (более новые изменения остаются поверх)"""
+        self._entries = batch['entries'] + self._entries
+        self._confirmations = batch['confirmations'] + self._confirmations
+        for user_id, account in batch['profiles'].items():
+            self._profiles.setdefault(user_id, account)
+        for task_id, task in batch['tasks'].items():
+            self._tasks.setdefault(task_id, task)
+        if batch['balances']:
+            for user_id, account in batch['balances'].items():
+                self._balances.setdefault(user_id, account)
+            self._snapshot_due = True
+    
+    async def _commit(self, batch: Dict[str, Any]):
+        """Записать пачку одной транзакцией"""
+        from sqlalchemy import update
+        
+        users = TrixUser.__table__
+        async with self.session_maker() as session:
+            for i in range(0, len(batch['profile_rows']), INSERT_CHUNK):
+                await session.execute(db.build_upsert(
+                    users, batch['profile_rows'][i:i + INSERT_CHUNK],
+                    index_elements=['user_id'], update_columns=PROFILE_COLUMNS
+                ))
+            for i in range(0, len(batch['snapshot_rows']), INSERT_CHUNK):
+                await session.execute(db.build_upsert(
+                    users, batch['snapshot_rows'][i:i + INSERT_CHUNK],
+                    index_elements=['user_id'], update_columns=SNAPSHOT_COLUMNS
+                ))
+            
+            if batch['entries']:
+                await session.execute(TrixLedgerEntry.__table__.insert(), batch['entries'])
+            
+            for i in range(0, len(batch['task_rows']), INSERT_CHUNK):
+                await session.execute(db.build_upsert(
+                    TrixTask.__table__, batch['task_rows'][i:i + INSERT_CHUNK],
+                    index_elements=['task_id'], update_columns=TASK_COLUMNS
+                ))
+            
+            creates = [op[1] for op in batch['confirmations'] if op[0] == 'create']
+            if creates:
+                await session.execute(TrixConfirmation.__table__.insert(), creates)
+            for op in batch['confirmations']:
+                if op[0] != 'resolve':
+                    continue
+                _, task_id, status, confirmed_by, confirmed_at = op
+                await session.execute(
+                    update(TrixConfirmation)
+                    .where(TrixConfirmation.task_id == task_id, TrixConfirmation.status == 'pending')
+                    .values(status=status, confirmed_by=confirmed_by, confirmed_at=confirmed_at)
+                )
+            
+            await session.commit()
+    
+    async def _write(self) -> bool:
+        """Писать пачками, пока есть изменения; False - запись не удалась"""
+        while self._has_pending():
+            if self.commit_delay:
+                # Окно group commit: проводки за это время уйдут одной транзакцией
+                await asyncio.sleep(self.commit_delay)
+            
+            batch = self._take()
+            try:
+                await self._commit(batch)
+            except Exception as e:
+                self.failed_commits += 1
+                logger.error(f"Error committing trixiki ledger ({len(batch['entries'])} entries): {e}")
+                self._restore(batch)
+                return False
+            
+            self.commits += 1
+            self.entries_written += len(batch['entries'])
+            if batch['snapshot_rows']:
+                self.snapshots += 1
+                logger.debug(f"Trixiki snapshot: {len(batch['snapshot_rows'])} accounts")
+        return True
+    
+    async def commit(self) -> bool:
+        """Дождаться записи всего накопленного"""
+        while True:
+            if self._writer is None or self._writer.done():
+                if not self._has_pending():
+                    return True
+                self._writer = asyncio.get_running_loop().create_task(self._write())
+            if not await self._writer:
+                return False
+    
+    async def close(self) -> bool:
+        """Снять все балансы и дописать журнал (при остановке бота)"""
+        self._snapshot_due = True
+        return await self.commit()
+    
+    # ============= ЗАГРУЗКА =============
+    
+    async def fetch_state(self) -> Dict[str, Any]:
+        """Снимки аккаунтов, хвост журнала после них, незавершённые задания и подтверждения"""
+        from sqlalchemy import select, func
+        
+        async with self.session_maker() as session:
+            users = (await session.execute(select(TrixUser))).scalars().all()
+            
+            # Для каждой проводки - только если она новее снимка своего аккаунта
+            tail = (await session.execute(
+                select(TrixLedgerEntry)
+                .outerjoin(TrixUser, TrixUser.user_id == TrixLedgerEntry.user_id)
+                .where(TrixLedgerEntry.seq > func.coalesce(TrixUser.ledger_seq, 0))
+                .order_by(TrixLedgerEntry.seq)
+            )).scalars().all()
+            
+            max_seq = (await session.execute(select(func.max(TrixLedgerEntry.seq)))).scalar() or 0
+            max_task_id = (await session.execute(select(func.max(TrixTask.task_id)))).scalar() or 0
+            
+            tasks = (await session.execute(
+                select(TrixTask).where(TrixTask.status.in_(('active', 'disputed')))
+                .order_by(TrixTask.task_id)
+            )).scalars().all()
+            confirmations = (await session.execute(
+                select(TrixConfirmation).where(TrixConfirmation.status == 'pending')
+            )).scalars().all()
+        
+        self.next_seq = max([max_seq] + [u.ledger_seq or 0 for u in users]) + 1
+        return {
+            'users': users,
+            'tail': tail,
+            'tasks': tasks,
+            'confirmations': confirmations,
+            'max_task_id': max_task_id
+        }
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        return {
+            'next_seq': self.next_seq,
+            'pending_entries': len(self._entries),
+            'entries_written': self.entries_written,
+            'commits': self.commits,
+            'snapshots': self.snapshots,
+            'failed_commits': self.failed_commits
+        }
+
 # Экспорт
 __all__ = [
     'Base',
@@ -408,5 +774,7 @@ __all__ = [
     'TrixConfirmation',
     'TrixStats',
     'TrixSubscription',
-    'TrixActivityDatabase'
+    'TrixLedgerEntry',
+    'TrixActivityDatabase',
+    'TrixLedger'
 ]
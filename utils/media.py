@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Отправка медиа альбомами (send_media_group) вместо отдельного запроса на каждый файл
+"""
+import logging
+from typing import List, Optional
+
+from telegram import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает в альбоме от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument
+}
+
+def split_media_groups(media: list) -> List[List[dict]]:
+    """Разбить медиа на альбомы по 10: фото/видео отдельно от документов"""
+    visual = []
+    documents = []
+
+    for i, item in enumerate(media or []):
+        if not item or not isinstance(item, dict):
+            logger.warning(f"Invalid media item {i}: {item}")
+            continue
+        if not item.get('file_id') or item.get('type') not in INPUT_MEDIA:
+            logger.warning(f"Missing file_id or type in media item {i}: {item}")
+            continue
+
+        (documents if item['type'] == 'document' else visual).append(item)
+
+    groups = []
+    for items in (visual, documents):
+        groups.extend(items[i:i + MEDIA_GROUP_LIMIT] for i in range(0, len(items), MEDIA_GROUP_LIMIT))
+    return groups
+
+async def _send_single(bot, chat_id: int, item: dict, caption: Optional[str]):
+    """Отправить один файл"""
+    if item['type'] == 'photo':
+        return await bot.send_photo(chat_id=chat_id, photo=item['file_id'], caption=caption)
+    if item['type'] == 'video':
+        return await bot.send_video(chat_id=chat_id, video=item['file_id'], caption=caption)
+    return await bot.send_document(chat_id=chat_id, document=item['file_id'], caption=caption)
+
+async def send_media_groups(bot, chat_id: int, media: list, caption: Optional[str] = None) -> List[int]:
+    """Отправить медиа альбомами, подпись - у первого файла. Возвращает ID сообщений"""
+    message_ids = []
+
+    for group in split_media_groups(media):
+        try:
+            if len(group) == 1:
+                msg = await _send_single(bot, chat_id, group[0], caption)
+                message_ids.append(msg.message_id)
+            else:
+                album = [
+                    INPUT_MEDIA[item['type']](item['file_id'], caption=caption if i == 0 else None)
+                    for i, item in enumerate(group)
+                ]
+                messages = await bot.send_media_group(chat_id=chat_id, media=album)
+                message_ids.extend(msg.message_id for msg in messages)
+            caption = None
+
+        except Exception as e:
+            # Один битый файл ломает весь альбом - досылаем по одному
+            logger.warning(f"Media group failed in {chat_id}, sending one by one: {e}")
+            for item in group:
+                try:
+                    msg = await _send_single(bot, chat_id, item, caption)
+                    message_ids.append(msg.message_id)
+                    caption = None
+                except Exception as item_error:
+                    logger.error(f"Error sending media to {chat_id}: {item_error}")
+
+    return message_ids